@@ -0,0 +1,87 @@
+"""
+:Copyright: |copy| 2008 by Adrian Hare and Kenneth Barber.
+
+.. |copy| unicode:: 0xA9 .. copyright sign
+
+:license: 
+    This file is part of OWLSugar.
+
+    OWLSugar is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    OWLSugar is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+:Version: $Rev$
+
+Benchmark of association get/set throughput.
+
+Compares attribute access through the association descriptors with the 
+association() method, and with the previous association() implementation that
+looked up the model configuration on every call.
+
+Run with:
+
+    python bench_associations.py [iterations]
+
+"""
+
+__docformat__ = 'restructuredtext en'
+__version__ = '$Rev$'
+
+import sys
+import timeit
+
+from owlsugar.universe import OwlUniverse
+from owlsugar.constructs import *
+from owlsugar.constructs import _model
+
+
+def legacy_association(obj, name, value=None):
+    """The association() path as it was before descriptors: a model lookup 
+    and configuration copy on every call.
+    
+    """
+    conf = _model.association_attr(obj.id(), name)
+    slot = "_data_%s" % name
+    if value is not None:
+        if ('maxCardinality' in conf) and (conf['maxCardinality'] == '1'):
+            setattr(obj, slot, value)
+            if hasattr(value, 'add_reference'):
+                value.add_reference(name, obj)
+    return getattr(obj, slot)
+
+
+def main(iterations):
+    universe = OwlUniverse()
+    uri = URI(uri="#foot")
+    decl = Declaration(entity=Individual(entityURI=uri))
+
+    tests = [
+        ("get: attribute", "decl.entity"),
+        ("get: association()", "decl.association('entity')"),
+        ("get: legacy association()", "legacy_association(decl, 'entity')"),
+        ("set: attribute", "uri.uri = '#shin'"),
+        ("set: association()", "uri.association('uri', '#shin')"),
+        ("set: legacy association()", 
+            "legacy_association(uri, 'uri', '#shin')"),
+        ]
+    context = {'decl': decl, 'uri': uri, 
+        'legacy_association': legacy_association}
+
+    for name, test in tests:
+        # Take the best of a few runs
+        best = min(timeit.repeat(test, number=iterations, repeat=3, 
+            globals=context))
+        print("%-28s %12.0f ops/sec" % (name, iterations / best))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(200000)
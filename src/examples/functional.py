@@ -4,8 +4,7 @@ from owlsugar.constructs import *
 # First initialise the universe
 universe = OwlUniverse() 
 
-a = Namespace()
-a.newinit("foo", "<http://bob.sh/#>")
+a = Namespace("foo", "<http://bob.sh/#>")
 
 # Test Structure
 ont = Ontology(
@@ -24,14 +23,14 @@ ont = Ontology(
         ])
 
 # Extract information from elements defined above
-print "Axiom:", ont.axioms()
-print "Annotations:", ont.annotations()
-print "All classes:", universe.get_classes()
-print "Ontology class:", universe.get_class("Ontology")
-print "Ontology objects:", universe.get_objects("Ontology")
-print "Declaration objects:", universe.get_objects("Declaration")
-print "Individual objects:", universe.get_objects("Individual")
-print "URI objects:", universe.get_objects("URI")
-print "Annotation objects:", universe.get_objects("Annotation")
-print "Annotation URI's:", [i.annotationURI().uri() for i in universe.get_objects("Annotation")]
-print "Namespace:", [i.IRI() for i in universe.get_objects("Namespace")]
+print("Axiom:", ont.axioms)
+print("Annotations:", ont.annotations)
+print("All classes:", universe.get_classes())
+print("Ontology class:", universe.get_class("Ontology"))
+print("Ontology objects:", universe.get_objects("Ontology"))
+print("Declaration objects:", universe.get_objects("Declaration"))
+print("Individual objects:", universe.get_objects("Individual"))
+print("URI objects:", universe.get_objects("URI"))
+print("Annotation objects:", universe.get_objects("Annotation"))
+print("Annotation URI's:", [i.annotationURI.uri for i in universe.get_objects("Annotation")])
+print("Namespace:", [i.IRI for i in universe.get_objects("Namespace")])
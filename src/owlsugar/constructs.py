@@ -24,14 +24,28 @@ __docformat__ = 'restructuredtext en'
 __version__ = '$Rev$'
 
 
-from owlsugar.universe import OwlUniverse
-from owlsugar.types import ValidatedList
+import os
+import threading
+
+from owlsugar.universe import OwlUniverse, SET
+from owlsugar.types import ValidatedList, UniqueList, ReferenceView, \
+    Deferred
 from owlsugar.model import ModelConfig
+from owlsugar.exceptions import SchemaException
 
 # TODO: We need a better way to specify these file locations
+_conf = os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+    os.pardir, os.pardir, 'conf')
+
+# Compiled models are cached here so short-lived processes can skip the XML
+# parsing and schema validation on import. Set OWLSUGAR_CACHE to an empty
+# string to disable the cache.
+_cache = os.environ.get('OWLSUGAR_CACHE', 
+    os.path.join(os.path.expanduser('~'), '.cache', 'owlsugar')) or None
+
 # Grab the model configuration
-_model = ModelConfig("/home/ken/Development/eclipse-workspace/owlsugar-library/conf/owl11.xml",
-        schema="/home/ken/Development/eclipse-workspace/owlsugar-library/conf/ObjectModel.xsd")
+_model = ModelConfig(os.path.join(_conf, 'owl11.xml'),
+        schema=os.path.join(_conf, 'ObjectModel.xsd'), cache=_cache)
 
 
 #------------------------------------------------------------ Construct Classes
@@ -40,30 +54,39 @@ _model = ModelConfig("/home/ken/Development/eclipse-workspace/owlsugar-library/c
 class ClassConstruct(object):
     """This class represents an OWL class construct or function.
     
+    Generated classes use __slots__ - association values are stored directly
+    in a slot per association (see AssociationConstruct.slot()), and instances
+    have no __dict__.
+    
     """
+    __slots__ = ('_universe', '_references', '__weakref__')
+
     def __init__(self, *oargs, **nargs):
         """Initialise an OWL function.
         
-            args: an argument list for auto-populating associations upon creation
-                of an object.
+        Concrete generated classes replace this with a specialised __init__ 
+        (see _make_init) that also accepts positional arguments. This generic
+        version only supports named arguments.
+        
+            nargs: named arguments for auto-populating associations upon 
+                creation of an object.
         
         """
         # Some helper variables to make typing easier
         self._universe = OwlUniverse.get_universe()
         
         # If we are an abstract - then throw an exception
-        if self.is_abstract() is True:
+        if self._abstract is True:
             raise Exception("Cannot instantiate an abstract class")
         
-        # Prepare data stores
-        self._references = dict()
-        self._data = dict()
-        for attr in self.associations():
-            self._data[attr.id()] = None
-            setattr(self, attr.id(), attr(self))
+        # Prepare data stores. References are only allocated when the first
+        # one is added.
+        self._references = None
+        for attr in self._associations:
+            setattr(self, attr.slot(), None)
         
         # For each named argument, run its method
-        for k,v in nargs.iteritems():
+        for k,v in nargs.items():
             self.association(k, v)
     
         # TODO: We should be mandating that objects are instantiated with
@@ -72,64 +95,36 @@ class ClassConstruct(object):
     
         # And register the instance in the universe
         self._universe.add_object(self)
+    
+    def __reduce__(self):
+        """Pickle support.
         
-    def newinit(self, *oargs):
-        # Testing new ordered args functionality - I've forked this from the
-        # main __init__ for dev purposes.
+        Only the association values are pickled. The universe and the reverse
+        references are not, so an unpickled object is detached - it belongs 
+        to no universe until it is adopted with OwlUniverse.merge().
         
-        # This allows you to type:
+        """
+        state = dict()
+        for assoc in self._associations:
+            value = assoc.__get__(self)
+            if isinstance(value, list):
+                state[assoc.id()] = list(value)
+            elif value is not None:
+                state[assoc.id()] = value
+        return (_restore, (self.__class__, ), state)
+    
+    def __setstate__(self, state):
+        """Restore a detached object from its pickled association values.
         
-        #     Namespace("foo", "<http://bob.sh/#>")
-         
-        # instead of using the named arguments.
-        num_args = len(oargs)
-            
-        # TODO: need max associations #
-        max_ass = 2
+        The values are stored as they are, lists included, and nothing is 
+        wired up. OwlUniverse.merge() does that.
         
-        # TODO: need min associations #
-        min_ass = 1
-
-        # Start with a basic arity check
-        if num_args == max_ass:
-            # Easy ... we just set each association in order with the input 
-            # argument list.
-            
-            # TODO: Get full list of associations (in order).
-            # TODO: Iterate across each association and apply them (in order)
-            # for n, attr in association_list:
-            #     self.associations(attr, oargs[n])
-            self.associations('prefix', oargs[0])
-            self.associations('IRI', oargs[1])
-        elif num_args >= min_ass:
-            # This means some of the optional associations are not included.
-            # Now - we need to work out which ones are missing.
-            
-            # TODO: Get full list of associations (in order).
-            # TODO: Need to get type checking working for the next thing to work.
-            # TODO: Iterate across each association and apply them (in order): 
-            # for n, attr in association_list:
-            #     self.associations(attr, oargs[n])            
-            #     if we get a type exception:
-            #         if the association is optional, skip this association but keep
-            #            the list index the same.
-            #         if the association is not optional ... then bail - this is 
-            #            just a normal invalid type, and not a consequence of
-            #            a missing optional argument.
-            # TODO: Have a neat way of working out weither an association is
-            #    optional.
-
-            pass
-        elif num_args < min_ass:
-            # Not enough mandatory arguments provided - throw an error.
-            raise Exception("We require %s arguments minimum but there are "
-                "only %s provided." % (min_ass, num_args))
-        elif num_args > max_ass:
-            # Too many arguments have been provided.
-            raise Exception("Too many arguments (%s) provided. Maximum number "
-                "of arguments is %s" % (num_args, max_ass))
+        """
+        self._universe = None
+        self._references = None
+        for assoc in self._associations:
+            setattr(self, assoc.slot(), state.get(assoc.id()))
         
-    
     #------------------------------- Class Methods/Attributes for Introspection
 
 
@@ -150,320 +145,1060 @@ class ClassConstruct(object):
         """Tests to see if this class is abstract.
         
         """
-        try:
-            if _model.class_attr(cls.id())['abstract'] == "true":
-                return True
-            else:
-                return False
-        except KeyError:
-            return False
+        return cls._abstract
+
+    _abstract = False #: Is the class abstract?
 
     @classmethod
     def associations(cls, filter="", optional=True):
-        """Return a list of association objects for this class.
+        """Return the association objects for this class.
+        
+            Returns: a tuple of AssociationConstruct objects, in model order
         
         """
         #TODO: Actually make the arguments work
-        associations = list()
-        for i in _model.associations(cls.id()):
-            associations.append(getattr(cls, i))
-            
-        return associations
+        return cls._associations
+
+    _associations = () #: The association objects, including inherited ones
         
     @classmethod
     def ref_classes(cls):
-        """Return a list of classes that may reference this class.
+        """Return the classes that may reference this class.
+        
+            Returns: a tuple of classes
         
         """
-        universe = OwlUniverse.get_universe()
-        refs = list()
-        for i in _model.references(cls.id()):
-            refs.append(universe.get_class(i))
-            
+        refs = cls.__dict__.get('_ref_classes')
+        if refs is None:
+            # Resolved on first use - the referencing classes may not have 
+            # been generated yet.
+            refs = tuple([_get_class(i) for i in cls._ref_ids])
+            cls._ref_classes = refs
         return refs
+
+    _ref_ids = () #: Names of the classes that may reference this class
     
     @classmethod
     def child_classes(cls):
-        """Return a list of child classes.
+        """Return the child classes, including indirect children.
+        
+            Returns: a tuple of classes
         
         """
+        children = cls.__dict__.get('_child_classes')
+        if children is None:
+            # Resolved on first use - the children may not have been 
+            # generated yet.
+            children = tuple([_get_class(i) for i in cls._child_ids])
+            cls._child_classes = children
+        return children
+
+    _child_ids = () #: Names of the child classes
+
+    _primary = None #: The primary AssociationConstruct, if there is one
+
+    _arity = {0: ()} #: Associations assigned per number of positional args
+
+    #------------------------------------------------------------ Bulk Creation
+
+
+    @classmethod
+    def bulk(cls, rows):
+        """Create many objects of this class in one batch.
+        
+        Each row is either a tuple of positional arguments or a dictionary of
+        named arguments, exactly as they would be given to the constructor:
+        
+        .. python::
+        
+            uris = URI.bulk([("#foot", ), ("#shin", )])
+            individuals = Individual.bulk([(i, ) for i in uris])
+            declarations = Declaration.bulk([{'entity': i} 
+                for i in individuals])
+        
+        The universe is looked up once, reverse references are wired per 
+        referenced object rather than per row, and all of the new objects are
+        registered with the universe in one step.
+        
+            rows: an iterable of tuples or dictionaries
+            Returns: a list of new objects
+        
+        """
+        # Classes that are not generated from the model (eg. Label) have 
+        # their own constructors, so just use them.
+        if '_associations' not in cls.__dict__:
+            with OwlUniverse.get_universe().batch_events():
+                return [cls(**row) if isinstance(row, dict) else cls(*row) 
+                    for row in rows]
+
+        if cls._abstract is True:
+            raise Exception("Cannot instantiate an abstract class")
+
         universe = OwlUniverse.get_universe()
-        children = list()
-        for i in _model.class_children(cls.id()):
-            children.append(universe.get_class(i))
+        slots = [i.slot() for i in cls._associations]
+        intern = universe._intern if cls._internable else None
+        
+        objects = list()
+        built = list() #: (new object, (referenced object, association)s)
+        fresh = dict() #: intern key to the object this call built for it
+        for row in rows:
+            # Interned objects that already exist are reused as they are
+            key = None
+            if intern is not None:
+                if isinstance(row, dict):
+                    key = _intern_key(cls, (), row)
+                else:
+                    key = _intern_key(cls, row, {})
+                if key is not None:
+                    existing = fresh.get(key)
+                    if existing is None:
+                        with universe._lock(cls):
+                            existing = intern.get(key)
+                    if existing is not None:
+                        objects.append(existing)
+                        continue
             
-        return children
+            obj = object.__new__(cls)
+            obj._universe = universe
+            obj._references = None
+            for slot in slots:
+                setattr(obj, slot, None)
+            
+            if isinstance(row, dict):
+                items = [(getattr(cls, k), v) for k, v in row.items()]
+            else:
+                try:
+                    items = zip(cls._arity[len(row)], row)
+                except KeyError:
+                    raise SchemaException("%s cannot take %s positional "
+                        "arguments" % (cls.id(), len(row)))
+            
+            referenced = list()
+            for assoc, value in items:
+                value = assoc._validate(obj, value)
+                setattr(obj, assoc.slot(), value)
+                if (assoc.max_cardinality() == 1 and 
+                    isinstance(value, ClassConstruct)):
+                    referenced.append((value, assoc.id()))
+            
+            if key is not None:
+                fresh[key] = obj
+            built.append((obj, referenced))
+            objects.append(obj)
+        
+        # New interned objects are only published once every row is built, so
+        # a failure leaves nothing behind. Equal objects that another thread 
+        # published meanwhile win over ours.
+        if fresh:
+            lost = dict()
+            with universe._lock(cls):
+                for key, obj in fresh.items():
+                    existing = intern.setdefault(key, obj)
+                    if existing is not obj:
+                        lost[id(obj)] = existing
+            if lost:
+                objects = [lost.get(id(i), i) for i in objects]
+                built = [i for i in built if id(i[0]) not in lost]
+        
+        created = [i[0] for i in built]
+        pending = dict() #: (referenced object, association) to referrers
+        for obj, referenced in built:
+            for group in referenced:
+                pending.setdefault(group, []).append(obj)
+        
+        # A group breaking head cardinality must not leave the groups wired 
+        # before it referring to objects that are never registered
+        applied = list()
+        try:
+            for (value, association), referrers in pending.items():
+                value.add_references(association, referrers)
+                applied.append((value, association, referrers))
+        except BaseException:
+            for value, association, referrers in applied:
+                for i in referrers:
+                    value.remove_reference(association, i)
+            with universe._lock(cls):
+                for key, obj in fresh.items():
+                    if intern.get(key) is obj:
+                        del intern[key]
+            raise
+        
+        universe.add_objects(created)
+        return objects
+
+    _internable = False #: Can instances be interned? See OwlUniverse.
 
     #----------------------------------------------------- Data-storage Methods
 
     
-    def association(self, name, value):
+    def universe(self):
+        """Return the universe this object was created in.
+        
+            Returns: OwlUniverse object
+        
+        """
+        return self._universe
+
+    def association(self, name, value=None):
         """Dynamic function that is called to set and get function properties.
         
+        This is equivalent to using the association as an attribute, ie. 
+        obj.association('axioms', value) is obj.axioms = value.
+        
+            name: association name
+            value: new value, or None to just get the current value
+            Returns: the current value of the association
+        
         """
-        # Grab this dynamic methods metadata context
-        conf = _model.association_attr(self.id(), name)
-    
         # If we have a value, that implies we are a setter
         if(value is not None):
-            # List, set or singleton?
-            if (conf.has_key('maxCardinality')) and (conf['maxCardinality'] == '1'): # singleton
-                # Store away the value
-                # TODO: Check types for singletons - and other validations
-                self._data[name] = value
-                
-                # Add myself (that is my instantiated self) to the reference data 
-                # structure of the class (the value). This allows that class to see
-                # who is referencing it using my reverse association methods.
-                if hasattr(value, 'add_reference'):
-                    value.add_reference(name, self)
-                        
-            else:
-                if isinstance(value, list) is False:
-                    raise Exception("Value is not a list")
-                
-                # Wrap the setter value in a ValidatedList object to provide
-                # enhanced validation and trigger support.
-                self._data[name] = ValidatedList(self, name, 
-                    self._universe.get_class(conf['type']), value)
+            setattr(self, name, value)
             
-        return self._data[name]
+        return getattr(self, name)
     
-    def ref_objects(self, classname):
+    def ref_objects(self, classname, association=None):
         """Dynamic function that is called to get classes that reference this 
         object.
         
+        References are kept per (association, referencing class), so looking
+        them up is O(1), and the result is a live view rather than a copy.
+        
             classname: the class name of the objects that need to be returned
-            Returns: list of objects that point at this object
+            association: optionally, only return objects referencing us 
+                through this association
+            Returns: a ReferenceView of objects that point at this object
         
         """
-        if self._references.has_key(classname):
-            return self._references[classname]
+        # Storage backends keep the references themselves
+        storage = self._universe._storage
+        if storage is not None:
+            return ReferenceView((storage.referrers(self, classname, 
+                association), ))
+        
+        references = self._references
+        if references is None:
+            return ReferenceView(())
+        
+        if association is not None:
+            key = (association, classname)
+            if key in references:
+                return ReferenceView((references[key], ))
+            return ReferenceView(())
 
-        return None
+        return ReferenceView(tuple([v for k, v in references.items() 
+            if k[1] == classname]))
+
+    def has_reference(self, association, obj):
+        """Test if an object references us through an association.
+        
+            association: the association that is being used to reference us
+            obj: the object that may reference us
+            Returns: boolean
+        
+        """
+        references = self._references
+        if references is None:
+            return False
+        key = (association, obj.id())
+        return key in references and obj in references[key]
 
     def add_reference(self, association, obj):
-        """Add a reference to the existing list of references.
+        """Add a reference to the existing set of references.
+        
+        Adding the same reference twice has no effect. The head cardinality
+        of the association is enforced.
         
+            association: the association that is being used to reference us
             obj: the object that is references our object
+        
+        """
+        self.add_references(association, (obj, ))
+
+    def add_references(self, association, objs):
+        """Add references from several objects of the same class at once.
+        
             association: the association that is being used to reference us
+            objs: sequence of objects that reference our object, all of the 
+                same class
         
         """
-        conf = _model.association_attr(obj.id(), association)
+        if len(objs) == 0:
+            return
+        batch = self._universe._batch
+        if batch is not None:
+            batch._wire(True, self, association, objs)
+            return
         
-        if conf.has_key('headCardinality') and (conf['headCardinality'] == "1"):
-            #print "head", self.id(), association, object.id(), object
-            if (self._references.has_key(obj.id()) and 
-                (self._references[obj.id()] is not None)):
-                raise Exception("Exceeded head cardinality for this association.")
-            else:
-                self._references[obj.id()] = obj
-        else:
-            
-            # TODO: Deal with the headCardinality properly - check # references
-            if self._references.has_key(obj.id()):
-                # TODO: Get some duplication testing for this list.
-                #print "exists", object.id(), object
-                self._references[obj.id()].append(object)
-            else:
-                # First element - so create a list
-                #print "first", self.id(), association, object.id(), object
-                self._references[obj.id()] = [obj]    
+        head = getattr(objs[0].__class__, association).head_cardinality()
+        key = (association, objs[0].id())
+        
+        # Referring objects that are not loaded are only known to the storage
+        # backend, so it is asked as well
+        stored = ()
+        storage = self._universe._storage
+        if head is not None and storage is not None:
+            stored = storage.referrers(self, key[1], association)
+        
+        with self._universe._lock(self):
+            if self._references is None:
+                self._references = dict()
+
+            references = self._references.get(key)
+            if references is None:
+                references = self._references[key] = \
+                    self._universe._reference_set()
+
+            if head is not None:
+                known = references
+                if stored:
+                    known = set(references)
+                    known.update(stored)
+                new = len([i for i in objs if i not in known])
+                if len(known) + new > head:
+                    raise SchemaException("Exceeded head cardinality for "
+                        "this association.")
+
+            for i in objs:
+                references.add(i)
+
+    def remove_reference(self, association, obj):
+        """Remove a reference. Removing a reference that does not exist has no
+        effect.
+        
+            association: the association that was being used to reference us
+            obj: the object that no longer references our object
+        
+        """
+        batch = self._universe._batch
+        if batch is not None:
+            batch._wire(False, self, association, (obj, ))
+            return
+        
+        references = self._references
+        if references is None:
+            return
+
+        key = (association, obj.id())
+        with self._universe._lock(self):
+            if key in references:
+                references[key].discard(obj)
+                if len(references[key]) == 0:
+                    del references[key]
 
 
 class AssociationConstruct(object):
     """This class represents an association between two class constructs.
     
-    """
+    One AssociationConstruct is created for every association of every 
+    generated class, and is stored on the class under the association name.
+    It is a data descriptor, so reading and writing the association on an 
+    instance goes straight to the instance slot:
     
-    def __init__(self, parent):
-        self._parent = parent
-        self._data = None
+    .. python::
     
-    def __call__(self):
-        print "call", self, self._parent
-        value = None
-        # If we have a value, that implies we are a setter
-        if(value is not None):
-            # List, set or singleton?
-            if (self.max_cardinality() == 1): # singleton
-                # Store away the value
-                # TODO: Check types for singletons - and other validations
-                self._data = value
-                
-                # Add myself (that is my instantiated self) to the reference data 
-                # structure of the class (the value). This allows that class to see
-                # who is referencing it using my reverse association methods.
-                """
-                if hasattr(value, 'add_reference'):
-                    value.add_reference(name, self)
-                """
-                        
-            else:
-                if isinstance(value, list) is False:
-                    raise Exception("Value is not a list")
-                
-                # Wrap the setter value in a ValidatedList object to provide
-                # enhanced validation and trigger support.
-                self._data = ValidatedList(self, name, 
-                    self._universe.get_class(conf['type']), value)
-            
-        return self._data
+        ont.axioms = [Declaration(entity=...)]
+        ont.axioms.append(Declaration(entity=...))
+    
+    Everything needed by the setter is resolved once - the association 
+    configuration when the class is generated, and the association type on 
+    first use.
+    
+    """
+    __slots__ = ('_id', '_classid', '_slot', '_info', '_type', '_member', 
+        '_primary')
+    
+    def __init__(self, classid, info):
+        """Create the association for a generated class.
         
-    @classmethod
-    def id(cls):
-        """Name of the association.
+            classid: name of the class this association belongs to
+            info: the AssociationInfo of this association
         
         """
-        return cls._id
+        self._id = info.id
+        self._classid = classid
+        self._slot = _slot_name(info.id)
+        self._info = info
+        self._type = None
+        self._member = None
+        self._primary = False
 
-    _id = None #: The class construct name
+    def __set_name__(self, owner, name):
+        """Grab the slot that stores our values, once the class exists.
+        
+        """
+        member = getattr(owner, self._slot, None)
+        if hasattr(member, '__set__'):
+            self._member = member
 
-    @classmethod
-    def classid(cls):
+    def __get__(self, obj, cls=None):
+        """Get the value of this association for an instance.
+        
+        Accessing the association on the class returns the association itself.
+        
+        """
+        if obj is None:
+            return self
+        if self._member is not None:
+            value = self._member.__get__(obj, cls)
+        else:
+            value = getattr(obj, self._slot)
+        
+        # Storage backends load values on first use
+        if value.__class__ is Deferred:
+            return value.load(obj, self)
+        return value
+
+    def __set__(self, obj, value):
+        """Set the value of this association for an instance.
+        
+        Singletons are type checked and wired up for reverse references. Other
+        associations must be given a list, which is wrapped in a ValidatedList
+        to provide enhanced validation and trigger support.
+        
+        Setting None clears the association.
+        
+        """
+        universe = obj._universe
+        old = getattr(obj, self._slot, None)
+        if old.__class__ is Deferred:
+            old = old.load(obj, self)
+        value = self._validate(obj, value)
+        if universe._batch is not None:
+            universe._batch._save(obj, self, old)
+        
+        # Interned objects move to the key of their new values
+        interned = None
+        if universe._intern is not None and obj.__class__._internable:
+            interned = _object_key(obj)
+        
+        if self._info.max_cardinality == 1:
+            # Add myself (that is my instantiated self) to the reference data
+            # structure of the class (the value). This allows that class to 
+            # see who is referencing it using my reverse association methods.
+            # This is done before storing, so a head cardinality failure 
+            # leaves the old value in place.
+            if isinstance(value, ClassConstruct) and value is not old:
+                value.add_reference(self._id, obj)
+            if isinstance(old, ClassConstruct) and value is not old:
+                old.remove_reference(self._id, obj)
+        elif old is not None:
+            # The new list has already wired its members, so unwire the old
+            # members that are not carried across.
+            kept = set(value) if value is not None else ()
+            for i in old:
+                if i not in kept and isinstance(i, ClassConstruct):
+                    i.remove_reference(self._id, obj)
+        
+        if self._member is not None:
+            self._member.__set__(obj, value)
+        else:
+            setattr(obj, self._slot, value)
+        
+        # Keep the universe's primary key and intern indexes current
+        if self._primary and value is not old:
+            universe._rekey(obj, _primary_key(old), _primary_key(value))
+        if interned is not None:
+            universe._reintern(obj, interned)
+        
+        # Storage backends need to write the change back, and subscribers 
+        # want to hear about it
+        if universe._storage is not None:
+            universe._storage.changed(obj)
+        if universe._observers is not None and universe._registered(obj):
+            universe._notify(SET, obj, self._id, value, old)
+
+    def _validate(self, obj, value):
+        """Check a new value for this association, without storing it.
+        
+        This is an internal function, and should only be used internally.
+        
+            obj: the instance the value is for
+            value: the new value
+            Returns: the value to store
+        
+        """
+        if value is None:
+            return None
+
+        cls = self._type
+        if cls is None:
+            cls = self.class_type()
+
+        # List, set or singleton?
+        if self._info.max_cardinality == 1: # singleton
+            if not isinstance(value, cls):
+                raise SchemaException("Association %s.%s must be of type "
+                    "%s, not %s" % (self._classid, self._id, 
+                    self._info.type, type(value).__name__))
+            return value
+        
+        if isinstance(value, list) is False:
+            raise SchemaException("Value is not a list")
+        if self._info.unique:
+            key = _structural_key if obj._universe._structural else None
+            return UniqueList(obj, self._id, cls, value, key)
+        return ValidatedList(obj, self._id, cls, value)
+        
+    def id(self):
+        """Name of the association.
+        
+        """
+        return self._id
+
+    def classid(self):
         """Name of the class this association belongs to.
         
         """        
-        return cls._classid
-    
-    _classid = None
+        return self._classid
 
-    @classmethod
-    def min_cardinality(cls):
+    def slot(self):
+        """Name of the instance slot that holds the value of this association.
+        
+        """
+        return self._slot
+
+    def min_cardinality(self):
         """Minimum amount of classes for this association.
         
         """
-        return _model.association_attr(cls.classid(), 
-            cls.id())['minCardinality']
+        return self._info.min_cardinality
 
-    @classmethod
-    def max_cardinality(cls):
-        """Maximum amount of classes for this association.
+    def max_cardinality(self):
+        """Maximum amount of classes for this association, or None if there is
+        no maximum.
         
         """        
-        try:
-            return _model.association_attr(cls.classid(), 
-                cls.id())['maxCardinality']
-        except KeyError:
-            return None
+        return self._info.max_cardinality
 
-    @classmethod
-    def head_cardinality(cls):
+    def head_cardinality(self):
         """Number of classes that may hold this association with another named
-        class construct.
+        class construct, or None if there is no limit.
         
         """
-        try:
-            return _model.association_attr(cls.classid(), 
-                cls.id())['headCardinality']
-        except KeyError:
-            return None
+        return self._info.head_cardinality
 
-    @classmethod
-    def is_unique(cls):
+    def is_unique(self):
         """Are members of this association required to be unique?
         
         """
-        try:
-            if _model.association_attr(cls.classid(), 
-                cls.id())['unique'] == "true":
-                return True
-            else:
-                return False
-        except KeyError:
-            return True
+        return self._info.unique
 
-    @classmethod
-    def class_type(cls):
+    def class_type(self):
         """Return the class that this association pertains to.
         
+        The class is resolved on first use, so that associations do not force
+        their types to be generated early.
+        
         """
-        universe = OwlUniverse.get_universe()
-        return universe.get_class(_model.association_attr(cls.classid(), 
-            cls.id())['type'])
+        if self._type is None:
+            self._type = _resolve_type(self._info.type)
+        return self._type
             
 
 #------------------------------------------------------- Create Dynamic Classes
 
-# Generate all of the OWL dynamic function classes.
+# The OWL dynamic function classes are generated lazily. A class (and its 
+# parents) is only built the first time it is asked for, either as an attribute
+# of this module or through _get_class(). Built classes are recorded here, and
+# also placed in the module globals so later lookups do not come back through
+# __getattr__.
 _owlclasses = dict()
 
-# Iterate across all classes defined in our XML data model, and create them
-# one by one. 
-for classname in _model.classes():
+# Classes that are not defined by the model. Maps a class name to a function
+# that builds the class.
+_custom_classes = dict()
+
+def _head_bounded(classnames):
+    """Find the classes that are the target of an association with a head 
+    cardinality.
+    
+        classnames: names of the classes to look at
+        Returns: a set of class names
+    
+    """
+    bounded = set()
+    for classname in classnames:
+        types = set([classname] + list(_model.class_parents(classname)))
+        for refs in _model.references(classname):
+            for assocname in _model.associations(refs):
+                info = _model.association_info(refs, assocname)
+                if info.head_cardinality is not None and info.type in types:
+                    bounded.add(classname)
+    return bounded
+
+
+# Terminal classes whose instances can be shared when the universe is 
+# interning, see OwlUniverse. A shared instance is referenced by every object
+# that uses it, so classes that may only be referenced a limited number of 
+# times (such as Constant, the value of a label) cannot be shared.
+_internable_classes = tuple([i for i in ('URI', 'Constant', 'Namespace') 
+    if i not in _head_bounded(('URI', 'Constant', 'Namespace'))])
+
+# Association types that are Python types rather than model classes
+_builtin_types = {'str': str}
+
+# Building a class touches several dictionaries - and we must never build two
+# different classes for the same name.
+_build_lock = threading.RLock()
+
+
+def _reference_method(refs):
+    """Create a reverse reference method for the given referencing class.
+    
+        refs: name of the class that may reference us
+        Returns: a function suitable for use as a method
+    
+    """
+    def reference(self):
+        return self.ref_objects(refs)
+    
+    # TODO: The documentation needs to be half-decent
+    reference.__doc__ = "Reverse function for: %s" % refs
+    return reference
+
+
+def _build_class(classname):
+    """Build a class from the model, building its parents first.
+    
+    This is an internal function, and should only be used internally. Use
+    _get_class() instead, which only builds a class the first time.
+    
+        classname: name of the class in the model
+        Returns: new class object
+    
+    """
     # If there are parents defined in the model, use them - otherwise fall
-    # back to the standard ClassConstruct parent.
-    parents = _model.class_parents(classname)
+    # back to the standard ClassConstruct parent. Only the direct parents are
+    # used as bases, the rest of the ancestry comes with them.
+    ancestors = _model.class_parents(classname)
+    parents = [i for i in ancestors 
+        if not any(i in _model.class_parents(n) for n in ancestors)]
     if len(parents) == 0:
-        parents = ['ClassConstruct']
+        bases = (ClassConstruct, )
+    else:
+        bases = tuple([_get_class(i) for i in parents])
     
-    # Start building up the dictionary
+    # Start building up the dictionary. Introspection metadata is resolved 
+    # here once, rather than on every call.
     class_dict = {
         '_id': classname,
+        '_abstract': _model.class_attr(classname).get('abstract') == 'true',
+        '_ref_ids': tuple(sorted(_model.references(classname))),
+        '_child_ids': tuple(_model.class_children(classname)),
         '__doc__': "ClassConstruct: %s" % classname
         }
     
     # Setup dynamic association methods
+    associations = list()
     for assocname in _model.associations(classname):
-        class_dict[assocname] = type(
-            "%s.%s" % (classname, assocname), 
-            (AssociationConstruct, ), 
-            {
-                '_id': assocname,
-                '_classid': classname,
-                '__doc__': "AssocationConstruct: %s" % assocname
-            })
+        associations.append(AssociationConstruct(classname, 
+            _model.association_info(classname, assocname)))
+        class_dict[assocname] = associations[-1]
+    class_dict['_associations'] = tuple(associations)
+    
+    # The primary association is indexed by the universe, see 
+    # OwlUniverse.lookup()
+    primary = _model.class_primary(classname)
+    if primary is not None:
+        class_dict['_primary'] = class_dict[primary]
+        class_dict['_primary']._primary = True
         
     # Setup dynamic reference methods    
     for refs in _model.references(classname):
-        dm = None
-        # TODO: When doing an eval - its unsafe not to check variables
-        exec("dm = lambda self: self.ref_objects('%s')" % refs)
-        # TODO: The documentation needs to be half-decent
-        dm.__doc__ = "Reverse function for: %s" % refs
-        class_dict[refs] = dm             
+        class_dict[refs] = _reference_method(refs)
+    
+    # Association values are stored in slots. Slots already provided by a 
+    # parent are reused. Python cannot combine two parents that both have
+    # slots, so in that (rare) case we fall back to a normal instance 
+    # dictionary. Abstract classes define no slots of their own, which keeps
+    # multiple inheritance from abstract classes (eg. Datatype) slotted.
+    inherited = [_slots(i) for i in bases]
+    if class_dict['_abstract']:
+        class_dict['__slots__'] = ()
+    elif len([i for i in inherited if i]) <= 1:
+        provided = set()
+        for i in inherited:
+            provided.update(i)
+        class_dict['__slots__'] = tuple([_slot_name(i) for i in 
+            _model.associations(classname) if _slot_name(i) not in provided])
+    
+    # Concrete classes get a constructor specialised for their associations
+    if not class_dict['_abstract']:
+        class_dict['_arity'] = _arity_table(associations)
+        class_dict['__init__'] = _make_init(classname, associations, 
+            class_dict['_arity'], classname in _internable_classes)
+    
+    # Terminal classes can be interned, which needs a __new__ that can hand
+    # back an existing object.
+    if classname in _internable_classes:
+        class_dict['_internable'] = True
+        class_dict['__new__'] = _intern_new
     
     # Create the new class construct   
-    locals()[classname] = type(classname, 
-        tuple([ locals()[i] for i in parents ]), class_dict)
+    return type(classname, bases, class_dict)
+
+
+def _arity_table(associations):
+    """Work out which associations receive positional arguments, for every 
+    number of positional arguments a class accepts.
+    
+    Mandatory associations (minCardinality > 0) always receive an argument.
+    Optional associations receive the extra arguments, in model order. For
+    example Namespace (prefix is optional, IRI is mandatory) maps a single 
+    argument to IRI, and two arguments to prefix and IRI.
+    
+    No positional arguments at all is always allowed, so that objects can 
+    still be built up with named arguments only.
+    
+        associations: AssociationConstruct objects in model order
+        Returns: dictionary (key=number of arguments, value=tuple of 
+            AssociationConstruct objects)
+    
+    """
+    mandatory = [i for i in associations if i.min_cardinality() > 0]
+    optional = [i for i in associations if i.min_cardinality() == 0]
     
-    # Update our classes dictionary
-    # TODO: There must be a better way.
-    _owlclasses[classname] = locals()[classname]  
+    table = {0: ()}
+    for n in range(len(optional) + 1):
+        chosen = set(mandatory + optional[:n])
+        table[len(mandatory) + n] = tuple([i for i in associations 
+            if i in chosen])
+    return table
 
-#------------------------------------------------------- Custom Child Functions
 
-class Label(AnnotationByConstant):
-    """This is a common annotation with a fixed URI of rdf:label.
+def _make_init(classname, associations, table, internable=False):
+    """Create the __init__ for a concrete class.
+    
+    The slots are worked out here, once, so that the constructor itself only 
+    has to assign its arguments.
+    
+        classname: name of the class
+        associations: AssociationConstruct objects in model order
+        table: arity table, see _arity_table()
+        internable: True if instances may be interned
+        Returns: a function suitable for use as __init__
     
     """
-    def __init__(self, constant):
-        """Create an annotation and use rdf:label as a URI.
+    slots = tuple([i.slot() for i in associations])
+    counts = sorted([i for i in table if i > 0])
+    
+    def _fill(self, oargs, nargs):
+        # Some helper variables to make typing easier
+        self._universe = OwlUniverse.get_universe()
         
-        """
-        Annotation.__init__(self, annotationURI=URI(uri="rdf:label"), 
-            annotationValue=Constant(value=constant))
+        # Prepare data stores. References are only allocated when the first
+        # one is added.
+        self._references = None
+        for slot in slots:
+            setattr(self, slot, None)
+        
+        # Positional arguments go to the associations chosen by the arity 
+        # table. None leaves an association unset.
+        if oargs:
+            try:
+                assigned = table[len(oargs)]
+            except KeyError:
+                raise SchemaException("%s takes %s positional arguments but "
+                    "%s were given" % (classname, 
+                    " or ".join([str(i) for i in counts]), len(oargs)))
+            for assoc, value in zip(assigned, oargs):
+                if value is not None:
+                    assoc.__set__(self, value)
+        
+        # For each named argument, run its method
+        if nargs:
+            for k, v in nargs.items():
+                self.association(k, v)
+        
+    def __init__(self, *oargs, **nargs):
+        # An interned object handed back by __new__ is already initialised
+        if internable and hasattr(self, '_universe'):
+            return
+        
+        _fill(self, oargs, nargs)
+        
+        # And register the instance in the universe
+        self._universe.add_object(self)
+    
+    __init__._fill = _fill
+    __init__.__doc__ = "Initialise a %s.\n\nPositional arguments:\n\n%s" % (
+        classname, "\n".join(["    %s: %s" % (i, ", ".join([n.id() for n in 
+        table[i]])) for i in counts]))
+    return __init__
+
+
+def _intern_key(cls, oargs, nargs):
+    """Work out the intern table key for constructor arguments.
+    
+        cls: class being constructed
+        oargs: positional arguments
+        nargs: named arguments
+        Returns: a hashable key, or None if the arguments cannot be interned
+    
+    """
+    values = dict()
+    if oargs:
+        assigned = cls._arity.get(len(oargs))
+        if assigned is None:
+            # Let the constructor report the problem
+            return None
+        for assoc, value in zip(assigned, oargs):
+            values[assoc.id()] = value
+    values.update(nargs)
+    
+    key = (cls, ) + tuple([values.get(i.id()) for i in cls._associations])
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
 
-_owlclasses['Label'] = Label
 
-class Comment(AnnotationByConstant):
-    """This is a common annotation with a fixed URI of rdf:comment.
+def _intern_new(cls, *oargs, **nargs):
+    """__new__ for internable classes.
+    
+    When the universe is interning, structurally identical objects are shared:
+    an existing object with the same association values is returned instead
+    of a new one.
     
     """
-    def __init__(self, constant):
-        """Create an annotation and use rdf:comment as a URI.
+    universe = OwlUniverse.get_universe()
+    intern = universe._intern
+    if intern is None:
+        return object.__new__(cls)
+    
+    key = _intern_key(cls, oargs, nargs)
+    if key is None:
+        return object.__new__(cls)
+    
+    with universe._lock(cls):
+        obj = intern.get(key)
+    if obj is not None:
+        return obj
+    
+    # Build and validate the object before publishing it, so that other 
+    # threads never see it half initialised and a failed constructor leaves
+    # nothing behind. If another thread published an equal object meanwhile,
+    # that one wins and this one is dropped before it is registered.
+    obj = object.__new__(cls)
+    cls.__init__._fill(obj, oargs, nargs)
+    with universe._lock(cls):
+        existing = intern.setdefault(key, obj)
+    if existing is not obj:
+        return existing
+    universe.add_object(obj)
+    return obj
+
+
+def _primary_key(value):
+    """Work out the primary key for an association value.
+    
+    Constructs are keyed by their own primary key, so an Individual is keyed
+    by the uri string of its entityURI rather than by the URI object.
+    
+        value: association value
+        Returns: a key suitable for OwlUniverse.lookup()
+    
+    """
+    while isinstance(value, ClassConstruct):
+        primary = value.__class__._primary
+        if primary is None:
+            break
+        value = primary.__get__(value)
+    return value
+
+
+def _restore(cls):
+    """Create an empty object for unpickling, see ClassConstruct.__reduce__.
+    
+    This skips both __init__ and the interning __new__.
+    
+    """
+    return object.__new__(cls)
+
+
+def _object_key(obj):
+    """Work out the intern table key of an existing object.
+    
+    This matches the key _intern_key() gives for the arguments that would 
+    create the object.
+    
+        obj: an object of an internable class
+        Returns: a hashable key, or None if the object cannot be interned
+    
+    """
+    cls = obj.__class__
+    key = (cls, ) + tuple([i.__get__(obj) for i in cls._associations])
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _structural_key(value, path=()):
+    """Work out a key that is equal for structurally equal values.
+    
+    Constructs are keyed by their class and the keys of their association 
+    values, all the way down. An object that refers back to one of the 
+    objects it is part of is keyed by identity at that point.
+    
+        value: a construct, list or plain value
+        path: ids of the constructs being keyed, for the recursion
+        Returns: a hashable key
+    
+    """
+    if isinstance(value, ClassConstruct):
+        if id(value) in path:
+            return ('cycle', id(value))
+        path = path + (id(value), )
+        cls = value.__class__
+        return (cls, ) + tuple([_structural_key(i.__get__(value), path) 
+            for i in cls._associations])
+    if isinstance(value, list):
+        return tuple([_structural_key(i, path) for i in value])
+    return value
+
+
+def _slot_name(assocname):
+    """Name of the instance slot used to store an association.
+    
+        assocname: association name
+        Returns: slot name
+    
+    """
+    return "_data_%s" % assocname
+
+
+def _slots(cls):
+    """Collect the association slots defined by a class and its parents.
+    
+        cls: class object
+        Returns: set of slot names
+    
+    """
+    slots = set()
+    for i in cls.__mro__:
+        for n in i.__dict__.get('__slots__', ()):
+            if n.startswith('_data_'):
+                slots.add(n)
+    return slots
+
+
+def _get_class(classname):
+    """Return a construct class, building it on first access.
+    
+        classname: name of the class
+        Returns: class object
+    
+    """
+    try:
+        return _owlclasses[classname]
+    except KeyError:
+        pass
+
+    with _build_lock:
+        if classname not in _owlclasses:
+            if classname in _custom_classes:
+                cls = _custom_classes[classname]()
+                # Custom classes are defined inside their builder, so name
+                # them after the module attribute they are found under - 
+                # pickle looks them up by that name.
+                cls.__qualname__ = classname
+                cls.__module__ = __name__
+            else:
+                # Raises KeyError for classes not in the model
+                cls = _build_class(classname)
+            _owlclasses[classname] = cls
+            globals()[classname] = cls
+        return _owlclasses[classname]
+
+
+def _resolve_type(typename):
+    """Resolve an association type name to a class.
+    
+        typename: type name used in the model
+        Returns: class object
+    
+    """
+    if typename in _builtin_types:
+        return _builtin_types[typename]
+    return _get_class(typename)
+
+
+def _get_classes():
+    """Build every remaining class and return them all.
+    
+        Returns: a dictionary of classes (key=name, value=class object)
+    
+    """
+    for classname in _model.classes():
+        _get_class(classname)
+    for classname in _custom_classes:
+        _get_class(classname)
+    return _owlclasses.copy()
+
+
+def __getattr__(name):
+    """Build construct classes the first time they are accessed as module 
+    attributes.
+    
+    """
+    try:
+        return _get_class(name)
+    except KeyError:
+        raise AttributeError("module %r has no attribute %r" % 
+            (__name__, name))
+
+#------------------------------------------------------- Custom Child Functions
+
+def _label():
+    """Build the Label class."""
+    
+    class Label(_get_class('AnnotationByConstant')):
+        """This is a common annotation with a fixed URI of rdf:label.
+        
+        """
+        __slots__ = ()
+
+        def __init__(self, constant):
+            """Create an annotation and use rdf:label as a URI.
+            
+            """
+            super(Label, self).__init__(
+                annotationURI=_get_class('URI')(uri="rdf:label"), 
+                annotationValue=_get_class('Constant')(value=constant))
+    
+    return Label
+
+_custom_classes['Label'] = _label
+
+def _comment():
+    """Build the Comment class."""
+    
+    class Comment(_get_class('AnnotationByConstant')):
+        """This is a common annotation with a fixed URI of rdf:comment.
         
         """
-        Annotation.__init__(self, annotationURI=URI(uri="rdf:comment"), 
-            annotationValue=Constant(value=constant))
+        __slots__ = ()
+
+        def __init__(self, constant):
+            """Create an annotation and use rdf:comment as a URI.
+            
+            """
+            super(Comment, self).__init__(
+                annotationURI=_get_class('URI')(uri="rdf:comment"), 
+                annotationValue=_get_class('Constant')(value=constant))
+    
+    return Comment
 
-_owlclasses['Comment'] = Comment
+_custom_classes['Comment'] = _comment
 
 
 # This is to keep the IDE quiet
 __all__ = ['Datatype', 'URI', 'OWLEntity', 'AnnotationByConstant', 'OWLClass', 
     'Axiom', 'Constant', 'Description', 'DataRange', 'DataProperty', 
     'AnnotationByEntity', 'ObjectProperty', 'Individual', 'Declaration', 
-    'Ontology', 'Annotation', 'Label', 'Namespace', 'ModelConfig']
+    'Ontology', 'Annotation', 'Label', 'Comment', 'Namespace', 'ModelConfig']
 
     
\ No newline at end of file
@@ -78,4 +78,41 @@ class SchemaWebException(OwlSugarException):
     """
     This exception is raised when a SchemaWeb error has been encountered.
     """
-    pass
\ No newline at end of file
+    pass
+
+class ModelConfigException(OwlSugarException):
+    """
+    This exception is raised when the object model configuration is invalid,
+    for example when a class has an unknown parent or inherits from itself.
+    """
+    pass
+
+
+class SnapshotException(OwlSugarException):
+    """
+    This exception is raised when a universe snapshot cannot be read, because
+    it is not a snapshot, is truncated or does not match the object model.
+    """
+    pass
+
+
+class BatchException(SchemaException):
+    """
+    This exception is raised when a universe batch breaks the schema. Every
+    violation found is listed in the errors attribute, and the batch has been
+    rolled back.
+    """
+    
+    def __init__(self, errors):
+        SchemaException.__init__(self, "%d schema violations:\n%s" % (
+            len(errors), "\n".join(errors)))
+        self.errors = errors
+
+
+class StorageException(OwlSugarException):
+    """
+    This exception is raised when a storage backend cannot load or remove an
+    object, for example because the database refers to an object that is not
+    there.
+    """
+    pass
@@ -23,14 +23,63 @@ Note:
 This module requires python-lxml (redhat package) or equivalent. Plus the 
 required C libraries such as libxml2.
 
+lxml is only imported when a model actually has to be parsed. A model loaded
+from its compiled cache file (see ModelConfig) does not need it at all.
+
 """
 
 __docformat__ = 'restructuredtext en'
 __version__ = '$Rev$'
 
 
-from lxml import etree
-          
+import collections
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+
+from owlsugar.exceptions import ModelConfigException
+
+#: Bump this whenever the layout of the cached dictionaries changes
+_CACHE_FORMAT = 1
+
+#: Attributes that are stored in a compiled model cache file
+_CACHED_ATTRS = ('_dict_classes', '_dict_associations', '_class_order', 
+    '_class_parents', '_class_children', '_class_associations', 
+    '_dict_references')
+
+
+#: The resolved configuration of an association. Cardinalities are integers (or
+#: None when not bounded), unique is a boolean and classid is the class that
+#: declares the association.
+AssociationInfo = collections.namedtuple('AssociationInfo', ['id', 'classid',
+    'type', 'min_cardinality', 'max_cardinality', 'head_cardinality', 
+    'unique'])
+
+
+def _cardinality(value):
+    """Convert a cardinality attribute to an integer.
+    
+        value: attribute string or None
+        Returns: integer, or None if the attribute was not set
+    
+    """
+    if value is None:
+        return None
+    return int(value)
+
+
+def _unique(items):
+    """Remove duplicates from a list, keeping the first occurrence of each."""
+    seen = set()
+    result = []
+    for i in items:
+        if i not in seen:
+            seen.add(i)
+            result.append(i)
+    return result
+
 
 class ModelConfig(object):
     """This object provides a raw read-only interface to accessing the internal 
@@ -44,7 +93,7 @@ class ModelConfig(object):
 
     """
 
-    def __init__(self, filename, schema=None):
+    def __init__(self, filename, schema=None, cache=None):
         """Open the model, and cache all of the configuration data.
         
         The model is accessed using the lxml libraries.
@@ -55,45 +104,33 @@ class ModelConfig(object):
         Once this is done, the XML configuration file is closed and all data
         is access from the cache.
         
-        """
-        # Initiate the XML side of things
-        self._xml = etree.ElementTree(file=filename)
+        If a cache directory is supplied, the resolved cache is also compiled
+        to a binary file in that directory. The file is keyed on the content
+        of the model and schema, so the next time the same model is opened 
+        the XML parsing and schema validation are skipped entirely. Problems
+        reading or writing the cache are never fatal - we just fall back to 
+        parsing the XML.
         
-        # If a schema has been supplied - lets validate.
-        if schema is not None:
-            etree.XMLSchema(etree.parse(schema)).assertValid(self._xml)
+            filename: ObjectModel XML file
+            schema: optional ObjectModel XSD file to validate against
+            cache: optional directory for compiled model files
         
-        # Cache classes dictionary
-        self._dict_classes = dict()
-        for i in self._xml.findall(self._mdlns('class')):
-            self._dict_classes[i.attrib['id']] = dict(i.attrib)
+        """
+        cachefile = None
+        if cache is not None:
+            cachefile = self._cache_filename(filename, schema, cache)
 
-        # Cache associations dictionary
-        self._dict_associations = dict()
-        for cls in self.classes():
-            associations = list() # Associations must be recorded in order
-            for attr in self._find_class(cls).\
-                findall(self._mdlns('association')):
-                
-                associations.append(dict(attr.attrib))
-            self._dict_associations[cls] = associations
+        if cachefile is None or not self._load_cache(cachefile):
+            self._load_xml(filename, schema)
 
-        # Cache references dictionary
-        self._dict_references = dict()
-        for cls in self.classes():
-            self._dict_references[cls] = set()
-        for cls in self.classes():
-            for attr in self.associations(cls):
-                try:
-                    self._dict_references[
-                        self.association_attr(cls, attr)['type']].add(cls)
-                except KeyError:
-                    self._dict_references[
-                        self.association_attr(cls, attr)['type']] = set([cls])
-
-        # Close the XML file (by removing references). It should not be 
-        # required after initialisation.
-        delattr(self, '_xml')
+            # Resolve the class hierarchy once, so that every later query is 
+            # just a lookup.
+            self._resolve()
+
+            if cachefile is not None:
+                self._save_cache(cachefile)
+        else:
+            self._index()
 
     #-------------------------------------------------------------- Basic Lists
 
@@ -108,31 +145,7 @@ class ModelConfig(object):
             Returns: a list of classes ordered by inheritance, seniors first
             
         """
-        orig_list = self._dict_classes.keys() #: Unordered list
-        new_list = [] #: New ordered list
-
-        # Keep iterating until the original list is empty
-        iter_check = 0 #: Iteration check, to avoid infinite loops
-        while(len(orig_list) > 0):
-            # Check for infinite loops
-            iter_check += 1
-            if iter_check >= 20:
-                raise Exception("This loops has iterated %s times. Possible "\
-                    "infinite loop scenario." % iter_check)
-            
-            for i in orig_list:
-                parents = self.class_parents(i)
-                
-                # If the item has no parents, or has parents already in the 
-                # new list ... move the item to the new list. Otherwise, keep
-                # looking.
-                if ((len(parents) == 0) or 
-                    (parents == [n for n in parents if n in new_list])):
-                    
-                    new_list.append(i)
-                    orig_list.remove(i)
-
-        return new_list
+        return list(self._class_order)
                 
     def class_parents(self, classname):
         """List the parents of the class specified in order of seniority.
@@ -141,24 +154,7 @@ class ModelConfig(object):
             Returns: list of parent class names
             
         """
-        conf = self.class_attr(classname)
-        
-        if conf.has_key('parentage'):
-            parent_string = conf['parentage']
-            parents = parent_string.split(' ')
-            
-            for i in parents:
-                # Validate the parent
-                if i not in self._dict_classes.keys():
-                    raise Exception("Class %s has an invalid parent: %s" %
-                        (classname, i))
-            
-                # Using recursion, add any other parents to the list
-                parents.extend(self.class_parents(i))
-            
-            return parents
-        else:
-            return []
+        return list(self._class_parents[classname])
 
     def class_children(self, classname):
         """List the children of the class specified.
@@ -167,14 +163,7 @@ class ModelConfig(object):
             Returns: list of children class names
             
         """
-        # Iterate across all the classes, and see if the class in question
-        # is a parent.
-        children = set()
-        for i in self.classes():
-            if classname in self.class_parents(i):
-                children.add(i)
-                
-        return list(children)
+        return list(self._class_children[classname])
 
     def associations(self, classname):
         """List the associations belonging to a certain class.
@@ -183,13 +172,7 @@ class ModelConfig(object):
             Returns: a list of associations names
         
         """
-        associations = [ i['id'] for i in self._dict_associations[classname] ]
-        
-        # Build up the parent associations as well
-        for i in self.class_parents(classname):
-            associations.extend(self.associations(i))
-        
-        return associations
+        return list(self._class_associations[classname])
 
     def references(self, classname):
         """Return a list of possible classes that may reference the given
@@ -235,48 +218,321 @@ class ModelConfig(object):
             Returns: dictionary of configuration (key=config item, value=value)
         
         """
-        classlist = [classname]
-        classlist.extend(self.class_parents(classname))
-        for i in classlist:
-            for n in self._dict_associations[i]:
-                if n['id'] == attrname:
-                    return n.copy()
+        try:
+            return self._association_dicts[(classname, attrname)].copy()
+        except KeyError:
+            return None
+
+    def association_info(self, classname, attrname):
+        """Returns the resolved configuration of the given association.
+        
+        Unlike association_attr() this does no copying or string parsing, the
+        record is resolved once when the model is loaded. Inherited 
+        associations are resolved as well.
+        
+            classname: string containing a classname
+            attrname: string containing an association name
+            Returns: an AssociationInfo record
+        
+        """
+        return self._association_index[(classname, attrname)]
+
+    def class_primary(self, classname):
+        """Returns the primary association of the given class.
+        
+        The primary association acts like the primary key of a table in a 
+        relational database. A class without a primaryAssociation of its own 
+        inherits the one of its nearest parent.
+        
+            classname: string containing a classname
+            Returns: association name, or None if the class has none
+        
+        """
+        for i in [classname] + self._class_parents[classname]:
+            primary = self._dict_classes[i].get('primaryAssociation')
+            if primary is not None:
+                if primary not in self._class_associations[classname]:
+                    raise ModelConfigException("Class %s has an invalid "
+                        "primary association: %s" % (i, primary))
+                return primary
+        return None
 
     #------------------------------------------------- Private Helper Functions
 
 
-    # _find_class and _find_association are helper classes created to do XML
-    # node lookups.
-    def _find_class(self, classname):
-        """Given a classname, find the XMLNode for the class.
+    # _load_xml, _cache_filename, _load_cache and _save_cache deal with 
+    # getting the raw configuration into our caches.
+    def _load_xml(self, filename, schema=None):
+        """Parse (and optionally validate) the model XML into the raw class and
+        association caches.
+        
+        The file is streamed in a single pass with iterparse. Elements are 
+        cleared as soon as they have been recorded, so memory use does not 
+        grow with the size of the model. Validation against the schema 
+        happens during the same pass.
         
         This is an internal function, and should only be used internally.
         
-            classname: name of class to search for
-            Returns: the first XML Element to match
+            filename: ObjectModel XML file
+            schema: optional ObjectModel XSD file to validate against
         
-        """   
-        for i in self._xml.findall(self._mdlns('class')):
-            if i.attrib['id'] == classname:
-                return i
+        """
+        from lxml import etree
+
+        # If a schema has been supplied - lets validate while we parse.
+        options = dict()
+        if schema is not None:
+            options['schema'] = etree.XMLSchema(etree.parse(schema))
+
+        class_tag = self._mdlns('class')
+        association_tag = self._mdlns('association')
 
-    def _find_association(self, classname, attrname):
-        """Given a class name and association name, find the XMLNode for the
-         association.
+        self._dict_classes = dict()
+        self._dict_associations = dict()
+        associations = None #: Associations of the class being parsed
+        try:
+            for event, elem in etree.iterparse(filename, 
+                events=('start', 'end'), **options):
+                
+                if event == 'start':
+                    # Cache classes dictionary. The attributes are available 
+                    # at the start tag, before any of the class's 
+                    # associations.
+                    if elem.tag == class_tag:
+                        associations = list()
+                        self._dict_classes[elem.attrib['id']] = \
+                            dict(elem.attrib)
+                        self._dict_associations[elem.attrib['id']] = \
+                            associations
+                    continue
+
+                # Cache associations dictionary. Associations must be 
+                # recorded in order.
+                if elem.tag == association_tag:
+                    associations.append(dict(elem.attrib))
+                elif elem.tag != class_tag:
+                    continue
+
+                # We have what we need from this element - free it, along 
+                # with any siblings already processed.
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+        except etree.XMLSyntaxError as e:
+            # Schema errors are reported as syntax errors by iterparse, make
+            # them look the same as a non-streamed validation.
+            if schema is not None:
+                raise etree.DocumentInvalid(str(e))
+            raise
+
+    def _cache_filename(self, filename, schema, cache):
+        """Work out the compiled cache file for a model.
+        
+        The name is a hash of the model and schema contents, the cache format
+        and the marshal format, so any change to either file (or to the Python
+        that wrote it) simply misses the cache.
+        
+        This is an internal function, and should only be used internally.
+        
+            filename: ObjectModel XML file
+            schema: ObjectModel XSD file or None
+            cache: directory for compiled model files
+            Returns: full path of the cache file
+        
+        """
+        digest = hashlib.sha1()
+        digest.update(("%s:%s:%s\n" % (_CACHE_FORMAT, marshal.version, 
+            sys.version_info[:2])).encode('ascii'))
+        for i in (filename, schema):
+            if i is not None:
+                with open(i, 'rb') as handle:
+                    digest.update(handle.read())
+            digest.update(b'\0')
+
+        return os.path.join(cache, 'owlsugar-model-%s.bin' % 
+            digest.hexdigest())
+
+    def _load_cache(self, cachefile):
+        """Populate our caches from a compiled cache file.
+        
+        This is an internal function, and should only be used internally.
+        
+            cachefile: full path of the cache file
+            Returns: True if the cache was loaded, False on a miss
+        
+        """
+        try:
+            with open(cachefile, 'rb') as handle:
+                data = marshal.load(handle)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return False
+
+        if (not isinstance(data, dict) or 
+            sorted(data.keys()) != sorted(_CACHED_ATTRS)):
+            return False
+
+        for attr in _CACHED_ATTRS:
+            setattr(self, attr, data[attr])
+        return True
+
+    def _save_cache(self, cachefile):
+        """Write our caches to a compiled cache file.
+        
+        The file is written to a temporary name first and then renamed, so 
+        concurrent processes never see a partially written cache.
         
         This is an internal function, and should only be used internally.
         
-            classname: name of the class to search for
-            attrname: name of the association to search for
-            Returns: the first XML Element to match
+            cachefile: full path of the cache file
+        
+        """
+        data = dict((attr, getattr(self, attr)) for attr in _CACHED_ATTRS)
+        directory = os.path.dirname(cachefile)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            handle, tmpname = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'wb') as tmpfile:
+                    marshal.dump(data, tmpfile)
+                os.replace(tmpname, cachefile)
+            except BaseException:
+                os.remove(tmpname)
+                raise
+        except (IOError, OSError):
+            pass
+
+    # _resolve, _index and _direct_parents build the hierarchy caches at load 
+    # time.
+    def _resolve(self):
+        """Resolve the inheritance hierarchy from the raw class and association
+        caches.
+        
+        This populates:
         
-        """   
-        for i in self._find_class(classname).findall(self._mdlns('association')):
-            if i.attrib['id'] == attrname:
-                return i
+        * _class_order: class names ordered by inheritance, seniors first
+        * _class_parents: class name to a list of all ancestors
+        * _class_children: class name to a set of all descendants
+        * _class_associations: class name to a list of association names, 
+            including inherited associations
+        * _dict_references: class name to a set of class names that may 
+            reference it
+        
+        This is an internal function, and should only be used internally.
+        
+        """
+        # Topological sort (depth first, parents before children) with cycle
+        # detection. Classes are visited in document order so the result is
+        # stable.
+        self._class_order = list()
+        state = dict() #: 1 = being visited, 2 = done
+        for root in self._dict_classes:
+            if root in state:
+                continue
+            stack = [(root, iter(self._direct_parents(root)))]
+            state[root] = 1
+            while stack:
+                classname, parents = stack[-1]
+                for parent in parents:
+                    if state.get(parent) == 1:
+                        raise ModelConfigException("Inheritance cycle detected "
+                            "between classes %s and %s" % (classname, parent))
+                    if parent not in state:
+                        state[parent] = 1
+                        stack.append((parent, 
+                            iter(self._direct_parents(parent))))
+                        break
+                else:
+                    stack.pop()
+                    state[classname] = 2
+                    self._class_order.append(classname)
+
+        # Ancestors and flattened associations. Because parents are always
+        # resolved first, each class only needs to merge its direct parents.
+        self._class_parents = dict()
+        self._class_associations = dict()
+        self._class_children = dict()
+        for classname in self._class_order:
+            parents = list()
+            associations = [i['id'] for i in 
+                self._dict_associations[classname]]
+            for parent in self._direct_parents(classname):
+                parents.append(parent)
+                parents.extend(self._class_parents[parent])
+                associations.extend(self._class_associations[parent])
+            self._class_parents[classname] = _unique(parents)
+            self._class_associations[classname] = _unique(associations)
+            self._class_children[classname] = set()
+
+        # Descendants are simply the reverse of ancestors
+        for classname in self._class_order:
+            for parent in self._class_parents[classname]:
+                self._class_children[parent].add(classname)
+
+        self._index()
+
+        # Cache references dictionary
+        self._dict_references = dict()
+        for cls in self._class_order:
+            self._dict_references[cls] = set()
+        for cls in self._class_order:
+            for attr in self._class_associations[cls]:
+                self._dict_references.setdefault(
+                    self._association_index[(cls, attr)].type, set()).add(cls)
+
+    def _index(self):
+        """Build the per class association index from the resolved caches.
+        
+        Every (class, association) pair - including inherited associations - 
+        is resolved to its configuration dictionary and to an AssociationInfo 
+        record. Where a class redefines an association of its parent, the 
+        class's own definition wins.
+        
+        This is an internal function, and should only be used internally.
+        
+        """
+        self._association_dicts = dict()
+        self._association_index = dict()
+        for classname in self._class_order:
+            classlist = [classname]
+            classlist.extend(self._class_parents[classname])
+            for i in classlist:
+                for attr in self._dict_associations[i]:
+                    key = (classname, attr['id'])
+                    if key in self._association_dicts:
+                        continue
+                    self._association_dicts[key] = attr
+                    self._association_index[key] = AssociationInfo(
+                        attr['id'], i, attr['type'], 
+                        _cardinality(attr.get('minCardinality', '0')),
+                        _cardinality(attr.get('maxCardinality')),
+                        _cardinality(attr.get('headCardinality')),
+                        attr.get('unique', 'true') in ('true', '1'))
+
+    def _direct_parents(self, classname):
+        """List the parents declared directly on a class, validating each one.
+        
+        This is an internal function, and should only be used internally.
+        
+            classname: class to retrieve parents
+            Returns: list of parent class names
+        
+        """
+        parent_string = self._dict_classes[classname].get('parentage')
+        if not parent_string:
+            return []
+
+        parents = parent_string.split()
+        for i in parents:
+            # Validate the parent
+            if i not in self._dict_classes:
+                raise ModelConfigException("Class %s has an invalid parent: %s"
+                    % (classname, i))
+        return parents
 
-    # Local namespace wrapper. Uses QName to wrap it in the ElementTree style:
+    # Local namespace wrapper. Wraps the tag in the ElementTree (Clark) style,
+    # without needing lxml loaded:
     # eg: uri = obj._mdlns('NCName')
-    _mdlns = lambda self, id: etree.QName(
-        "http://organictechnology.net/schema/ObjectModel.xsd", tag=id).__str__()
+    _mdlns = lambda self, id: "{%s}%s" % (
+        "http://organictechnology.net/schema/ObjectModel.xsd", id)
 
@@ -0,0 +1,105 @@
+"""
+:Copyright: |copy| 2008 by Adrian Hare and Kenneth Barber.
+
+.. |copy| unicode:: 0xA9 .. copyright sign
+
+:license: 
+    This file is part of OWLSugar.
+
+    OWLSugar is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    OWLSugar is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+:Version: $Rev$
+
+Building a universe in parallel, with a pool of worker processes.
+
+.. python::
+
+    def build_record(record):
+        Individual(URI(record))
+    
+    parallel.build(records, build_record, workers=4)
+
+Records are split into shards, and each worker builds a shard into a universe
+of its own. The objects are sent back to the parent by pickling them, and 
+merged into the parent universe with OwlUniverse.merge().
+
+"""
+
+__docformat__ = 'restructuredtext en'
+__version__ = '$Rev$'
+
+import collections
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from owlsugar.universe import OwlUniverse
+
+
+def build(records, builder, universe=None, workers=None, shard_size=1000):
+    """Build constructs from records across a pool of worker processes.
+    
+    Records are read lazily, and only a couple of shards per worker are in 
+    flight at any time, so the input can be much larger than memory. Shards 
+    are merged in the order of the records.
+    
+        records: iterable of input records, which must be picklable
+        builder: function that is called with each record in a worker, and 
+            creates constructs in the worker's universe. It is pickled by 
+            name, so it must be a module level function.
+        universe: universe to merge the results into, defaults to the 
+            current universe
+        workers: number of worker processes, defaults to the number of CPUs
+        shard_size: number of records given to a worker at a time
+        Returns: the universe the results were merged into
+    
+    """
+    if universe is None:
+        universe = OwlUniverse.get_universe()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    
+    pending = collections.deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for shard in _shards(records, shard_size):
+            pending.append(executor.submit(_build_shard, builder, shard))
+            if len(pending) >= workers * 2:
+                universe.merge(pending.popleft().result())
+        while pending:
+            universe.merge(pending.popleft().result())
+    return universe
+
+
+def _shards(records, shard_size):
+    """Split records into lists of up to shard_size records."""
+    records = iter(records)
+    while True:
+        shard = list(itertools.islice(records, shard_size))
+        if not shard:
+            return
+        yield shard
+
+
+def _build_shard(builder, records):
+    """Build one shard of records. This runs in a worker process.
+    
+    Terminals are interned, so that repeated URIs are only pickled once.
+    
+        builder: see build()
+        records: list of records
+        Returns: list of all the objects built
+    
+    """
+    universe = OwlUniverse(intern=True, default=False)
+    with universe.activate():
+        for record in records:
+            builder(record)
+    return list(universe._objects())
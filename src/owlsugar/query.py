@@ -0,0 +1,344 @@
+"""
+:Copyright: |copy| 2008 by Adrian Hare and Kenneth Barber.
+
+.. |copy| unicode:: 0xA9 .. copyright sign
+
+:license: 
+    This file is part of OWLSugar.
+
+    OWLSugar is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    OWLSugar is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+:Version: $Rev$
+
+Queries over the objects of a universe.
+
+Rather than looping over get_objects() by hand, build a query and iterate 
+over it:
+
+.. python::
+
+    # Declarations of a given individual
+    universe.query("Declaration").where(entity=individual)
+    
+    # The uri strings of every entity that has been declared
+    universe.query("Declaration").join("entity").join("entityURI") \\
+        .select("uri")
+
+"""
+
+__docformat__ = 'restructuredtext en'
+__version__ = '$Rev$'
+
+from owlsugar.constructs import ClassConstruct, AssociationConstruct, \
+    _primary_key
+
+
+class Query(object):
+    """A lazy query over the objects of a universe.
+    
+    Queries are built by chaining methods, each of which returns a new query
+    and leaves the original alone. Nothing is evaluated until the query is 
+    iterated, and results are streamed one at a time - no intermediate lists 
+    are built.
+    
+    When the query runs, the planner looks at the where() clauses at the 
+    start of the query and picks the cheapest place to get objects from:
+    
+    * The primary key index, if the primary association is being matched.
+    * The reverse references of a construct, if an association is being 
+        matched against a construct.
+    * Otherwise, every object of the class from the type registry.
+    
+    explain() describes the choice that was made.
+    
+    """
+    __slots__ = ('_universe', '_classname', '_steps')
+    
+    def __init__(self, universe, classname, steps=()):
+        """Create a query. Use OwlUniverse.query() rather than calling this 
+        directly.
+        
+            universe: the universe to query
+            classname: class of the objects to start from
+            steps: the steps of the query, in order
+        
+        """
+        self._universe = universe
+        self._classname = classname
+        self._steps = steps
+    
+    def _extend(self, *step):
+        """Create a new query with one more step."""
+        return Query(self._universe, self._classname, self._steps + (step, ))
+    
+    #----------------------------------------------------------------- Building
+    
+    def where(self, **values):
+        """Only keep objects whose associations match the given values.
+        
+        A value matches if it is equal to the association value, or to its 
+        primary key - so both URI objects and uri strings can be used to match
+        an entityURI. For associations holding a list, any member may match.
+        None matches an association that has not been set.
+        
+            values: association names and the values to match
+            Returns: a new Query
+        
+        """
+        clauses = tuple([(k, _primary_key(v)) for k, v in 
+            sorted(values.items())])
+        return self._extend('where', clauses, values)
+    
+    def filter(self, predicate, association=None):
+        """Only keep objects for which a predicate is true.
+        
+            predicate: function taking one argument and returning a boolean
+            association: if given, the predicate is called with the value of 
+                this association rather than the object itself
+            Returns: a new Query
+        
+        """
+        return self._extend('filter', predicate, association)
+    
+    def join(self, association):
+        """Follow an association to the objects it refers to.
+        
+        Unset associations are skipped, and the members of lists are returned
+        one at a time.
+        
+            association: association name
+            Returns: a new Query
+        
+        """
+        return self._extend('join', association)
+    
+    def referenced_by(self, classname, association=None):
+        """Follow reverse references to the objects that refer to ours.
+        
+            classname: class of the referring objects, including its child 
+                classes
+            association: optionally, only follow references made through 
+                this association
+            Returns: a new Query
+        
+        """
+        classids = (classname, ) + \
+            self._universe.get_class(classname)._child_ids
+        return self._extend('referenced_by', classids, association)
+    
+    def distinct(self):
+        """Drop results that have already been returned.
+        
+            Returns: a new Query
+        
+        """
+        return self._extend('distinct')
+    
+    def select(self, *associations):
+        """Return a tuple of association values for each result, rather than 
+        the result itself.
+        
+            associations: association names
+            Returns: a new Query
+        
+        """
+        return self._extend('select', associations)
+    
+    #--------------------------------------------------------------- Evaluation
+    
+    def __iter__(self):
+        results = self._plan()[1]
+        for step in self._steps:
+            results = _steps[step[0]](results, *step[1:])
+        return iter(results)
+    
+    def first(self):
+        """Return the first result.
+        
+            Returns: the first result, or None if there are none
+        
+        """
+        for i in self:
+            return i
+        return None
+    
+    def count(self):
+        """Count the results.
+        
+        A query with no steps is counted from the type registry without 
+        touching the objects.
+        
+            Returns: integer
+        
+        """
+        if not self._steps:
+            return self._universe.count_objects(self._classname)
+        count = 0
+        for i in self:
+            count += 1
+        return count
+    
+    def explain(self):
+        """Describe where the planner gets the objects for this query from.
+        
+            Returns: a string
+        
+        """
+        return self._plan()[0]
+    
+    def _plan(self):
+        """Choose the source of objects for this query.
+        
+        Only the where() clauses at the start of the query are considered, 
+        since they are the only ones applying to objects of the starting 
+        class. Those clauses are still applied to the objects found, so the
+        source only has to return a superset of the matches.
+        
+            Returns: a tuple of a description and an iterable of objects
+        
+        """
+        universe = self._universe
+        classname = self._classname
+        
+        values = dict()
+        for step in self._steps:
+            if step[0] != 'where':
+                break
+            values.update(step[2])
+        
+        # Primary key index
+        primary = universe.get_class(classname)._primary
+        if primary is not None and values.get(primary.id()) is not None:
+            return ("primary key index of %s on %s" % (classname, 
+                primary.id()), _chain(universe._lookup(classname, 
+                values[primary.id()])))
+        
+        # Reverse references. Clauses match by primary key, so when the value
+        # has one, the referrers of every object sharing that key are needed.
+        for name in sorted(values):
+            value = values[name]
+            if not isinstance(value, ClassConstruct):
+                continue
+            classids = (classname, ) + \
+                universe.get_class(classname)._child_ids
+            key = _primary_key(value)
+            targets = [value]
+            if key is not value:
+                types = set()
+                for i in classids:
+                    assoc = getattr(universe.get_class(i), name, None)
+                    if isinstance(assoc, AssociationConstruct):
+                        types.add(assoc.class_type().id())
+                targets = list(_distinct([i for n in sorted(types) 
+                    for objects in universe._lookup(n, key) for i in objects]
+                    + [value]))
+            source = _chain([i.ref_objects(n, name) for i in targets 
+                for n in classids])
+            if len(targets) > 1:
+                # A list may refer to several of them
+                source = _distinct(source)
+            return ("reverse references of %s through %s" % (value.id(), 
+                name), source)
+        
+        # Type registry
+        return ("type registry of %s" % classname, 
+            universe.iter_objects(classname))
+
+
+#------------------------------------------------------------------ Query Steps
+
+
+# Each step takes an iterable of results, followed by the arguments stored for
+# the step, and returns a generator of new results.
+
+def _chain(iterables):
+    for i in iterables:
+        for n in i:
+            yield n
+
+
+def _matches(value, key):
+    """Does an association value match a primary key normalised value?"""
+    if isinstance(value, list):
+        if key is None:
+            return len(value) == 0
+        for i in value:
+            if _primary_key(i) == key:
+                return True
+        return False
+    return _primary_key(value) == key
+
+
+def _where(results, clauses, values):
+    for obj in results:
+        for name, key in clauses:
+            if not _matches(getattr(obj, name), key):
+                break
+        else:
+            yield obj
+
+
+def _filter(results, predicate, association):
+    for obj in results:
+        if association is None:
+            if predicate(obj):
+                yield obj
+        elif predicate(getattr(obj, association)):
+            yield obj
+
+
+def _join(results, association):
+    for obj in results:
+        value = getattr(obj, association)
+        if value is None:
+            continue
+        if isinstance(value, list):
+            for i in value:
+                yield i
+        else:
+            yield value
+
+
+def _referenced_by(results, classids, association):
+    for obj in results:
+        for classid in classids:
+            for i in obj.ref_objects(classid, association):
+                yield i
+
+
+def _distinct(results):
+    seen = set()
+    unhashable = list()
+    for i in results:
+        try:
+            if i in seen:
+                continue
+            seen.add(i)
+        except TypeError:
+            if i in unhashable:
+                continue
+            unhashable.append(i)
+        yield i
+
+
+def _select(results, associations):
+    for obj in results:
+        yield tuple([getattr(obj, i) for i in associations])
+
+
+_steps = {
+    'where': _where,
+    'filter': _filter,
+    'join': _join,
+    'referenced_by': _referenced_by,
+    'distinct': _distinct,
+    'select': _select,
+    }
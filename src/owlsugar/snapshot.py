@@ -0,0 +1,278 @@
+"""
+:Copyright: |copy| 2008 by Adrian Hare and Kenneth Barber.
+
+.. |copy| unicode:: 0xA9 .. copyright sign
+
+:license: 
+    This file is part of OWLSugar.
+
+    OWLSugar is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    OWLSugar is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+:Version: $Rev$
+
+Binary snapshots of a universe.
+
+Rebuilding a large universe from its source files is slow. A snapshot stores 
+every object of a universe in a compact binary file that loads much faster:
+
+.. python::
+
+    snapshot.save(universe, "ontology.snap")
+    
+    # ... and later, perhaps in another process
+    universe = OwlUniverse()
+    snapshot.load("ontology.snap")
+
+The file is a sequence of records, written in a single streaming pass:
+
+* A header: the magic bytes OWLSNAP plus a format version byte.
+* String records (S): the next entry of the string table, as a 32-bit 
+    length and UTF-8 bytes. Strings are numbered in the order they appear, 
+    and are written the first time they are needed. Class names, association
+    names and string values all go in the table, so each is stored once.
+* Object records (O): a 32-bit object id, the string id of the class name and
+    the number of values. Each value is the string id of the association 
+    name, then a kind (s for a string, o for an object, l for a list) and 
+    its payload of 32-bit ids. Lists start with their length.
+* An end record (E), so truncated files are detected.
+
+Object ids are given out as objects are first seen. An object can refer to 
+one whose record comes later in the file. Reverse references are not 
+stored, because they follow from the associations and are rebuilt on load.
+
+All integers are little-endian.
+
+"""
+
+__docformat__ = 'restructuredtext en'
+__version__ = '$Rev$'
+
+import contextlib
+import mmap
+import os
+import struct
+import tempfile
+
+from owlsugar.universe import OwlUniverse
+from owlsugar.constructs import ClassConstruct, _get_class, _restore
+from owlsugar.exceptions import SnapshotException
+
+_MAGIC = b'OWLSNAP\x01'
+
+_U32 = struct.Struct('<I')
+_STRING = struct.Struct('<cI') #: tag, length
+_OBJECT = struct.Struct('<cIII') #: tag, object id, class name, value count
+_VALUE = struct.Struct('<IcI') #: association name, kind, id or list length
+_MEMBER = struct.Struct('<cI') #: kind, id of a list member
+
+
+def save(universe, filename):
+    """Write a snapshot of every object in a universe.
+    
+    The snapshot is written to a temporary file first and then renamed, so 
+    an existing snapshot is never left half written.
+    
+        universe: the universe to save
+        filename: name of the snapshot file
+    
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    handle, tmpname = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as stream:
+            writer = _Writer(stream)
+            for obj in universe._objects():
+                writer.write(obj)
+            writer.close()
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.remove(tmpname)
+        raise
+
+
+def load(filename, universe=None):
+    """Load a snapshot into a universe.
+    
+    The file is memory mapped rather than read into memory. The objects are 
+    adopted with OwlUniverse.merge(), so a snapshot can be loaded into a 
+    universe that already has objects. The objects are restored exactly as 
+    they were saved - terminals are not shared with equal ones already in 
+    the universe.
+    
+        filename: name of the snapshot file
+        universe: universe to load into, defaults to the current universe
+        Returns: a list of the objects loaded
+    
+    """
+    if universe is None:
+        universe = OwlUniverse.get_universe()
+    
+    with open(filename, 'rb') as stream:
+        if os.fstat(stream.fileno()).st_size == 0:
+            raise SnapshotException("%s is not a snapshot" % filename)
+        with contextlib.closing(mmap.mmap(stream.fileno(), 0, 
+            access=mmap.ACCESS_READ)) as data:
+            objects = _read(data, filename)
+    
+    return universe.merge(objects, dedup=False)
+
+
+class _Writer(object):
+    """Streams snapshot records to a file, see save()."""
+    
+    def __init__(self, stream):
+        self._stream = stream
+        self._strings = dict() #: string to string id
+        self._ids = dict() #: object to object id
+        self._written = set() #: ids of objects already written
+        self._queued = list() #: objects referred to before being written
+        stream.write(_MAGIC)
+    
+    def _string(self, value):
+        """Get the id of a string, writing it to the table if it is new."""
+        sid = self._strings.get(value)
+        if sid is None:
+            sid = self._strings[value] = len(self._strings)
+            encoded = value.encode('utf-8')
+            self._stream.write(_STRING.pack(b'S', len(encoded)) + encoded)
+        return sid
+    
+    def _object(self, obj):
+        """Get the id of an object, queueing it if it has not been seen."""
+        oid = self._ids.get(obj)
+        if oid is None:
+            oid = self._ids[obj] = len(self._ids)
+            self._queued.append(obj)
+        return oid
+    
+    def _value(self, value):
+        """Encode a single value as a kind and an id."""
+        if isinstance(value, str):
+            return b's', self._string(value)
+        # Anything else must be a construct
+        if not isinstance(value, ClassConstruct):
+            raise SnapshotException("Cannot store a value of type %s" % 
+                type(value).__name__)
+        return b'o', self._object(value)
+    
+    def write(self, obj):
+        """Write the record for an object, unless it has been written.
+        
+            obj: the object
+        
+        """
+        oid = self._object(obj)
+        if oid in self._written:
+            return
+        self._written.add(oid)
+        
+        values = list()
+        count = 0
+        for assoc in obj._associations:
+            value = assoc.__get__(obj)
+            if value is None:
+                continue
+            name = self._string(assoc.id())
+            count += 1
+            if isinstance(value, list):
+                members = [self._value(i) for i in value]
+                values.append(_VALUE.pack(name, b'l', len(members)))
+                values.extend([_MEMBER.pack(kind, i) for kind, i in members])
+            else:
+                kind, i = self._value(value)
+                values.append(_VALUE.pack(name, kind, i))
+        
+        self._stream.write(_OBJECT.pack(b'O', oid, self._string(obj.id()), 
+            count) + b''.join(values))
+    
+    def close(self):
+        """Write any objects that were referred to but not yet written, and 
+        the end record.
+        
+        """
+        while self._queued:
+            queued, self._queued = self._queued, list()
+            for obj in queued:
+                self.write(obj)
+        self._stream.write(b'E')
+
+
+def _read(data, filename):
+    """Read the objects of a snapshot.
+    
+    The objects are created detached, with their association values set but 
+    nothing wired up, ready for OwlUniverse.merge(). Values are resolved 
+    after all of the records have been read, since an object may refer to 
+    one that comes later in the file.
+    
+        data: the snapshot contents (bytes or a memory map)
+        filename: name of the snapshot, for error messages
+        Returns: a list of objects
+    
+    """
+    if data[:len(_MAGIC)] != _MAGIC:
+        raise SnapshotException("%s is not a snapshot, or was written by an "
+            "incompatible version" % filename)
+    
+    strings = list()
+    objects = dict() #: object id to object
+    values = list() #: (object, slot, kind, ids) waiting to be resolved
+    slots = dict() #: (class, association name id) to slot name
+    pos = len(_MAGIC)
+    try:
+        while True:
+            tag = data[pos:pos + 1]
+            if tag == b'S':
+                length = _STRING.unpack_from(data, pos)[1]
+                pos += _STRING.size
+                strings.append(data[pos:pos + length].decode('utf-8'))
+                pos += length
+            elif tag == b'O':
+                oid, classid, count = _OBJECT.unpack_from(data, pos)[1:]
+                pos += _OBJECT.size
+                cls = _get_class(strings[classid])
+                obj = objects[oid] = _restore(cls)
+                obj.__setstate__({})
+                for i in range(count):
+                    name, kind, n = _VALUE.unpack_from(data, pos)
+                    pos += _VALUE.size
+                    slot = slots.get((cls, name))
+                    if slot is None:
+                        slot = slots[(cls, name)] = \
+                            getattr(cls, strings[name]).slot()
+                    if kind == b'l':
+                        members = [_MEMBER.unpack_from(data, 
+                            pos + _MEMBER.size * m) for m in range(n)]
+                        pos += _MEMBER.size * n
+                        values.append((obj, slot, kind, members))
+                    else:
+                        values.append((obj, slot, kind, n))
+            elif tag == b'E':
+                break
+            else:
+                raise SnapshotException("%s is truncated or corrupt" % 
+                    filename)
+        
+        for obj, slot, kind, n in values:
+            if kind == b'l':
+                value = [strings[i] if k == b's' else objects[i] 
+                    for k, i in n]
+            elif kind == b's':
+                value = strings[n]
+            else:
+                value = objects[n]
+            setattr(obj, slot, value)
+    except (struct.error, IndexError, KeyError, AttributeError, 
+        UnicodeDecodeError) as e:
+        raise SnapshotException("%s is truncated or corrupt: %s" % (
+            filename, e))
+    
+    return list(objects.values())
@@ -0,0 +1,600 @@
+"""
+:Copyright: |copy| 2008 by Adrian Hare and Kenneth Barber.
+
+.. |copy| unicode:: 0xA9 .. copyright sign
+
+:license: 
+    This file is part of OWLSugar.
+
+    OWLSugar is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    OWLSugar is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+:Version: $Rev$
+
+Storage backends for the objects of a universe.
+
+By default a universe keeps its objects in memory. For ontologies that do not
+fit in memory, a storage backend can be given instead:
+
+.. python::
+
+    universe = OwlUniverse(storage=SQLiteStorage("ontology.db"))
+
+The universe API stays the same - add_object(), get_objects(), lookup(), 
+queries and so on all work - but the objects themselves live in the backend.
+Only the objects in use are held in memory.
+
+A backend implements the Storage interface. SQLiteStorage is the one 
+provided.
+
+"""
+
+__docformat__ = 'restructuredtext en'
+__version__ = '$Rev$'
+
+import collections
+import sqlite3
+import weakref
+
+from owlsugar.exceptions import StorageException
+from owlsugar.types import Deferred
+
+try:
+    from collections.abc import Set
+except ImportError:
+    from collections import Set
+
+
+class Storage(object):
+    """Interface for object storage backends.
+    
+    A universe with a backend hands all of its object registry operations to
+    it. Class names are always of concrete classes, the universe works out 
+    the child classes itself.
+    
+    """
+    
+    def attach(self, universe):
+        """Called once, when the universe using this backend is created.
+        
+            universe: the OwlUniverse
+        
+        """
+        raise NotImplementedError
+    
+    def add(self, objects):
+        """Store new objects.
+        
+            objects: sequence of objects
+        
+        """
+        raise NotImplementedError
+    
+    def changed(self, obj):
+        """Called after an association of an object has been changed.
+        
+            obj: the object
+        
+        """
+        raise NotImplementedError
+    
+    def remove(self, obj):
+        """Remove an object. Objects that other stored objects still refer 
+        to cannot be removed, and raise StorageException.
+        
+            obj: the object
+            Returns: False if the object was not stored
+        
+        """
+        raise NotImplementedError
+    
+    def contains(self, obj):
+        """Is an object stored?
+        
+            obj: the object
+            Returns: boolean
+        
+        """
+        raise NotImplementedError
+    
+    def iter(self, classid):
+        """Iterate over the objects of exactly one class.
+        
+            classid: name of the class
+            Returns: an iterator of objects
+        
+        """
+        raise NotImplementedError
+    
+    def iter_all(self):
+        """Iterate over every object, of every class.
+        
+            Returns: an iterator of objects
+        
+        """
+        raise NotImplementedError
+    
+    def count(self, classid):
+        """Count the objects of exactly one class.
+        
+            classid: name of the class
+            Returns: integer
+        
+        """
+        raise NotImplementedError
+    
+    def lookup(self, classid, key):
+        """Find the objects of exactly one class with a primary key.
+        
+            classid: name of the class
+            key: primary key, see OwlUniverse.lookup()
+            Returns: a list of objects
+        
+        """
+        raise NotImplementedError
+    
+    def referrers(self, obj, classid, association=None):
+        """Find the objects of exactly one class that refer to an object.
+        
+            obj: the object being referred to
+            classid: name of the class of the referring objects
+            association: optionally, only references through this association
+            Returns: a list of objects
+        
+        """
+        raise NotImplementedError
+    
+    def materialize(self, obj, assoc, oid):
+        """Load an association value that was left as a 
+        owlsugar.types.Deferred placeholder.
+        
+            obj: the object the value belongs to
+            assoc: the AssociationConstruct
+            oid: the id given to the placeholder
+            Returns: the value
+        
+        """
+        raise NotImplementedError
+    
+    def flush(self):
+        """Write any changes that are waiting to be written."""
+        raise NotImplementedError
+    
+    def close(self):
+        """Flush, and release the backend's resources."""
+        raise NotImplementedError
+
+
+class SQLiteStorage(Storage):
+    """Storage backend keeping objects in a SQLite database.
+    
+    Tables are derived from the object model. Each concrete class gets a 
+    table named c_<class>, with an integer object id and one column per 
+    single-valued association (a_<association>). Associations holding lists 
+    get a table of their own, l_<class>_<association>, with one row per 
+    member. References to other objects are stored as their object id, and 
+    an objects table records the class of every id. Reference columns and 
+    primary associations are indexed, for reverse references and lookups.
+    
+    Objects are loaded on access and kept in a bounded LRU cache. The objects
+    they refer to, and the members of their lists, are only loaded when the 
+    association is first read. Objects stay the same Python object for as 
+    long as they are in use. New and changed objects are written back in 
+    batches, each in a single transaction. Any outstanding changes are 
+    written before reading from the database, and by flush().
+    
+    Reverse references are read from the database, so they do not have to 
+    fit in memory. Head cardinality is enforced against them as well as 
+    against the referring objects in memory.
+    
+    A SQLiteStorage is not thread-safe.
+    
+    """
+    
+    def __init__(self, filename, cache_size=10000, batch_size=1000):
+        """Create a SQLite backend.
+        
+            filename: name of the database file, created if needed
+            cache_size: number of objects kept in memory once they are no 
+                longer used elsewhere
+            batch_size: number of new or changed objects written at a time
+        
+        """
+        self._filename = filename
+        self._cache_size = cache_size
+        self._batch_size = batch_size
+        self._universe = None
+        self._db = None
+        self._next = None #: next free object id
+        self._oids = weakref.WeakKeyDictionary() #: object to object id
+        self._objects = weakref.WeakValueDictionary() #: object id to object
+        self._cache = collections.OrderedDict() #: recently used objects
+        self._dirty = dict() #: object id to objects waiting to be written
+        self._sql = dict() #: class to its SQL statements
+    
+    def attach(self, universe):
+        """Open the database, creating tables for the model as needed."""
+        import owlsugar.constructs as constructs
+        
+        self._universe = universe
+        self._db = sqlite3.connect(self._filename)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS objects '
+                '(oid INTEGER PRIMARY KEY, class TEXT NOT NULL)')
+            for cls in constructs._get_classes().values():
+                if not cls.is_abstract():
+                    for statement in self._schema(cls):
+                        self._db.execute(statement)
+        self._next = (self._db.execute('SELECT max(oid) FROM objects')
+            .fetchone()[0] or 0) + 1
+    
+    #---------------------------------------------------------------- Interface
+    
+    def add(self, objects):
+        for obj in objects:
+            if obj not in self._oids:
+                self._register(obj)
+        if len(self._dirty) >= self._batch_size:
+            self.flush()
+    
+    def changed(self, obj):
+        oid = self._oids.get(obj)
+        if oid is None:
+            return
+        self._dirty[oid] = obj
+        if len(self._dirty) >= self._batch_size:
+            self.flush()
+    
+    def remove(self, obj):
+        self.flush()
+        oid = self._oids.get(obj)
+        if oid is None:
+            return False
+        
+        # Referring objects would be left pointing at nothing
+        import owlsugar.constructs as constructs
+        for cls in constructs._get_classes().values():
+            if cls.is_abstract():
+                continue
+            for assoc, select in self._statements(cls)['referrers']:
+                if (isinstance(obj, assoc.class_type()) and 
+                    self._db.execute(select, (oid, )).fetchone()):
+                    raise StorageException("Cannot remove %s, it is still "
+                        "referred to by %s.%s" % (obj.id(), cls.id(), 
+                        assoc.id()))
+        
+        del self._oids[obj]
+        sql = self._statements(obj.__class__)
+        with self._db:
+            self._db.execute('DELETE FROM objects WHERE oid = ?', (oid, ))
+            self._db.execute(sql['delete'], (oid, ))
+            for assoc, delete, insert in sql['lists']:
+                self._db.execute(delete, (oid, ))
+        self._objects.pop(oid, None)
+        self._cache.pop(oid, None)
+        return True
+    
+    def contains(self, obj):
+        return obj in self._oids
+    
+    def iter(self, classid):
+        import owlsugar.constructs as constructs
+        if constructs._get_class(classid).is_abstract():
+            return
+        self.flush()
+        for oid in self._oid_query('SELECT oid FROM "c_%s"' % classid, ()):
+            yield self._load(oid)
+    
+    def iter_all(self):
+        self.flush()
+        for oid in self._oid_query('SELECT oid FROM objects', ()):
+            yield self._load(oid)
+    
+    def count(self, classid):
+        import owlsugar.constructs as constructs
+        if constructs._get_class(classid).is_abstract():
+            return 0
+        self.flush()
+        return self._db.execute('SELECT count(*) FROM "c_%s"' % 
+            classid).fetchone()[0]
+    
+    def lookup(self, classid, key):
+        import owlsugar.constructs as constructs
+        cls = constructs._get_class(classid)
+        if cls.is_abstract() or cls._primary is None:
+            return []
+        self.flush()
+        
+        sql = self._statements(cls)['lookup']
+        if sql is not None:
+            return [self._load(i) for i in self._oid_query(sql, (key, ))]
+        
+        # The primary association cannot be matched in SQL, so check each 
+        # object instead.
+        return [i for i in self.iter(classid) if constructs._primary_key(
+            cls._primary.__get__(i)) == key]
+    
+    def referrers(self, obj, classid, association=None):
+        import owlsugar.constructs as constructs
+        cls = constructs._get_class(classid)
+        if cls.is_abstract():
+            return []
+        self.flush()
+        oid = self._oids.get(obj)
+        if oid is None:
+            return []
+        
+        found = list()
+        for assoc, sql in self._statements(cls)['referrers']:
+            if association is None or assoc.id() == association:
+                found.extend(self._oid_query(sql, (oid, )))
+        return [self._load(i) for i in 
+            collections.OrderedDict.fromkeys(found)]
+    
+    def materialize(self, obj, assoc, oid):
+        if assoc.max_cardinality() == 1:
+            return self._load(oid)
+        
+        sql = self._statements(obj.__class__)['members'][assoc]
+        members = [i[0] for i in self._db.execute(sql, (oid, ))]
+        if assoc.class_type() is not str:
+            members = [self._load(i) for i in members]
+        return assoc._validate(obj, members) if members else None
+    
+    def flush(self):
+        if not self._dirty:
+            return
+        with self._db:
+            # Writing an object can find new objects it refers to, which are
+            # written in the next pass.
+            while self._dirty:
+                batch, self._dirty = self._dirty, dict()
+                groups = dict()
+                for oid, obj in batch.items():
+                    groups.setdefault(obj.__class__, []).append((oid, obj))
+                for cls, items in groups.items():
+                    self._write(cls, items)
+    
+    def close(self):
+        self.flush()
+        self._db.close()
+    
+    #------------------------------------------------------------------ Helpers
+    
+    def _schema(self, cls):
+        """Work out the CREATE statements for a class.
+        
+            cls: a concrete class
+            Returns: a list of SQL statements
+        
+        """
+        table = 'c_%s' % cls.id()
+        columns = ['oid INTEGER PRIMARY KEY']
+        statements = list()
+        for assoc in cls._associations:
+            column = 'a_%s' % assoc.id()
+            indexed = assoc is cls._primary or assoc.class_type() is not str
+            if assoc.max_cardinality() == 1:
+                columns.append('"%s" %s' % (column, 
+                    'TEXT' if assoc.class_type() is str else 'INTEGER'))
+                if indexed:
+                    statements.append('CREATE INDEX IF NOT EXISTS '
+                        '"i_%s_%s" ON "%s" ("%s")' % (cls.id(), assoc.id(), 
+                        table, column))
+            else:
+                members = 'l_%s_%s' % (cls.id(), assoc.id())
+                statements.append('CREATE TABLE IF NOT EXISTS "%s" '
+                    '(owner INTEGER NOT NULL, pos INTEGER NOT NULL, value, '
+                    'PRIMARY KEY (owner, pos))' % members)
+                if indexed:
+                    statements.append('CREATE INDEX IF NOT EXISTS "i_%s" '
+                        'ON "%s" (value)' % (members, members))
+        statements.insert(0, 'CREATE TABLE IF NOT EXISTS "%s" (%s)' % (table,
+            ', '.join(columns)))
+        return statements
+    
+    def _statements(self, cls):
+        """Get the SQL statements used for a class, working them out the 
+        first time.
+        
+            cls: a concrete class
+            Returns: a dictionary of statements
+        
+        """
+        sql = self._sql.get(cls)
+        if sql is not None:
+            return sql
+        
+        table = 'c_%s' % cls.id()
+        singles = [i for i in cls._associations if i.max_cardinality() == 1]
+        lists = [i for i in cls._associations if i.max_cardinality() != 1]
+        sql = self._sql[cls] = {
+            'singles': singles,
+            'select': 'SELECT * FROM "%s" WHERE oid = ?' % table,
+            'insert': 'INSERT OR REPLACE INTO "%s" VALUES (%s)' % (table, 
+                ', '.join(['?'] * (len(singles) + 1))),
+            'delete': 'DELETE FROM "%s" WHERE oid = ?' % table,
+            'lists': [(i, 
+                'DELETE FROM "l_%s_%s" WHERE owner = ?' % (cls.id(), i.id()),
+                'INSERT INTO "l_%s_%s" VALUES (?, ?, ?)' % (cls.id(), i.id()))
+                for i in lists],
+            'members': dict([(i, 'SELECT value FROM "l_%s_%s" WHERE owner = ?'
+                ' ORDER BY pos' % (cls.id(), i.id())) for i in lists]),
+            'referrers': [(i, 'SELECT oid FROM "%s" WHERE "a_%s" = ? ORDER BY '
+                'oid' % (table, i.id())) for i in singles 
+                if i.class_type() is not str] + [(i, 'SELECT DISTINCT owner '
+                'FROM "l_%s_%s" WHERE value = ? ORDER BY owner' % (cls.id(), 
+                i.id())) for i in lists if i.class_type() is not str],
+            'lookup': self._lookup_sql(cls),
+            }
+        return sql
+    
+    def _lookup_sql(self, cls):
+        """Work out the SQL to find objects of a class by primary key.
+        
+        Primary associations referring to other constructs are followed with
+        joins, until one holding a string is found.
+        
+            cls: a concrete class
+            Returns: a SQL statement, or None if it cannot be done in SQL
+        
+        """
+        joins = list()
+        current = cls
+        while True:
+            primary = current._primary
+            if primary is None or primary.max_cardinality() != 1:
+                return None
+            column = 't%s."a_%s"' % (len(joins), primary.id())
+            if primary.class_type() is str:
+                break
+            current = primary.class_type()
+            if current.is_abstract():
+                return None
+            joins.append('JOIN "c_%s" t%s ON %s = t%s.oid' % (current.id(), 
+                len(joins) + 1, column, len(joins) + 1))
+        return 'SELECT t0.oid FROM "c_%s" t0 %s WHERE %s = ? ORDER BY t0.oid' \
+            % (cls.id(), ' '.join(joins), column)
+    
+    def _oid_query(self, sql, args):
+        """Run a query for object ids, reading the results in chunks."""
+        cursor = self._db.execute(sql, args)
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                return
+            for row in rows:
+                yield row[0]
+    
+    def _register(self, obj):
+        """Give an object an id, and queue it to be written."""
+        oid = self._next
+        self._next += 1
+        self._oids[obj] = oid
+        self._objects[oid] = obj
+        self._dirty[oid] = obj
+        self._use(oid, obj)
+        return oid
+    
+    def _use(self, oid, obj):
+        """Mark an object as recently used in the LRU cache."""
+        cache = self._cache
+        cache[oid] = obj
+        cache.move_to_end(oid)
+        if len(cache) > self._cache_size:
+            cache.popitem(last=False)
+    
+    def _value(self, value):
+        """Convert an association value for the database."""
+        if value is None or isinstance(value, str):
+            return value
+        if value.__class__ is Deferred:
+            return value._oid
+        oid = self._oids.get(value)
+        if oid is None:
+            oid = self._register(value)
+        return oid
+    
+    def _write(self, cls, items):
+        """Write a batch of objects of one class."""
+        sql = self._statements(cls)
+        db = self._db
+        db.executemany('INSERT OR REPLACE INTO objects VALUES (?, ?)', 
+            [(oid, cls.id()) for oid, obj in items])
+        db.executemany(sql['insert'], [[oid] + [self._value(getattr(obj, 
+            i.slot())) for i in sql['singles']] for oid, obj in items])
+        for assoc, delete, insert in sql['lists']:
+            # Lists that were never loaded have not changed
+            loaded = [(oid, obj) for oid, obj in items 
+                if getattr(obj, assoc.slot()).__class__ is not Deferred]
+            db.executemany(delete, [(oid, ) for oid, obj in loaded])
+            db.executemany(insert, [(oid, n, self._value(value)) 
+                for oid, obj in loaded 
+                for n, value in enumerate(assoc.__get__(obj) or ())])
+    
+    def _load(self, oid):
+        """Get the object with an id, loading it if it is not in memory.
+        
+        Objects referred to that are not in memory, and the members of lists,
+        are left as Deferred placeholders to be loaded on first use.
+        
+            oid: object id
+            Returns: the object
+        
+        """
+        obj = self._objects.get(oid)
+        if obj is not None:
+            self._use(oid, obj)
+            return obj
+        
+        import owlsugar.constructs as constructs
+        found = self._db.execute('SELECT class FROM objects WHERE oid = ?',
+            (oid, )).fetchone()
+        if found is None:
+            raise StorageException("Object %s is referred to, but is not in "
+                "%s" % (oid, self._filename))
+        cls = constructs._get_class(found[0])
+        sql = self._statements(cls)
+        
+        obj = constructs._restore(cls)
+        obj._universe = self._universe
+        obj._references = None
+        self._oids[obj] = oid
+        self._objects[oid] = obj
+        self._use(oid, obj)
+        
+        row = self._db.execute(sql['select'], (oid, )).fetchone()
+        for assoc, value in zip(sql['singles'], row[1:]):
+            if value is not None and assoc.class_type() is not str:
+                loaded = self._objects.get(value)
+                value = loaded if loaded is not None else Deferred(self, 
+                    value)
+            setattr(obj, assoc.slot(), value)
+        for assoc in sql['members']:
+            setattr(obj, assoc.slot(), Deferred(self, oid))
+        
+        # Loaded terminals take part in interning
+        intern = self._universe._intern
+        if intern is not None and cls._internable:
+            key = constructs._object_key(obj)
+            if key is not None:
+                intern.setdefault(key, obj)
+        return obj
+
+
+class StorageView(Set):
+    """A live, read-only view of the objects of a class and its children in
+    a storage backend.
+    
+    This is what OwlUniverse.view_objects() returns for a universe with a 
+    storage backend.
+    
+    """
+    __slots__ = ('_storage', '_classids')
+    
+    def __init__(self, storage, classids):
+        self._storage = storage
+        self._classids = classids
+    
+    def __contains__(self, item):
+        from owlsugar.constructs import ClassConstruct
+        return (isinstance(item, ClassConstruct) and 
+            item.id() in self._classids and self._storage.contains(item))
+    
+    def __iter__(self):
+        for classid in self._classids:
+            for obj in self._storage.iter(classid):
+                yield obj
+    
+    def __len__(self):
+        return sum([self._storage.count(i) for i in self._classids])
+    
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, list(self))
@@ -23,29 +23,542 @@
 __docformat__ = 'restructuredtext en'
 __version__ = '$Rev$'
 
+import weakref
+
+from owlsugar.exceptions import SchemaException
+
+try:
+    from collections.abc import MutableSet, Set
+except ImportError:
+    from collections import MutableSet, Set
+
 
 class ValidatedList(list):
+    """A list holding the values of a non-singleton association.
+    
+    Every way of adding members - the constructor, append(), extend(), 
+    insert(), item and slice assignment, += and *= - checks their type and
+    wires up their reverse references. The type is checked once per distinct
+    class of the new members, so extending by a long list of one class is 
+    a single check. Every way of removing members - del, remove(), pop(), 
+    clear() and assignment - unwires the references of members that are no 
+    longer in the list.
+    
+    Reverse references are only kept for members that are constructs. The 
+    list counts how often each of them occurs, so a member that is in the 
+    list twice stays referenced until both are gone, and membership tests 
+    are O(1). Associations whose members must be unique use UniqueList.
+    
+    Changes are written back to the storage backend, and reported to the 
+    subscribers of the universe: an APPENDED event for each member added by
+    append(), extend() or insert(), and a SET event with the previous 
+    members for any other change.
+    
+    """
+    __slots__ = ('_parent', '_attribute', '_type', '_counts')
+    
     def __init__(self, parent, attribute, type, value):
+        """Create the list, with its initial members.
+        
+            parent: the object the association belongs to
+            attribute: name of the association
+            type: class the members must be instances of
+            value: iterable of initial members
+        
+        """
         self._parent = parent
         self._attribute = attribute
         self._type = type
         
-        list.__init__(self, [])
-        for i in value:    
-            self.append(i)
+        # Member counts, or None if the members have no reverse references
+        if hasattr(type, 'add_reference'):
+            self._counts = dict()
+        else:
+            self._counts = None
+        
+        items = list(value)
+        self._check(items)
+        items = self._admit(items)
+        self._wire(items)
+        list.__init__(self, items)
+    
+    def __contains__(self, element):
+        if self._counts is not None:
+            try:
+                return element in self._counts
+            except TypeError:
+                return False
+        return list.__contains__(self, element)
+    
+    def append(self, element):
+        """Add a member to the end of the list."""
+        self._insert(None, [element])
+    
+    def extend(self, elements):
+        """Add several members to the end of the list."""
+        self._insert(None, list(elements))
+    
+    def insert(self, index, element):
+        """Add a member before the given index."""
+        self._insert(index, [element])
+    
+    def __iadd__(self, elements):
+        self.extend(elements)
+        return self
+    
+    def __imul__(self, count):
+        if count <= 0:
+            self.clear()
+        else:
+            self.extend(list(self) * (count - 1))
+        return self
+    
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            items = list(value)
+            removed = list.__getitem__(self, index)
+        else:
+            items = [value]
+            removed = [list.__getitem__(self, index)]
+        
+        old = self._before(True)
+        self._check(items)
+        self._forget(removed)
+        added = None
+        try:
+            added = self._admit(items)
+            if not isinstance(index, slice):
+                if len(added) != 1:
+                    raise SchemaException("%r is already a member of "
+                        "association %s.%s" % (value, 
+                        self._parent.__class__.__name__, self._attribute))
+                value = added[0]
+            else:
+                value = added
+            self._wire(added)
+        except BaseException:
+            if added is not None:
+                self._forget(added)
+            self._admit(removed)
+            raise
+        
+        try:
+            list.__setitem__(self, index, value)
+        except BaseException:
+            self._unwire(added)
+            self._forget(added)
+            self._admit(removed)
+            raise
+        self._unwire(removed)
+        self._after(old=old)
+    
+    def __delitem__(self, index):
+        removed = list.__getitem__(self, index)
+        if not isinstance(index, slice):
+            removed = [removed]
+        old = self._before(True)
+        list.__delitem__(self, index)
+        self._forget(removed)
+        self._unwire(removed)
+        self._after(old=old)
+    
+    def remove(self, element):
+        """Remove the first occurrence of a member."""
+        old = self._before(True)
+        index = list.index(self, element)
+        element = list.__getitem__(self, index)
+        list.__delitem__(self, index)
+        self._forget((element, ))
+        self._unwire((element, ))
+        self._after(old=old)
+    
+    def pop(self, index=-1):
+        """Remove and return the member at the given index."""
+        old = self._before(True)
+        element = list.pop(self, index)
+        self._forget((element, ))
+        self._unwire((element, ))
+        self._after(old=old)
+        return element
+    
+    def clear(self):
+        """Remove every member."""
+        old = self._before(True)
+        removed = list(self)
+        list.clear(self)
+        self._forget(removed)
+        self._unwire(removed)
+        self._after(old=old)
+    
+    def _insert(self, index, items):
+        """Add new members.
+        
+            index: index to insert them before, or None to add them at the end
+            items: list of new members
+        
+        """
+        self._before()
+        self._check(items)
+        items = self._admit(items)
+        if not items:
+            return
+        try:
+            self._wire(items)
+        except BaseException:
+            self._forget(items)
+            raise
+        
+        if index is None:
+            list.extend(self, items)
+        else:
+            list.__setitem__(self, slice(index, index), items)
+        self._after(items)
+    
+    def _replace(self, items):
+        """Replace the members, without checking or wiring them.
+        
+        This is for putting back members whose reverse references are already
+        in place, as when a batch is rolled back.
+        
+            items: list of members
+        
+        """
+        list.__setitem__(self, slice(None), items)
+        if self._counts is not None:
+            counts = self._counts = dict()
+            for i in items:
+                counts[i] = counts.get(i, 0) + 1
+    
+    def _admit(self, items):
+        """Decide which new members are actually added.
+        
+        Lists accept every member. See UniqueList.
+        
+            items: list of new members
+            Returns: list of the members to add
+        
+        """
+        return items
+    
+    def _forget(self, items):
+        """Forget members that have left the list, see _admit().
+        
+            items: sequence of removed members
+        
+        """
+        pass
+    
+    def _check(self, items):
+        """Make sure new members are of the right type.
+        
+            items: sequence of new members
+        
+        """
+        cls = self._type
+        for i in set([i.__class__ for i in items]):
+            if i is not cls and not issubclass(i, cls):
+                raise SchemaException("Association %s.%s members must be of "
+                    "type %s, not %s" % (self._parent.__class__.__name__, 
+                    self._attribute, cls.__name__, i.__name__))
+    
+    def _wire(self, items):
+        """Add the reverse references of new members.
+        
+        If one of them cannot be referenced, the references added so far are
+        taken back out.
+        
+            items: sequence of new members
+        
+        """
+        counts = self._counts
+        if counts is None:
+            return
+        
+        wired = list()
+        try:
+            for i in items:
+                count = counts.get(i, 0)
+                if count == 0:
+                    i.add_reference(self._attribute, self._parent)
+                counts[i] = count + 1
+                wired.append(i)
+        except BaseException:
+            self._unwire(wired)
+            raise
+    
+    def _unwire(self, items):
+        """Remove the reverse references of members that have left the list.
+        
+            items: sequence of removed members
+        
+        """
+        counts = self._counts
+        if counts is None:
+            return
+        
+        for i in items:
+            count = counts[i] - 1
+            if count:
+                counts[i] = count
+            else:
+                del counts[i]
+                i.remove_reference(self._attribute, self._parent)
+    
+    def _before(self, copy=False):
+        """Get ready to change the list.
+        
+        An open batch is given the members before the change, so that it can
+        be rolled back.
+        
+            copy: if True, the change fires a SET event and needs the previous
+                members
+            Returns: a copy of the members if asked for and there are 
+                subscribers, otherwise None
+        
+        """
+        universe = self._parent._universe
+        if universe._batch is not None:
+            universe._batch._save(self._parent, 
+                getattr(self._parent.__class__, self._attribute), self)
+        if (copy and universe._observers is not None and 
+            universe._registered(self._parent)):
+            return list(self)
+        return None
+    
+    def _after(self, appended=None, old=None):
+        """Write back and report a change to the list.
+        
+            appended: the members added, for an append
+            old: the previous members, for any other change
+        
+        """
+        universe = self._parent._universe
+        if universe._storage is not None:
+            universe._storage.changed(self._parent)
+        if (universe._observers is None or 
+            not universe._registered(self._parent)):
+            return
+        
+        from owlsugar.universe import APPENDED, SET
+        if appended is None:
+            universe._notify(SET, self._parent, self._attribute, self, old)
+            return
+        with universe.batch_events():
+            for i in appended:
+                universe._notify(APPENDED, self._parent, self._attribute, i)
 
 
-    def append(self, element):
-        """Special override for append.
+class UniqueList(ValidatedList):
+    """A ValidatedList for an association whose members must be unique.
+    
+    The members are also kept in a dictionary - an insertion ordered hash 
+    set - so finding a duplicate is O(1) however long the list grows. New 
+    members that are already in the list are skipped, as they would be by a
+    set. Assigning a duplicate to a single index raises SchemaException.
+    
+    Members are normally compared by identity. A key function can be given 
+    instead, for example to treat structurally equal members as duplicates
+    (see OwlUniverse). Members should not be changed while they are in the
+    list, as their key would be out of date.
+    
+    """
+    __slots__ = ('_index', '_key')
+    
+    def __init__(self, parent, attribute, type, value, key=None):
+        """Create the list, with its initial members.
+        
+            parent: the object the association belongs to
+            attribute: name of the association
+            type: class the members must be instances of
+            value: iterable of initial members
+            key: optional function giving the key members are compared by
+        
+        """
+        self._index = dict()
+        self._key = key
+        ValidatedList.__init__(self, parent, attribute, type, value)
+    
+    def __contains__(self, element):
+        try:
+            if self._key is not None:
+                element = self._key(element)
+            return element in self._index
+        except TypeError:
+            return False
+    
+    def _replace(self, items):
+        self._index = dict()
+        self._admit(items)
+        ValidatedList._replace(self, items)
+    
+    def _admit(self, items):
+        index = self._index
+        key = self._key
+        admitted = list()
+        for i in items:
+            k = key(i) if key is not None else i
+            if k not in index:
+                index[k] = None
+                admitted.append(i)
+        return admitted
+    
+    def _forget(self, items):
+        index = self._index
+        key = self._key
+        for i in items:
+            index.pop(key(i) if key is not None else i, None)
+
+
+class Deferred(object):
+    """An association value that a storage backend has not loaded yet.
+    
+    Backends put these in the instance slots of the objects they load, so 
+    that the objects referred to are only loaded when they are used. Reading
+    the association (see AssociationConstruct) replaces the placeholder with 
+    the real value.
+    
+    """
+    __slots__ = ('_storage', '_oid')
+    
+    def __init__(self, storage, oid):
+        """Create a placeholder.
+        
+            storage: the backend that can load the value
+            oid: the backend's id for the value - the object referred to, or
+                for lists the object that owns the list
         
         """
-        # Make sure the type is correct
-        if isinstance(element, self._type) is False:
-            raise Exception("Invalid type:", element.fname())
+        self._storage = storage
+        self._oid = oid
+    
+    def load(self, obj, assoc):
+        """Load the value and put it in place of the placeholder.
         
-        # Fix up reverse references
-        if hasattr(element, 'add_reference'):
-            element.add_reference(self._attribute, self._parent)
+            obj: the object holding the placeholder
+            assoc: the AssociationConstruct the placeholder is for
+            Returns: the value
         
-        # Now call the real add        
-        return list.append(self, element)
+        """
+        value = self._storage.materialize(obj, assoc, self._oid)
+        setattr(obj, assoc.slot(), value)
+        return value
+
+
+class OrderedSet(MutableSet):
+    """A set that remembers insertion order.
+    
+    Membership, add and remove are all O(1) - it is just a dictionary with no
+    values.
+    
+    """
+    __slots__ = ('_items', )
+    
+    def __init__(self, items=()):
+        self._items = dict()
+        for i in items:
+            self._items[i] = None
+    
+    def __contains__(self, item):
+        return item in self._items
+    
+    def __iter__(self):
+        return iter(self._items)
+    
+    def __len__(self):
+        return len(self._items)
+    
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, list(self._items))
+    
+    def add(self, item):
+        """Add an item, if it is not already a member."""
+        self._items[item] = None
+    
+    def discard(self, item):
+        """Remove an item, if it is a member."""
+        self._items.pop(item, None)
+
+
+class WeakOrderedSet(OrderedSet):
+    """An OrderedSet that only holds weak references to its members.
+    
+    Members disappear from the set once they are garbage collected.
+    
+    """
+    __slots__ = ()
+    
+    def __init__(self, items=()):
+        self._items = weakref.WeakKeyDictionary()
+        for i in items:
+            self._items[i] = None
+
+
+class ReferenceView(Set):
+    """A live, read-only view across one or more sets of references.
+    
+    This is what ClassConstruct.ref_objects() returns. No references are 
+    copied - the view simply looks through to the sets it was given.
+    
+    """
+    __slots__ = ('_sets', )
+    
+    def __init__(self, sets):
+        self._sets = sets
+    
+    def __contains__(self, item):
+        for i in self._sets:
+            if item in i:
+                return True
+        return False
+    
+    def __iter__(self):
+        if len(self._sets) == 1:
+            return iter(self._sets[0])
+        return self._iter_unique()
+    
+    def _iter_unique(self):
+        seen = set()
+        for i in self._sets:
+            for n in i:
+                if n not in seen:
+                    seen.add(n)
+                    yield n
+    
+    def __len__(self):
+        if len(self._sets) == 1:
+            return len(self._sets[0])
+        return len(set(self._iter_unique()))
+    
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, list(self))
+
+
+class ObjectView(Set):
+    """A live, read-only view of the objects of a class and its children.
+    
+    This is what OwlUniverse.view_objects() returns. Each object belongs to 
+    exactly one class, so the per-class sets behind the view never overlap 
+    and its length is just the sum of theirs.
+    
+    """
+    __slots__ = ('_sets', )
+    
+    def __init__(self, sets):
+        self._sets = sets
+    
+    def __contains__(self, item):
+        for i in self._sets:
+            if item in i:
+                return True
+        return False
+    
+    def __iter__(self):
+        for i in self._sets:
+            for n in i:
+                yield n
+    
+    def __len__(self):
+        return sum([len(i) for i in self._sets])
+    
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, list(self))
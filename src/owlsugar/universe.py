@@ -23,6 +23,32 @@
 __docformat__ = 'restructuredtext en'
 __version__ = '$Rev$'
 
+import contextlib
+import contextvars
+import threading
+import weakref
+from collections import namedtuple
+
+from owlsugar.exceptions import BatchException, SchemaException
+from owlsugar.types import OrderedSet, WeakOrderedSet, ObjectView
+
+# The universe activated in the current context, see OwlUniverse.activate().
+# This takes precedence over the global default universe.
+_current = contextvars.ContextVar('owlsugar_universe', default=None)
+
+# Number of locks a thread-safe universe spreads its repositories over
+_SHARDS = 32
+
+# Kinds of mutation event, see OwlUniverse.subscribe()
+ADDED = 'added'
+REMOVED = 'removed'
+SET = 'set'
+APPENDED = 'appended'
+
+# A mutation event. For SET the value is the new value of the association and
+# old the previous one, for APPENDED the value is the element appended.
+Event = namedtuple('Event', 'kind obj association value old')
+
 
 class OwlUniverse(object):
     """An OWL universe is a global area for working with owlsugar constructs.
@@ -32,48 +58,217 @@ class OwlUniverse(object):
     After that, you can use the get_universe() static method to grab the 
     object.
     
+    By default the universe holds on to every object created in it. For long
+    running applications, a universe can instead be created in weak mode:
+    
+    .. python::
+    
+        universe = OwlUniverse(weak=True)
+    
+    In weak mode neither the universe nor the reverse references of other 
+    objects keep an object alive. Once nothing else (such as your own 
+    variables, or the associations of another object) refers to an object it
+    is reclaimed by the garbage collector, and simply disappears from 
+    get_objects().
+    
+    A universe can also intern the terminal constructs URI and Namespace:
+    
+    .. python::
+    
+        universe = OwlUniverse(intern=True)
+        URI("rdf:label") is URI("rdf:label") # True
+    
+    Creating one of these with the same association values as an existing 
+    object returns the existing object, so repeated IRIs share one instance.
+    Interned objects are shared, so treat them as immutable once created.
+    Constants are not interned, as each annotation needs a Constant of its 
+    own.
+    
+    Associations declared unique skip members that are already in the list.
+    Members are compared by identity, or by structure in a universe created 
+    with structural=True:
+    
+    .. python::
+    
+        universe = OwlUniverse(structural=True)
+        ont.axioms = [Declaration(foot), Declaration(foot)] # one axiom
+    
+    Several universes can be used at once, for example to build independent 
+    ontologies in different threads or asyncio tasks. Create them with 
+    default=False and activate one for the current context:
+    
+    .. python::
+    
+        universe = OwlUniverse(default=False)
+        with universe.activate():
+            Individual(URI("#foot"))
+    
+    Constructs remember the universe they were created in, see 
+    ClassConstruct.universe(), so they can be used after the block ends.
+    
+    A single universe can also be built from several threads at once, if it 
+    is created in thread-safe mode:
+    
+    .. python::
+    
+        universe = OwlUniverse(threadsafe=True)
+    
+    The repositories are then guarded by a set of sharded locks - one shard 
+    per class for the object registry and primary keys, and one shard per 
+    object for reverse references - so threads working on different classes 
+    and objects rarely wait for each other. There is no lock around the 
+    universe as a whole. Iterating over objects takes a snapshot of each 
+    class, but the live views from view_objects() and ref_objects() should 
+    not be iterated while other threads are changing them.
+    
+    Objects normally live in memory. A universe can keep them in a storage 
+    backend instead (see owlsugar.storage), for ontologies that are larger 
+    than memory:
+    
+    .. python::
+    
+        universe = OwlUniverse(storage=SQLiteStorage("ontology.db"))
+    
+    Reverse references are then held weakly, as in weak mode, and read from
+    the backend by ref_objects().
+    
+    Structures derived from the objects of a universe can be kept up to date
+    by subscribing to its mutation events:
+    
+    .. python::
+    
+        def changed(events):
+            for event in events:
+                print(event.kind, event.obj)
+        
+        universe.subscribe(changed)
+    
+    Events are delivered in lists. Bulk operations (and batch_events()) 
+    deliver all of their events in one list. While nobody is subscribed, no 
+    events are created at all.
+    
+    Many changes can be made as one batch, which either succeeds as a whole or
+    is undone as a whole:
+    
+    .. python::
+    
+        with universe.batch():
+            for row in rows:
+                ont.axioms.append(Declaration(Individual(URI(row))))
+    
+    Inside a batch new objects are not registered and reverse references are
+    not wired up. Both are done in one pass at the end of the batch, after 
+    the cardinality of everything touched has been checked. See batch().
+    
     """
 
     
 #----------------------------------------------------- Initiators and factories
 
     
-    def __init__(self):
-        """Create a new universe object, and make it the global default from
-        here on in.
+    def __init__(self, weak=False, intern=False, default=True, 
+        threadsafe=False, storage=None, structural=False):
+        """Create a new universe object, and (by default) make it the global 
+        default from here on in.
         
         Prepare the necessary universe-wide repositories:
         
-        * Classes dictionary: This is generated by introspecting the 
-            "owlsugar.functional.dynamic" name space.
+        * Classes: These are generated on demand by the 
+            "owlsugar.constructs" module, see get_class().
         * Object dictionary: Simply create a blank dictionary to be populated.
         
+            weak: if True, only hold weak references to objects
+            intern: if True, share structurally identical terminal objects
+            default: if True, make this the global default universe and the
+                current universe of this context. Otherwise the universe is 
+                only used inside activate().
+            threadsafe: if True, guard the repositories with locks so several
+                threads can add objects at once
+            storage: optional Storage backend to keep the objects in
+            structural: if True, associations whose members must be unique 
+                treat structurally equal members as duplicates
+        
         """
         # Globals
-        globals()['__owl_universe__'] = self
+        if default:
+            globals()['__owl_universe__'] = self
+            _current.set(self)
         
-        # Copy the class dictionary
-        import owlsugar.constructs
-        self._class_dict = owlsugar.constructs._owlclasses.copy()
-                
         # Create the object data structures
+        self._weak = weak
         self._object_dict = dict()
+        self._closures = dict() #: classname to its and its children's sets
+        self._keys = dict() #: classname to primary key to objects
+        # In weak mode, object to a one item list holding its current primary
+        # key, so that the key can be pruned once the object dies
+        self._key_cells = weakref.WeakKeyDictionary() if weak else None
+        
+        # Intern table for terminal constructs. Values are weak, so an 
+        # interned object that is no longer used does not linger here.
+        if intern:
+            self._intern = weakref.WeakValueDictionary()
+        else:
+            self._intern = None
+        
+        # Unique associations compare members by structure rather than by
+        # identity, see owlsugar.types.UniqueList
+        self._structural = structural
+        
+        # Sharded locks, see _lock()
+        if threadsafe:
+            self._locks = tuple([threading.RLock() for i in range(_SHARDS)])
+        else:
+            self._locks = None
+        
+        # Mutation event subscribers, see subscribe(). None when there are 
+        # none, so the mutation paths only have to check for None.
+        self._observers = None
+        self._held = None #: events held back by batch_events()
+        self._canonical = None #: terminals by structure, see _terminals()
+        self._batch = None #: the open Batch, see batch()
+        
+        # Storage backend, see owlsugar.storage
+        self._storage = storage
+        if storage is not None:
+            storage.attach(self)
            
 
     @staticmethod
     def get_universe():
-        """This is a static method to retrieve the existing universe from its
-        global variable. 
+        """This is a static method to retrieve the current universe. 
+        
+        This is the universe activated in the current context, falling back to
+        the global default universe.
         
             Returns: Pre-instantiated Universe object.
         
         """
-        if globals().has_key('__owl_universe__'):
+        universe = _current.get()
+        if universe is not None:
+            return universe
+        if '__owl_universe__' in globals():
             return globals()['__owl_universe__']
         else:
             raise Exception("Cannot retrieve the universe object. " \
                 "Instantiate a universe first.")
 
+    @contextlib.contextmanager
+    def activate(self):
+        """Make this the current universe within a with block.
+        
+        The universe is bound to the current context with contextvars, so 
+        other threads and asyncio tasks are not affected. The previous 
+        universe is restored at the end of the block.
+        
+            Returns: a context manager, giving this universe
+        
+        """
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
 
 #----------------------------------------------------------- Class Manipulation
 
@@ -81,21 +276,27 @@ class OwlUniverse(object):
     def get_class(self, classname):
         """Get a particular OWL class.
         
+        The class is generated the first time it is asked for.
+        
             classname: classname to search for
             Returns: class object
             
         """
-        return self.get_classes()[classname]
+        import owlsugar.constructs
+        return owlsugar.constructs._get_class(classname)
 
     
     def get_classes(self):
         """Get all OWL function classes.
         
+        This generates any classes that have not been used yet.
+        
             Returns: a copy of the dictionary of classes (key=name, 
                 value=class object)
             
         """
-        return self._class_dict.copy()
+        import owlsugar.constructs
+        return owlsugar.constructs._get_classes()
 
     
 #---------------------------------------------------------- Object Manipulation
@@ -107,29 +308,301 @@ class OwlUniverse(object):
             object: the object to add to this universes object repository.
             
         """
-        if self._object_dict.has_key(obj.id()):
-            self._object_dict[obj.id()].add(obj)
+        if self._batch is not None:
+            self._batch._added.append(obj)
+            return
+        
+        if self._canonical is not None:
+            self._index_terminals((obj, ))
+        if self._storage is not None:
+            self._storage.add((obj, ))
         else:
-            self._object_dict[obj.id()] = set([obj])        
+            with self._lock(obj.id()):
+                self._class_set(obj.id()).add(obj)
+            if obj.__class__._primary is not None:
+                self._add_key(obj, self._key(obj))
+                self._watch_key(obj)
+        
+        if self._observers is not None:
+            self._notify(ADDED, obj)
+    
+    
+    def add_objects(self, objects):
+        """Add many objects to the universe at once.
+        
+            objects: an iterable of objects to add to this universes object 
+                repository.
+            
+        """
+        objects = list(objects)
+        if self._batch is not None:
+            self._batch._added.extend(objects)
+            return
+        
+        if self._canonical is not None:
+            self._index_terminals(objects)
+        if self._storage is not None:
+            self._storage.add(objects)
+        else:
+            groups = dict()
+            for obj in objects:
+                groups.setdefault(obj.id(), []).append(obj)
+            
+            for classid, group in groups.items():
+                with self._lock(classid):
+                    self._class_set(classid).update(group)
+                if group[0].__class__._primary is not None:
+                    for obj in group:
+                        self._add_key(obj, self._key(obj))
+                        self._watch_key(obj)
+        
+        if self._observers is not None:
+            with self.batch_events():
+                for obj in objects:
+                    self._notify(ADDED, obj)
     
     
     def get_objects(self, classname):
-        """Return objects of a certain class name. 
+        """Return objects of a certain class name, including the objects of
+        its child classes.
+        
+        This copies the objects into a new list. To avoid the copy use 
+        iter_objects() or view_objects() instead.
         
             classname: classname to search for
             Returns: a list of objects
             
         """
-        objects = []
+        return list(self.iter_objects(classname))
+    
+    
+    def iter_objects(self, classname):
+        """Iterate over the objects of a certain class name, including the 
+        objects of its child classes.
         
-        classes = self.get_class(classname).child_classes()
-        classes.append(classname)
-        for i in classes:
+            classname: classname to search for
+            Returns: an iterator of objects
             
-            if self._object_dict.has_key(i):
-                objects.extend(list(self._object_dict[i]))
+        """
+        if self._storage is not None:
+            for classid in self._classids(classname):
+                for obj in self._storage.iter(classid):
+                    yield obj
+            return
         
-        return objects
+        if self._locks is None:
+            for objects in self._closure(classname):
+                for obj in objects:
+                    yield obj
+            return
+        
+        # Other threads may be adding objects, so take a snapshot of each 
+        # class as we go.
+        for classid in self._classids(classname):
+            with self._lock(classid):
+                objects = list(self._class_set(classid))
+            for obj in objects:
+                yield obj
+    
+    
+    def view_objects(self, classname):
+        """Return a live view of the objects of a certain class name, 
+        including the objects of its child classes.
+        
+        The view is not a copy, so objects added to the universe afterwards 
+        show up in it.
+        
+            classname: classname to search for
+            Returns: an ObjectView, or a StorageView for a universe with a 
+                storage backend
+            
+        """
+        if self._storage is not None:
+            from owlsugar.storage import StorageView
+            return StorageView(self._storage, self._classids(classname))
+        return ObjectView(self._closure(classname))
+    
+    
+    def count_objects(self, classname):
+        """Count the objects of a certain class name, including the objects of
+        its child classes.
+        
+        The cost depends on the number of child classes, not the number of 
+        objects.
+        
+            classname: classname to search for
+            Returns: integer
+            
+        """
+        if self._storage is not None:
+            return sum([self._storage.count(i) for i in 
+                self._classids(classname)])
+        return sum([len(i) for i in self._closure(classname)])
+    
+    
+    def merge(self, source, dedup=True):
+        """Adopt the objects of another universe.
+        
+        This combines universes that were built separately, for example by 
+        the worker processes of owlsugar.parallel.build(). Objects are moved 
+        rather than copied - afterwards they belong to this universe, and the
+        source universe should no longer be used.
+        
+        URIs and Namespaces equal to ones already in this universe (or 
+        earlier in the source) are dropped, and associations that referred 
+        to them are pointed at the existing objects instead. Reverse 
+        references are then rebuilt, and the objects registered.
+        
+        Everything is checked before anything is changed, so if the objects 
+        do not fit the schema - for example they would exceed the head 
+        cardinality of an object already in this universe - a 
+        SchemaException is raised and neither universe is touched.
+        
+            source: another OwlUniverse, or an iterable of detached objects 
+                such as unpickled ones
+            dedup: if False, adopt every terminal as it is
+            Returns: a list of the objects adopted
+        
+        """
+        import owlsugar.constructs as constructs
+        
+        if isinstance(source, OwlUniverse):
+            objects = list(source._objects())
+        else:
+            objects = list(source)
+        
+        remap = dict() #: dropped duplicate to the object replacing it
+        def swap(value):
+            if isinstance(value, list):
+                return [remap.get(i, i) for i in value]
+            if isinstance(value, constructs.ClassConstruct):
+                return remap.get(value, value)
+            return value
+        
+        # Terminals are deduplicated against this universe. They are done in
+        # the order of _internable_classes, so that terminals referring to 
+        # other terminals are keyed by the objects that are kept.
+        terminals = dict()
+        if dedup:
+            canonical = self._terminals()
+            terminals = dict([(i, []) for i in 
+                constructs._internable_classes])
+        adopted = list()
+        for obj in objects:
+            if obj.id() in terminals:
+                terminals[obj.id()].append(obj)
+            else:
+                adopted.append(obj)
+        
+        found = dict() #: key to the terminals that are kept
+        for classid in constructs._internable_classes:
+            for obj in terminals.get(classid, ()):
+                key = (obj.__class__, ) + tuple([swap(i.__get__(obj)) 
+                    for i in obj._associations])
+                try:
+                    existing = found.get(key)
+                    if existing is None:
+                        existing = canonical.get(key)
+                except TypeError:
+                    key = existing = None
+                if existing is not None and existing is not obj:
+                    remap[obj] = existing
+                    continue
+                if key is not None:
+                    found[key] = obj
+                adopted.append(obj)
+        
+        # Work out the new association values, and check them against the 
+        # schema, before changing anything
+        members = set([id(i) for i in adopted])
+        values = list() #: (object, association, new value)
+        counts = dict() #: reference group to [referenced, head, referrers]
+        errors = list()
+        for obj in adopted:
+            for assoc in obj._associations:
+                value = assoc.__get__(obj)
+                if value is None:
+                    continue
+                value = swap(value)
+                values.append((obj, assoc, value))
+                
+                cls = assoc.class_type()
+                if isinstance(value, list):
+                    targets = list(dict.fromkeys(value))
+                else:
+                    targets = [value]
+                for i in set([i.__class__ for i in targets]):
+                    if not issubclass(i, cls):
+                        errors.append("Association %s.%s must be of type %s, "
+                            "not %s" % (obj.id(), assoc.id(), cls.__name__, 
+                            i.__name__))
+                
+                head = assoc.head_cardinality()
+                for i in targets:
+                    if not isinstance(i, constructs.ClassConstruct):
+                        continue
+                    if i._universe is None and id(i) not in members:
+                        errors.append("Association %s.%s refers to a "
+                            "detached %s that is not being merged" % (
+                            obj.id(), assoc.id(), i.id()))
+                    if head is None:
+                        continue
+                    group = (id(i), assoc.id(), obj.id())
+                    if group not in counts:
+                        counts[group] = [i, head, 0]
+                    counts[group][2] += 1
+        
+        for (ident, association, classid), (value, head, count) in \
+            counts.items():
+            if ident not in members and value._references is not None:
+                count += len(value._references.get((association, classid), 
+                    ()))
+            if count > head:
+                errors.append("Exceeded head cardinality of %s.%s: %s would "
+                    "be referenced %d times, at most %d are allowed" % (
+                    classid, association, value.id(), count, head))
+        if errors:
+            raise SchemaException("\n".join(errors))
+        
+        # Now point the adopted objects at this universe and the remapped 
+        # terminals, and rebuild the reverse references
+        if self._intern is not None:
+            for key, obj in found.items():
+                self._intern[key] = obj
+        for obj in adopted:
+            obj._universe = self
+            obj._references = None
+        
+        pending = dict() #: (referenced object, association) to referrers
+        for obj, assoc, value in values:
+            if isinstance(value, list):
+                setattr(obj, assoc.slot(), assoc._validate(obj, value))
+                continue
+            setattr(obj, assoc.slot(), value)
+            if isinstance(value, constructs.ClassConstruct):
+                pending.setdefault((value, assoc.id()), []).append(obj)
+        
+        for (value, association), referrers in pending.items():
+            value.add_references(association, referrers)
+        
+        self.add_objects(adopted)
+        return adopted
+    
+    
+    def query(self, classname):
+        """Start a query over the objects of a certain class name, including
+        the objects of its child classes.
+        
+        See owlsugar.query.Query for the steps that can be added.
+        
+            classname: classname to start from
+            Returns: a Query
+        
+        """
+        from owlsugar.query import Query
+        self.get_class(classname)
+        return Query(self, classname)
+    
     
     def del_object(self, object):
         """Delete an object from the universe.
@@ -137,9 +610,786 @@ class OwlUniverse(object):
             object: the object to remove from this universes object repository.
             
         """
-        if self._object_dict.has_key(object.fname()):
-            self._object_dict[object.fname()].remove(object)
+        if self._storage is not None:
+            if not self._storage.remove(object):
+                raise Exception("Attempt to remove an object that does not " \
+                    "exist in the universal objected repository.")
+        else:
+            with self._lock(object.id()):
+                objects = self._object_dict.get(object.id())
+                if objects is None or object not in objects:
+                    raise Exception("Attempt to remove an object that does " \
+                        "not exist in the universal objected repository.")
+                objects.remove(object)
+            if object.__class__._primary is not None:
+                self._remove_key(object, self._key(object))
+        if self._canonical is not None:
+            self._index_terminals((object, ), remove=True)
+        
+        if self._observers is not None:
+            self._notify(REMOVED, object)
+    
+    
+    def lookup(self, classname, key):
+        """Find an object of a certain class name by its primary key.
+        
+        The primary key is the value of the primaryAssociation of the class in
+        the model. Constructs are keyed by their own primary key, so the 
+        Individual with a given IRI can be found with:
+        
+        .. python::
+        
+            universe.lookup("Individual", "http://example.com/#foot")
+        
+        Objects of child classes are found as well. The lookup is a hash table
+        probe per class, it does not scan the objects.
+        
+            classname: classname to search for
+            key: primary key value, or a construct with a primary key
+            Returns: the first object registered with this key, or None
+        
+        """
+        for objects in self._lookup(classname, key):
+            for obj in objects:
+                return obj
+        return None
+    
+    
+    def lookup_all(self, classname, key):
+        """Find all objects of a certain class name with a primary key.
+        
+        Primary keys are not required to be unique - for example every Label 
+        shares the rdf:label annotation URI.
+        
+            classname: classname to search for
+            key: primary key value, or a construct with a primary key
+            Returns: a list of objects
+        
+        """
+        return [i for objects in self._lookup(classname, key) for i in objects]
+
+    def subscribe(self, callback, kinds=None):
+        """Subscribe to mutation events.
+        
+        The callback is given a list of Event records. The kinds of event 
+        are:
+        
+        * ADDED: an object was added to the universe
+        * REMOVED: an object was removed from the universe
+        * SET: an association of an object in the universe was set
+        * APPENDED: an element was appended to a list association
+        
+        Objects fire SET events only once they are in the universe, so the 
+        associations given at construction come with the ADDED event instead.
+        
+            callback: function taking a list of events
+            kinds: optionally, the kinds of event wanted
+        
+        """
+        if kinds is not None:
+            kinds = frozenset(kinds)
+        # Copy on write, so callbacks can subscribe and unsubscribe while 
+        # events are being delivered
+        self._observers = list(self._observers or ()) + [(callback, kinds)]
+
+    def unsubscribe(self, callback):
+        """Stop delivering mutation events to a callback.
+        
+            callback: a callback given to subscribe()
+        
+        """
+        observers = [i for i in self._observers or () if i[0] != callback]
+        self._observers = observers or None
+
+    @contextlib.contextmanager
+    def batch_events(self):
+        """Hold back mutation events within a with block, and deliver them in
+        one list at the end.
+        
+        Blocks can be nested, the events are delivered at the end of the 
+        outermost one.
+        
+            Returns: a context manager
+        
+        """
+        if self._held is not None:
+            yield
+            return
+        
+        self._held = list()
+        try:
+            yield
+        finally:
+            events, self._held = self._held, None
+            if events:
+                self._deliver(events)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Make changes as one batch within a with block.
+        
+        Within the block, new objects are held back from the registry and 
+        reverse references are buffered rather than wired up. Association 
+        values are still stored straight away, and type checked as usual. At
+        the end of the block the buffered references are wired up in one 
+        pass, and then checked together with the cardinality of every object
+        and association touched. If anything breaks the schema, a 
+        BatchException listing every violation is raised. Otherwise the new 
+        objects are registered, and the mutation events of the batch are 
+        delivered in one list.
+        
+        If the block raises, or there are violations, the batch is rolled 
+        back: association values are restored, the new objects are dropped 
+        and the events are discarded. The batch can also be rolled back 
+        explicitly:
+        
+        .. python::
+        
+            with universe.batch() as batch:
+                ...
+                batch.rollback()
+        
+        New objects cannot be found (get_objects(), lookup() and so on) until
+        the batch ends. Deleting objects is not part of the batch. A batch 
+        belongs to the universe rather than to a thread, so other threads 
+        should not change the universe during it.
+        
+        Blocks can be nested, inner blocks are part of the outermost batch.
+        
+            Returns: a context manager, giving the Batch
+        
+        """
+        if self._batch is not None:
+            yield self._batch
+            return
+        
+        batch = self._batch = Batch(self)
+        try:
+            yield batch
+        except BaseException:
+            batch.rollback()
+            raise
+        batch._commit()
+
+    def flush(self):
+        """Write any outstanding changes to the storage backend, if there is 
+        one.
+        
+        """
+        if self._storage is not None:
+            self._storage.flush()
+
+    def is_weak(self):
+        """Does this universe only hold weak references to its objects?
+        
+            Returns: boolean
+        
+        """
+        return self._weak
+
+    def is_interning(self):
+        """Does this universe intern terminal constructs?
+        
+            Returns: boolean
+        
+        """
+        return self._intern is not None
+
+    def is_structural(self):
+        """Do unique associations treat structurally equal members as 
+        duplicates?
+        
+            Returns: boolean
+        
+        """
+        return self._structural
+
+
+#--------------------------------------------------------- Repository Factories
+
+
+    def _object_set(self, objects=()):
+        """Create a set to hold the objects of one class.
+        
+            objects: initial members
+            Returns: a set, or a weakref.WeakSet in weak mode
+        
+        """
+        if self._weak:
+            return weakref.WeakSet(objects)
+        return set(objects)
+
+    def _reference_set(self):
+        """Create a set to hold reverse references for an object.
+        
+            Returns: an OrderedSet, or a WeakOrderedSet in weak mode
+        
+        """
+        if self._weak or self._storage is not None:
+            return WeakOrderedSet()
+        return OrderedSet()
+
+    def _objects(self):
+        """Iterate over every object in the universe, of every class.
+        
+            Returns: an iterator of objects
+        
+        """
+        if self._storage is not None:
+            for obj in self._storage.iter_all():
+                yield obj
+            return
+        
+        for classid in list(self._object_dict):
+            for obj in list(self._object_dict[classid]):
+                yield obj
+
+    def _lock(self, key):
+        """Get the lock guarding part of a repository.
+        
+        Class ids are used as the key for the object registry and primary 
+        keys, and objects as the key for their reverse references. Outside 
+        thread-safe mode this returns a lock that does nothing.
+        
+        Only one of these locks should be held at a time. They are reentrant,
+        so the same one can be taken again.
+        
+            key: hashable key identifying the data being guarded
+            Returns: a context manager
+        
+        """
+        if self._locks is None:
+            return _nolock
+        return self._locks[hash(key) % _SHARDS]
+
+
+#--------------------------------------------------------------- Class Registry
+
+
+    def _class_set(self, classid):
+        """Get the set of objects for exactly one class, creating it if this
+        is the first object of that class.
+        
+            classid: name of the class
+            Returns: see _object_set()
+        
+        """
+        objects = self._object_dict.get(classid)
+        if objects is None:
+            with self._lock(classid):
+                objects = self._object_dict.get(classid)
+                if objects is None:
+                    objects = self._object_dict[classid] = self._object_set()
+        return objects
+    
+    def _notify(self, kind, obj, association=None, value=None, old=None):
+        """Fire a mutation event.
+        
+        Callers check that there are subscribers first, so that nothing is
+        done when there are none.
+        
+        """
+        event = Event(kind, obj, association, value, old)
+        if self._held is not None:
+            self._held.append(event)
         else:
-            raise Exception("Attempt to remove an object that does not " \
-                "exist in the universal objected repository.")
+            self._deliver([event])
+    
+    def _deliver(self, events):
+        """Deliver mutation events to the subscribers that want them."""
+        for callback, kinds in self._observers or ():
+            if kinds is None:
+                callback(list(events))
+            else:
+                wanted = [i for i in events if i.kind in kinds]
+                if wanted:
+                    callback(wanted)
+    
+    def _registered(self, obj):
+        """Is an object in this universe yet?"""
+        if self._storage is not None:
+            return self._storage.contains(obj)
+        return obj in self._object_dict.get(obj.id(), ())
+    
+    def _terminals(self):
+        """Get the index of terminal objects by structure, that merge() uses
+        to find equal terminals.
+        
+        An interning universe uses its intern table. Otherwise the index is 
+        built by the first merge, and from then on kept up to date as objects
+        are added and removed.
+        
+            Returns: a mapping of intern keys to objects
+        
+        """
+        if self._intern is not None:
+            return self._intern
+        if self._canonical is None:
+            import owlsugar.constructs as constructs
+            self._canonical = weakref.WeakValueDictionary()
+            for classid in constructs._internable_classes:
+                self._index_terminals(self._object_dict.get(classid, ()))
+        return self._canonical
+    
+    def _index_terminals(self, objects, remove=False):
+        """Add objects to (or remove them from) the index of terminals.
+        
+        Objects that are not terminals are ignored.
+        
+            objects: iterable of objects
+            remove: if True remove the objects rather than add them
+        
+        """
+        import owlsugar.constructs as constructs
+        canonical = self._canonical
+        for obj in objects:
+            if obj.id() not in constructs._internable_classes:
+                continue
+            key = constructs._object_key(obj)
+            if key is None:
+                continue
+            if not remove:
+                canonical.setdefault(key, obj)
+            elif canonical.get(key) is obj:
+                del canonical[key]
+    
+    def _classids(self, classname):
+        """Get the names of a class and all of its child classes.
+        
+            classname: name of the class
+            Returns: a tuple of class names
+        
+        """
+        return (classname, ) + self.get_class(classname)._child_ids
+    
+    def _closure(self, classname):
+        """Get the object sets of a class and all of its child classes.
+        
+        The class hierarchy never changes, so this is worked out once per 
+        class. Sets are never replaced either, so the tuple stays current as
+        objects come and go.
+        
+            classname: name of the class
+            Returns: a tuple of sets
+        
+        """
+        closure = self._closures.get(classname)
+        if closure is None:
+            classids = self._classids(classname)
+            closure = tuple([self._class_set(i) for i in classids])
+            self._closures[classname] = closure
+        return closure
+
+
+#----------------------------------------------------------------- Primary Keys
+
+
+    def _key(self, obj):
+        """Get the primary key of an object.
+        
+            obj: the object
+            Returns: primary key value
+        
+        """
+        import owlsugar.constructs
+        return owlsugar.constructs._primary_key(
+            obj.__class__._primary.__get__(obj))
+    
+    def _add_key(self, obj, key):
+        """Index an object under a primary key.
+        
+        None and unhashable keys (such as lists) are not indexed.
+        
+            obj: the object
+            key: primary key value
+        
+        """
+        if key is None:
+            return
+        with self._lock(obj.id()):
+            keys = self._keys.get(obj.id())
+            if keys is None:
+                keys = self._keys[obj.id()] = dict()
+            try:
+                objects = keys.get(key)
+            except TypeError:
+                return
+            if objects is None:
+                objects = self._reference_set()
+            objects.add(obj)
+            keys[key] = objects
+        
+        # Rekeyed objects prune their new key when they die
+        if self._key_cells is not None:
+            cell = self._key_cells.get(obj)
+            if cell is not None:
+                cell[0] = key
+    
+    def _watch_key(self, obj):
+        """In weak mode an object can die without being removed, so arrange 
+        for its primary key to be dropped from the index once nothing is left
+        under it. Only one finalizer is registered per object, it reads the 
+        key the object has when it dies.
+        
+            obj: an object that has just been indexed
+        
+        """
+        if self._key_cells is None or obj in self._key_cells:
+            return
+        cell = self._key_cells[obj] = [self._key(obj)]
+        weakref.finalize(obj, _prune_key, weakref.ref(self), obj.id(), cell)
+    
+    def _remove_key(self, obj, key):
+        """Remove an object from the index of a primary key.
+        
+            obj: the object
+            key: primary key value
+        
+        """
+        with self._lock(obj.id()):
+            try:
+                objects = self._keys.get(obj.id(), {}).get(key)
+            except TypeError:
+                return
+            if objects is not None:
+                objects.discard(obj)
+                if len(objects) == 0:
+                    del self._keys[obj.id()][key]
+    
+    def _rekey(self, obj, old, new):
+        """Move an object in the primary key index, after its primary 
+        association has changed.
+        
+        Objects that are keyed through this one (such as an Individual keyed
+        through its URI) are moved with it. Objects that are not yet in the 
+        universe are left alone, add_object() indexes them.
+        
+            obj: the object
+            old: previous primary key value
+            new: new primary key value
+        
+        """
+        objects = self._object_dict.get(obj.id())
+        if objects is None or obj not in objects or old == new:
+            return
+        self._remove_key(obj, old)
+        self._add_key(obj, new)
+        
+        if obj._references is None:
+            return
+        referrers = list()
+        with self._lock(obj):
+            for (association, classid), refs in obj._references.items():
+                primary = self.get_class(classid)._primary
+                if primary is not None and primary.id() == association:
+                    referrers.extend(refs)
+        for i in referrers:
+            self._rekey(i, old, new)
+    
+    def _reintern(self, obj, old):
+        """Move an interned object in the intern table, after one of its 
+        associations has changed.
+        
+        Objects that are not in the table under the old key (because they 
+        are still being built, or were never interned) are left alone. If an
+        equal object is already interned under the new key, that one stays.
+        
+            obj: the object
+            old: intern key of the object before the change
+        
+        """
+        import owlsugar.constructs
+        new = owlsugar.constructs._object_key(obj)
+        if old == new:
+            return
+        with self._lock(obj.__class__):
+            if self._intern.get(old) is not obj:
+                return
+            del self._intern[old]
+            if new is not None:
+                self._intern.setdefault(new, obj)
+    
+    def _lookup(self, classname, key):
+        """Find the sets of objects indexed under a primary key for a class 
+        and its child classes.
+        
+            classname: classname to search for
+            key: primary key value, or a construct with a primary key
+            Returns: a list of sets
+        
+        """
+        import owlsugar.constructs
+        key = owlsugar.constructs._primary_key(key)
+        
+        if self._storage is not None:
+            return [self._storage.lookup(i, key) for i in 
+                self._classids(classname)]
+        
+        found = list()
+        for classid in self._classids(classname):
+            keys = self._keys.get(classid)
+            if keys is None or key not in keys:
+                continue
+            if self._locks is None:
+                found.append(keys[key])
+            else:
+                with self._lock(classid):
+                    found.append(list(keys.get(key, ())))
+        return found
+
+
+class Batch(object):
+    """The changes of an open OwlUniverse.batch().
+    
+    New objects and reverse reference changes are held here until the batch
+    is committed. The first value each association held before the batch is
+    kept, so that the batch can be rolled back.
+    
+    """
+    
+    def __init__(self, universe):
+        self._universe = universe
+        self._added = list() #: new objects, in the order they were created
+        self._wiring = list() #: (add, target, association, objs) in order
+        self._saved = dict() #: (object id, association) to the first value
+        
+        # Events are held until the end of the batch. The position they start
+        # at is kept, so that ours can be dropped from an enclosing 
+        # batch_events() block.
+        self._owner = universe._held is None
+        if self._owner:
+            universe._held = list()
+        self._start = len(universe._held)
+    
+    def rollback(self):
+        """Undo the batch and end it.
+        
+        Changes made after this, within the with block, are no longer part of
+        the batch.
+        
+        """
+        universe = self._universe
+        if universe._batch is not self:
+            return
+        universe._batch = None
+        self._undo()
+    
+    def _undo(self):
+        """Restore the universe to how it was before the batch."""
+        universe = self._universe
+        for obj, assoc, old, items in reversed(list(self._saved.values())):
+            self._restore(obj, assoc, old, items)
+        
+        # Interned objects created by the batch are forgotten as well
+        intern = universe._intern
+        if intern is not None:
+            import owlsugar.constructs as constructs
+            for obj in self._added:
+                if obj.id() in constructs._internable_classes:
+                    key = constructs._object_key(obj)
+                    if key is not None and intern.get(key) is obj:
+                        del intern[key]
+        
+        self._end(False)
+    
+    def _wire(self, add, target, association, objs):
+        """Buffer a reverse reference change, see ClassConstruct."""
+        self._wiring.append((add, target, association, list(objs)))
+    
+    def _save(self, obj, assoc, old):
+        """Keep the value an association had before the batch changed it.
+        
+        Only the first value is kept, and only for objects that were already
+        registered - new objects are simply dropped on rollback. The members 
+        of lists are copied, as lists are changed in place.
+        
+        """
+        key = (id(obj), assoc.id())
+        if key in self._saved or not self._universe._registered(obj):
+            return
+        items = list(old) if isinstance(old, list) else None
+        self._saved[key] = (obj, assoc, old, items)
+    
+    def _restore(self, obj, assoc, old, items):
+        """Put back the value an association had before the batch."""
+        import owlsugar.constructs as constructs
+        universe = self._universe
+        
+        current = assoc.__get__(obj)
+        interned = None
+        if universe._intern is not None and obj.__class__._internable:
+            interned = constructs._object_key(obj)
+        if items is not None:
+            old._replace(items)
+        setattr(obj, assoc.slot(), old)
+        if interned is not None:
+            universe._reintern(obj, interned)
+        
+        if assoc._primary and current is not old:
+            universe._rekey(obj, constructs._primary_key(current), 
+                constructs._primary_key(old))
+        if universe._storage is not None:
+            universe._storage.changed(obj)
+    
+    def _commit(self):
+        """Apply the batch, or roll it back if it breaks the schema."""
+        universe = self._universe
+        if universe._batch is not self:
+            return
+        universe._batch = None
+        
+        applied, groups = self._apply()
+        errors = self._check(groups)
+        if errors:
+            self._unapply(applied)
+            self._undo()
+            raise BatchException(errors)
+        
+        universe.add_objects(self._added)
+        self._end(True)
+    
+    def _apply(self):
+        """Wire up the buffered reverse references.
+        
+            Returns: the changes made, for _unapply(), and the reference 
+                groups that were added to
+        
+        """
+        universe = self._universe
+        applied = list()
+        groups = dict()
+        for add, target, association, objs in self._wiring:
+            key = (association, objs[0].id())
+            with universe._lock(target):
+                if target._references is None:
+                    target._references = dict()
+                references = target._references.get(key)
+                if add:
+                    if references is None:
+                        references = target._references[key] = \
+                            universe._reference_set()
+                    new = [i for i in objs if i not in references]
+                    for i in new:
+                        references.add(i)
+                    applied.append((True, target, key, new))
+                    groups[(id(target), key)] = (target, key, objs[0])
+                elif references is not None and objs[0] in references:
+                    references.discard(objs[0])
+                    if len(references) == 0:
+                        del target._references[key]
+                    applied.append((False, target, key, objs[0]))
+        return applied, groups
+    
+    def _unapply(self, applied):
+        """Undo the reverse references wired up by _apply()."""
+        universe = self._universe
+        for add, target, key, objs in reversed(applied):
+            references = target._references
+            if add:
+                group = references.get(key, ())
+                for i in objs:
+                    group.discard(i)
+                if key in references and len(group) == 0:
+                    del references[key]
+            else:
+                if key not in references:
+                    references[key] = universe._reference_set()
+                references[key].add(objs)
+    
+    def _check(self, groups):
+        """Check the cardinality of everything the batch touched.
+        
+            groups: reference groups that were added to, see _apply()
+            Returns: a list of violation messages
+        
+        """
+        errors = list()
+        storage = self._universe._storage
+        
+        # Head cardinality, once per group of references. Referring objects 
+        # that are not loaded are only known to the storage backend.
+        for target, key, referrer in groups.values():
+            assoc = getattr(referrer.__class__, key[0])
+            head = assoc.head_cardinality()
+            if head is None:
+                continue
+            referrers = target._references.get(key, ())
+            if storage is not None:
+                referrers = set(referrers)
+                referrers.update(storage.referrers(target, key[1], key[0]))
+            count = len(referrers)
+            if count > head:
+                errors.append("%s is referenced by %d %s.%s associations, "
+                    "at most %d are allowed" % (target.id(), count, key[1], 
+                    key[0], head))
+        
+        # Maximum cardinality of the lists of new objects, and of the lists
+        # changed on existing ones. Like construction outside a batch, 
+        # mandatory associations are not enforced.
+        touched = [(obj, obj._associations) for obj in self._added]
+        touched.extend([(i[0], (i[1], )) for i in self._saved.values()])
+        for obj, associations in touched:
+            for assoc in associations:
+                high = assoc.max_cardinality()
+                if high is None or high == 1:
+                    continue
+                value = assoc.__get__(obj)
+                count = len(value) if value is not None else 0
+                if count > high:
+                    errors.append("%s.%s allows at most %d values, it has "
+                        "%d" % (obj.id(), assoc.id(), high, count))
+        return errors
+    
+    def _end(self, deliver):
+        """Stop holding back the events of the batch.
+        
+            deliver: if True deliver them, otherwise discard them
+        
+        """
+        universe = self._universe
+        if not deliver:
+            del universe._held[self._start:]
+        if self._owner:
+            events, universe._held = universe._held, None
+            if events:
+                universe._deliver(events)
+
+
+def _prune_key(ref, classid, cell):
+    """Remove a primary key from the index of a weak universe, if no objects
+    are left under it. Called when an object indexed under it dies.
+    
+        ref: weak reference to the universe
+        classid: name of the class of the object
+        cell: one item list holding the primary key the object last had
+    
+    """
+    universe = ref()
+    if universe is None:
+        return
+    # The dead object may still be counted by the set, but iterating only 
+    # gives live members
+    key = cell[0]
+    with universe._lock(classid):
+        keys = universe._keys.get(classid)
+        try:
+            if keys is not None and key in keys and \
+                next(iter(keys[key]), None) is None:
+                del keys[key]
+        except TypeError:
+            # Unhashable keys are never indexed
+            pass
+
+
+class _NoLock(object):
+    """A lock that does nothing, for universes that are not thread-safe."""
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+
+_nolock = _NoLock()
     
\ No newline at end of file
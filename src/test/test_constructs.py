@@ -0,0 +1,419 @@
+"""
+:Copyright: |copy| 2008 by Adrian Hare and Kenneth Barber.
+
+.. |copy| unicode:: 0xA9 .. copyright sign
+
+:license: 
+    This file is part of OWLSugar.
+
+    OWLSugar is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    OWLSugar is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+:Version: $Rev$
+
+Tests on the generated construct classes.
+
+"""
+
+__docformat__ = 'restructuredtext en'
+__version__ = '$Rev$'
+
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+from owlsugar import OwlUniverse
+from owlsugar.exceptions import SchemaException
+import owlsugar.constructs as constructs
+
+
+class ClassGeneration(TestCase):
+    """Tests related to the lazy generation of construct classes."""
+
+    #------------------------------------------------------------------ Fixture
+    def setUp(self):
+        """Create a universe."""
+        self.universe = OwlUniverse()
+
+    def tearDown(self):
+        """Reset the universe."""
+        self.universe = None
+
+    #------------------------------------------------------- Success test cases
+    def test_import_builds_nothing(self):
+        """Importing the constructs module must not generate any classes."""
+        code = ("import owlsugar.constructs as c; "
+            "import sys; sys.stdout.write(str(len(c._owlclasses)))")
+        output = subprocess.check_output([sys.executable, '-c', code], 
+            cwd=os.path.join(os.path.dirname(__file__), '..'))
+        self.assertEqual(output.strip(), b'0')
+
+    def test_access_builds_ancestors(self):
+        """Accessing a class builds it along with its parents only."""
+        cls = constructs.Datatype
+        self.assertEqual(cls.id(), "Datatype")
+        self.assertTrue(issubclass(cls, constructs._owlclasses['DataRange']))
+        self.assertTrue(issubclass(cls, constructs._owlclasses['OWLEntity']))
+
+    def test_class_built_once(self):
+        """The module attribute and the universe agree on the class."""
+        self.assertTrue(constructs.Declaration is 
+            self.universe.get_class("Declaration"))
+
+    def test_get_classes(self):
+        """The universe can still list every class."""
+        classes = self.universe.get_classes()
+        for classname in constructs._model.classes():
+            self.assertEqual(classes[classname].id(), classname)
+        self.assertTrue('Label' in classes)
+        self.assertTrue('Comment' in classes)
+
+    def test_label(self):
+        """Custom classes are built on demand as well."""
+        label = constructs.Label("Testing a label")
+        self.assertEqual(label.association('annotationURI', None).
+            association('uri', None), "rdf:label")
+
+    def test_association_metadata(self):
+        """Association metadata is typed and the type is a resolved class."""
+        entity = constructs.Declaration.entity
+        self.assertEqual(entity.min_cardinality(), 1)
+        self.assertEqual(entity.max_cardinality(), 1)
+        self.assertEqual(entity.head_cardinality(), 1)
+        self.assertTrue(entity.class_type() is constructs.OWLEntity)
+        self.assertTrue(constructs.URI.uri.class_type() is str)
+        self.assertEqual(constructs.Ontology.axioms.max_cardinality(), None)
+
+    def test_slots(self):
+        """Instances store association values in slots, without a __dict__."""
+        uri = constructs.URI(uri="#x")
+        decl = constructs.Declaration(entity=constructs.Individual(
+            entityURI=uri))
+        for obj in (uri, decl, decl.association('entity'), 
+            constructs.Label("x")):
+            self.assertFalse(hasattr(obj, '__dict__'))
+        self.assertEqual(uri._data_uri, "#x")
+        self.assertTrue(decl.association('entity').association('entityURI') 
+            is uri)
+        self.assertEqual(decl.association('annotations'), None)
+
+    def test_slots_multiple_inheritance(self):
+        """Classes with several abstract parents are still slotted."""
+        datatype = constructs.Datatype(arity="1", 
+            entityURI=constructs.URI(uri="#t"))
+        self.assertFalse(hasattr(datatype, '__dict__'))
+        self.assertEqual(datatype.association('arity'), "1")
+
+    def test_attribute_access(self):
+        """Associations can be read and written as attributes."""
+        uri = constructs.URI(uri="#x")
+        individual = constructs.Individual()
+        individual.entityURI = uri
+        self.assertTrue(individual.entityURI is uri)
+        self.assertTrue(individual.association('entityURI') is uri)
+        self.assertEqual(list(uri.ref_objects('Individual')), [individual])
+
+        ont = constructs.Ontology()
+        ont.axioms = [constructs.Declaration(entity=individual)]
+        self.assertEqual(len(ont.axioms), 1)
+        ont.axioms = None
+        self.assertEqual(ont.axioms, None)
+
+    def test_association_descriptor(self):
+        """The association is available from the class."""
+        self.assertTrue(isinstance(constructs.Ontology.axioms, 
+            constructs.AssociationConstruct))
+        self.assertEqual(constructs.Ontology.axioms.id(), "axioms")
+        self.assertEqual([i.id() for i in constructs.URI.associations()], 
+            ["uri"])
+
+    def test_introspection(self):
+        """Class metadata is available as tuples and booleans."""
+        self.assertTrue(constructs.OWLEntity.is_abstract())
+        self.assertFalse(constructs.Individual.is_abstract())
+        self.assertEqual(set(constructs.OWLEntity.child_classes()), 
+            set([constructs.Datatype, constructs.ObjectProperty, 
+            constructs.DataProperty, constructs.Individual, 
+            constructs.OWLClass]))
+        self.assertEqual(constructs.Declaration.child_classes(), ())
+        self.assertTrue(constructs.Declaration in 
+            constructs.OWLEntity.ref_classes())
+        self.assertTrue(constructs.Declaration.associations() is
+            constructs.Declaration.associations())
+
+    def test_positional(self):
+        """Positional arguments are assigned in model order."""
+        decl = constructs.Declaration(constructs.Individual(
+            constructs.URI("#x")))
+        self.assertEqual(decl.entity.entityURI.uri, "#x")
+
+    def test_positional_optional(self):
+        """Optional associations only take arguments when there are enough."""
+        namespace = constructs.Namespace("foo", "<http://bob.sh/#>")
+        self.assertEqual(namespace.prefix, "foo")
+        self.assertEqual(namespace.IRI, "<http://bob.sh/#>")
+
+        namespace = constructs.Namespace("<http://bob.sh/#>")
+        self.assertEqual(namespace.prefix, None)
+        self.assertEqual(namespace.IRI, "<http://bob.sh/#>")
+
+    def test_positional_and_named(self):
+        """Positional and named arguments can be mixed."""
+        namespace = constructs.Namespace("<http://bob.sh/#>", prefix="foo")
+        self.assertEqual(namespace.prefix, "foo")
+        self.assertEqual(namespace.IRI, "<http://bob.sh/#>")
+
+    def test_bulk(self):
+        """Objects can be created in bulk from tuples and dictionaries."""
+        uris = constructs.URI.bulk([("#foot", ), ("#shin", )])
+        individuals = constructs.Individual.bulk([(i, ) for i in uris])
+        declarations = constructs.Declaration.bulk([{'entity': i} 
+            for i in individuals])
+        
+        self.assertEqual([i.entity.entityURI.uri for i in declarations], 
+            ["#foot", "#shin"])
+        self.assertEqual(list(uris[0].ref_objects('Individual')), 
+            [individuals[0]])
+        self.assertEqual(list(individuals[1].ref_objects('Declaration')), 
+            [declarations[1]])
+        self.assertEqual(set(self.universe.get_objects("Declaration")), 
+            set(declarations))
+
+    def test_bulk_shared_reference(self):
+        """Bulk references to a shared object are wired together."""
+        datatype = constructs.URI("#string")
+        constants = constructs.Constant.bulk([("a", datatype), 
+            ("b", datatype)])
+        self.assertEqual(list(datatype.ref_objects('Constant')), constants)
+
+    def test_bulk_custom(self):
+        """Custom classes fall back to their own constructor."""
+        labels = constructs.Label.bulk([("foo", ), ("bar", )])
+        self.assertEqual([i.annotationURI.uri for i in labels], 
+            ["rdf:label", "rdf:label"])
+
+    def test_references(self):
+        """Reverse references are deduplicated sets, and can be removed."""
+        uri = constructs.URI("#string")
+        constant = constructs.Constant("a", uri)
+        uri.add_reference('datatypeURI', constant)
+        self.assertEqual(list(uri.ref_objects('Constant')), [constant])
+        self.assertEqual(list(uri.Constant()), [constant])
+        self.assertTrue(uri.has_reference('datatypeURI', constant))
+        self.assertEqual(len(uri.ref_objects('Constant', 'datatypeURI')), 1)
+        self.assertEqual(len(uri.ref_objects('Individual')), 0)
+
+        uri.remove_reference('datatypeURI', constant)
+        self.assertFalse(uri.has_reference('datatypeURI', constant))
+        self.assertEqual(len(uri.ref_objects('Constant')), 0)
+
+    def test_references_view(self):
+        """References are returned as a live view."""
+        uri = constructs.URI("#string")
+        constant = constructs.Constant("a", uri)
+        view = uri.ref_objects('Constant')
+        other = constructs.Constant("b", uri)
+        self.assertEqual(list(view), [constant, other])
+
+    def test_reassign_unwires(self):
+        """Replacing a value removes the old reverse reference."""
+        first = constructs.Individual(constructs.URI("#first"))
+        second = constructs.Individual(constructs.URI("#second"))
+        decl = constructs.Declaration(first)
+        decl.entity = second
+        self.assertEqual(len(first.ref_objects('Declaration')), 0)
+        self.assertEqual(list(second.ref_objects('Declaration')), [decl])
+        
+        # The head cardinality of the first individual is free again
+        constructs.Declaration(first)
+
+    def test_list_reassign_unwires(self):
+        """Replacing a list removes reverse references of dropped members."""
+        first = constructs.Declaration(constructs.Individual())
+        second = constructs.Declaration(constructs.Individual())
+        ont = constructs.Ontology(axioms=[first, second])
+        ont.axioms = [second]
+        self.assertEqual(len(first.ref_objects('Ontology')), 0)
+        self.assertEqual(list(second.ref_objects('Ontology')), [ont])
+
+    #------------------------------------------------------- Failure test cases
+    def test_head_cardinality(self):
+        """An entity can only be declared once."""
+        individual = constructs.Individual(constructs.URI("#x"))
+        decl = constructs.Declaration(individual)
+        self.assertRaises(SchemaException, constructs.Declaration, individual)
+        
+        # Setting the same value again is not a second reference
+        decl.entity = individual
+
+    def test_bulk_head_cardinality(self):
+        """Bulk creation still enforces head cardinality."""
+        individual = constructs.Individual(constructs.URI("#x"))
+        self.assertRaises(Exception, constructs.Declaration.bulk, 
+            [(individual, ), (individual, )])
+
+    def test_bulk_head_cardinality_unwired(self):
+        """A failed bulk creation leaves no references behind."""
+        foot = constructs.Individual(constructs.URI("#foot"))
+        shin = constructs.Individual(constructs.URI("#shin"))
+        self.assertRaises(SchemaException, constructs.Declaration.bulk, 
+            [(foot, ), (shin, ), (shin, )])
+        self.assertEqual(len(foot.ref_objects("Declaration", "entity")), 0)
+        self.assertEqual(len(shin.ref_objects("Declaration", "entity")), 0)
+        declaration = constructs.Declaration(foot)
+        self.assertIs(declaration.entity, foot)
+
+    def test_arity(self):
+        """Too many or too few positional arguments are rejected."""
+        self.assertRaises(SchemaException, constructs.Namespace, "a", "b", "c")
+        self.assertRaises(SchemaException, constructs.Constant, "foo")
+
+    def test_abstract(self):
+        """Abstract classes cannot be instantiated."""
+        self.assertRaises(Exception, constructs.OWLEntity)
+
+    def test_singleton_type(self):
+        """Singletons must be given a value of the right type."""
+        individual = constructs.Individual()
+        self.assertRaises(SchemaException, setattr, individual, 'entityURI', 
+            "#x")
+        self.assertRaises(SchemaException, setattr, 
+            constructs.URI(uri="#x"), 'uri', 1)
+
+    def test_list_type(self):
+        """Non-singletons must be given a list."""
+        self.assertRaises(SchemaException, setattr, constructs.Ontology(), 
+            'axioms', constructs.Declaration())
+
+    def test_unknown_class(self):
+        """Unknown classes are still attribute errors."""
+        self.assertRaises(AttributeError, getattr, constructs, 'Foo')
+        self.assertRaises(KeyError, self.universe.get_class, 'Foo')
+
+
+class AssociationLists(TestCase):
+    """Tests related to the lists holding non-singleton associations."""
+
+    #------------------------------------------------------------------ Fixture
+    def setUp(self):
+        """Create a universe with an ontology and some declarations."""
+        self.universe = OwlUniverse()
+        self.declarations = [constructs.Declaration(constructs.Individual(
+            constructs.URI(i))) for i in ("#foot", "#shin", "#knee")]
+        self.ontology = constructs.Ontology(axioms=[])
+
+    def tearDown(self):
+        """Reset the universe."""
+        self.universe = None
+
+    def referenced(self):
+        """The declarations that reference the ontology."""
+        return [i for i in self.declarations 
+            if len(i.ref_objects('Ontology')) > 0]
+
+    #------------------------------------------------------- Success test cases
+    def test_extend(self):
+        """Extending and += wire up reverse references."""
+        foot, shin, knee = self.declarations
+        self.ontology.axioms.extend([foot, shin])
+        self.ontology.axioms += [knee]
+        self.assertEqual(list(self.ontology.axioms), self.declarations)
+        self.assertEqual(self.referenced(), self.declarations)
+
+    def test_insert_setitem(self):
+        """Inserting and assigning wire and unwire reverse references."""
+        foot, shin, knee = self.declarations
+        axioms = self.ontology.axioms
+        axioms.insert(0, foot)
+        axioms[0] = shin
+        self.assertEqual(self.referenced(), [shin])
+        axioms[:] = [foot, knee]
+        self.assertEqual(self.referenced(), [foot, knee])
+
+    def test_removal(self):
+        """Removing members unwires them."""
+        foot, shin, knee = self.declarations
+        axioms = self.ontology.axioms
+        axioms.extend([foot, shin, knee])
+        axioms.remove(foot)
+        self.assertEqual(self.referenced(), [shin, knee])
+        del axioms[0]
+        self.assertEqual(axioms.pop(), knee)
+        self.assertEqual(self.referenced(), [])
+        axioms.append(knee)
+        self.assertIn(knee, axioms)
+        self.assertNotIn(foot, axioms)
+        axioms.clear()
+        self.assertEqual(self.referenced(), [])
+
+    def test_events(self):
+        """Appends fire APPENDED events, other changes SET events."""
+        foot, shin, knee = self.declarations
+        deliveries = []
+        self.universe.subscribe(deliveries.append)
+        self.ontology.axioms.extend([foot, shin])
+        del self.ontology.axioms[0]
+        
+        self.assertEqual([[i.kind for i in n] for n in deliveries], 
+            [['appended', 'appended'], ['set']])
+        self.assertEqual(deliveries[1][0].old, [foot, shin])
+
+    #------------------------------------------------------- Failure test cases
+    def test_type(self):
+        """Every way of adding members checks their type."""
+        axioms = self.ontology.axioms
+        uri = constructs.URI("#hip")
+        self.assertRaises(SchemaException, axioms.append, uri)
+        self.assertRaises(SchemaException, axioms.extend, 
+            [self.declarations[0], uri])
+        self.assertRaises(SchemaException, axioms.insert, 0, uri)
+        self.assertRaises(SchemaException, axioms.__iadd__, [uri])
+        axioms.append(self.declarations[0])
+        self.assertRaises(SchemaException, axioms.__setitem__, 0, uri)
+        self.assertRaises(SchemaException, axioms.__setitem__, 
+            slice(0, 1), [uri])
+        self.assertEqual(list(axioms), [self.declarations[0]])
+        self.assertEqual(self.referenced(), [self.declarations[0]])
+
+    def test_unique(self):
+        """Members of unique associations are only added once."""
+        foot, shin, knee = self.declarations
+        axioms = self.ontology.axioms
+        axioms.extend([foot, shin, foot])
+        axioms.append(shin)
+        axioms.insert(0, foot)
+        self.assertEqual(list(axioms), [foot, shin])
+        
+        axioms[0:1] = [knee, shin]
+        self.assertEqual(list(axioms), [knee, shin])
+        self.assertRaises(SchemaException, axioms.__setitem__, 0, shin)
+        self.assertEqual(list(axioms), [knee, shin])
+        self.assertEqual(self.referenced(), [shin, knee])
+
+    def test_structural(self):
+        """Structurally equal members can be treated as duplicates."""
+        universe = OwlUniverse(structural=True)
+        individual = constructs.Individual(constructs.URI("#hip"))
+        first = constructs.Declaration(individual)
+        ontology = constructs.Ontology(axioms=[first])
+        second = constructs.Declaration(constructs.Individual(
+            constructs.URI("#hip")))
+        ontology.axioms.append(second)
+        ontology.axioms.append(constructs.Declaration(constructs.Individual(
+            constructs.URI("#knee"))))
+        self.assertEqual(len(ontology.axioms), 2)
+        self.assertIn(second, ontology.axioms)
+        self.assertEqual(len(second.ref_objects('Ontology')), 0)
+        
+        labels = [constructs.Label("hip"), constructs.Label("hip")]
+        ontology.annotations = labels
+        self.assertEqual(list(ontology.annotations), labels[:1])
+        self.assertIn(labels[1], ontology.annotations)
@@ -0,0 +1,246 @@
+"""
+:Copyright: |copy| 2008 by Adrian Hare and Kenneth Barber.
+
+.. |copy| unicode:: 0xA9 .. copyright sign
+
+:license: 
+    This file is part of OWLSugar.
+
+    OWLSugar is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    OWLSugar is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+:Version: $Rev$
+
+Tests on the object model configuration.
+
+"""
+
+__docformat__ = 'restructuredtext en'
+__version__ = '$Rev$'
+
+import os
+import shutil
+import sys
+import tempfile
+from unittest import TestCase
+
+from owlsugar.model import ModelConfig
+from owlsugar.exceptions import ModelConfigException
+
+CONF = os.path.join(os.path.dirname(__file__), '..', '..', 'conf')
+MODEL = os.path.join(CONF, 'owl11.xml')
+SCHEMA = os.path.join(CONF, 'ObjectModel.xsd')
+
+
+def write_model(body):
+    """Write a throw-away model file containing the given class elements.
+    
+        body: XML class elements
+        Returns: filename of the new model
+    
+    """
+    handle, filename = tempfile.mkstemp(suffix='.xml')
+    os.write(handle, ('<model xmlns="http://organictechnology.net/schema/'
+        'ObjectModel.xsd">%s</model>' % body).encode('utf-8'))
+    os.close(handle)
+    return filename
+
+
+class ModelHierarchy(TestCase):
+    """Tests related to the resolved class hierarchy."""
+
+    #------------------------------------------------------------------ Fixture
+    def setUp(self):
+        """Load the OWL 1.1 model."""
+        self.model = ModelConfig(MODEL, schema=SCHEMA)
+
+    def tearDown(self):
+        """Reset the model."""
+        self.model = None
+
+    #------------------------------------------------------- Success test cases
+    def test_classes_ordered(self):
+        """Every class must come after all of its parents."""
+        classes = self.model.classes()
+        self.assertEqual(len(classes), len(set(classes)))
+        for classname in classes:
+            for parent in self.model.class_parents(classname):
+                self.assertTrue(classes.index(parent) < 
+                    classes.index(classname))
+
+    def test_class_parents(self):
+        """Parents are returned in order of seniority without duplicates."""
+        self.assertEqual(self.model.class_parents("Datatype"), 
+            ["DataRange", "OWLEntity"])
+        self.assertEqual(self.model.class_parents("URI"), [])
+
+    def test_class_children(self):
+        """Children are the reverse of parents."""
+        self.assertEqual(sorted(self.model.class_children("OWLEntity")), 
+            ["DataProperty", "Datatype", "Individual", "OWLClass", 
+            "ObjectProperty"])
+        self.assertEqual(self.model.class_children("Declaration"), [])
+
+    def test_associations_inherited(self):
+        """Inherited associations follow the class's own associations."""
+        self.assertEqual(self.model.associations("Declaration"), 
+            ["entity", "annotations"])
+        self.assertEqual(self.model.associations("AnnotationByConstant"), 
+            ["annotationValue", "annotationURI"])
+
+    def test_association_info(self):
+        """Association records are resolved, typed and inherited."""
+        info = self.model.association_info("Declaration", "entity")
+        self.assertEqual(info.type, "OWLEntity")
+        self.assertEqual(info.min_cardinality, 1)
+        self.assertEqual(info.max_cardinality, 1)
+        self.assertEqual(info.head_cardinality, 1)
+        self.assertTrue(info.unique)
+
+        info = self.model.association_info("Declaration", "annotations")
+        self.assertEqual(info.classid, "Axiom")
+        self.assertEqual(info.max_cardinality, None)
+        self.assertEqual(info.head_cardinality, None)
+
+    def test_association_descriptions(self):
+        """Description elements do not disturb the streamed loader."""
+        filename = write_model('<class id="A"><association id="x" type="A" '
+            'minCardinality="0"><description>x</description></association>'
+            '<association id="y" type="A" minCardinality="0"/>'
+            '<description>A</description></class>'
+            '<class id="B" parentage="A"/>')
+        try:
+            model = ModelConfig(filename, schema=SCHEMA)
+        finally:
+            os.remove(filename)
+        self.assertEqual(model.associations("B"), ["x", "y"])
+
+    def test_association_override(self):
+        """A class's own association wins over an inherited one."""
+        info = self.model.association_info("AnnotationByEntity", 
+            "annotationValue")
+        self.assertEqual(info.type, "OWLEntity")
+        self.assertEqual(self.model.association_attr("AnnotationByEntity", 
+            "annotationValue")['type'], "OWLEntity")
+
+    def test_results_are_copies(self):
+        """Modifying a returned list must not affect the model."""
+        self.model.class_children("OWLEntity").append("Foo")
+        self.assertFalse("Foo" in self.model.class_children("OWLEntity"))
+
+    def test_class_primary(self):
+        """Primary associations are inherited from the nearest parent."""
+        self.assertEqual(self.model.class_primary("URI"), "uri")
+        self.assertEqual(self.model.class_primary("Individual"), "entityURI")
+        self.assertEqual(self.model.class_primary("Declaration"), None)
+
+    #------------------------------------------------------- Failure test cases
+    def test_inheritance_cycle(self):
+        """Cyclic parentage is reported rather than looping."""
+        filename = write_model('<class id="A" parentage="B"/>'
+            '<class id="B" parentage="A"/>')
+        try:
+            self.assertRaises(ModelConfigException, ModelConfig, filename)
+        finally:
+            os.remove(filename)
+
+    def test_schema_validation(self):
+        """Models are validated against the schema while they are streamed."""
+        from lxml.etree import DocumentInvalid
+        filename = write_model('<class id="A">'
+            '<association id="x" type="A"/></class>')
+        try:
+            self.assertRaises(DocumentInvalid, ModelConfig, filename, 
+                schema=SCHEMA)
+        finally:
+            os.remove(filename)
+
+    def test_invalid_primary(self):
+        """A primary association must be an association of the class."""
+        filename = write_model('<class id="A" primaryAssociation="x"/>')
+        try:
+            model = ModelConfig(filename)
+            self.assertRaises(ModelConfigException, model.class_primary, "A")
+        finally:
+            os.remove(filename)
+
+    def test_invalid_parent(self):
+        """A parent must be a class in the model."""
+        filename = write_model('<class id="A" parentage="Z"/>')
+        try:
+            self.assertRaises(ModelConfigException, ModelConfig, filename)
+        finally:
+            os.remove(filename)
+
+
+class ModelCache(TestCase):
+    """Tests related to the compiled model cache."""
+
+    #------------------------------------------------------------------ Fixture
+    def setUp(self):
+        """Create an empty cache directory."""
+        self.cache = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the cache directory."""
+        shutil.rmtree(self.cache)
+
+    #------------------------------------------------------- Success test cases
+    def test_cache_written(self):
+        """Loading a model with a cache directory compiles it there."""
+        ModelConfig(MODEL, schema=SCHEMA, cache=self.cache)
+        self.assertEqual(len(os.listdir(self.cache)), 1)
+
+    def test_cache_hit_matches(self):
+        """A model loaded from the cache is the same as a parsed one."""
+        parsed = ModelConfig(MODEL, schema=SCHEMA, cache=self.cache)
+        cached = ModelConfig(MODEL, schema=SCHEMA, cache=self.cache)
+        self.assertEqual(cached.classes(), parsed.classes())
+        for classname in parsed.classes():
+            self.assertEqual(cached.associations(classname), 
+                parsed.associations(classname))
+            self.assertEqual(cached.references(classname), 
+                parsed.references(classname))
+            for attr in parsed.associations(classname):
+                self.assertEqual(cached.association_info(classname, attr), 
+                    parsed.association_info(classname, attr))
+            self.assertEqual(sorted(cached.class_children(classname)), 
+                sorted(parsed.class_children(classname)))
+
+    def test_cache_hit_skips_xml(self):
+        """A cache hit must not need lxml at all."""
+        ModelConfig(MODEL, schema=SCHEMA, cache=self.cache)
+        saved = dict((k, v) for k, v in sys.modules.items() 
+            if k.startswith('lxml'))
+        for k in saved:
+            sys.modules[k] = None
+        try:
+            ModelConfig(MODEL, schema=SCHEMA, cache=self.cache)
+        finally:
+            sys.modules.update(saved)
+
+    def test_cache_keyed_on_content(self):
+        """A different model compiles to a different cache file."""
+        filename = write_model('<class id="A"/>')
+        try:
+            ModelConfig(MODEL, cache=self.cache)
+            ModelConfig(filename, cache=self.cache)
+        finally:
+            os.remove(filename)
+        self.assertEqual(len(os.listdir(self.cache)), 2)
+
+    def test_corrupt_cache_ignored(self):
+        """A damaged cache file falls back to parsing the XML."""
+        ModelConfig(MODEL, schema=SCHEMA, cache=self.cache)
+        for i in os.listdir(self.cache):
+            with open(os.path.join(self.cache, i), 'wb') as handle:
+                handle.write(b'garbage')
+        model = ModelConfig(MODEL, schema=SCHEMA, cache=self.cache)
+        self.assertTrue("Declaration" in model.classes())
@@ -0,0 +1,181 @@
+"""
+:Copyright: |copy| 2008 by Adrian Hare and Kenneth Barber.
+
+.. |copy| unicode:: 0xA9 .. copyright sign
+
+:license: 
+    This file is part of OWLSugar.
+
+    OWLSugar is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    OWLSugar is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+:Version: $Rev$
+
+Tests on merging universes and building them in parallel.
+
+"""
+
+__docformat__ = 'restructuredtext en'
+__version__ = '$Rev$'
+
+import pickle
+from unittest import TestCase
+
+from owlsugar import OwlUniverse
+from owlsugar import parallel
+from owlsugar.exceptions import SchemaException
+import owlsugar.constructs as constructs
+
+
+def build_individual(record):
+    """Builder for the parallel tests. Builders must be module level."""
+    individual = constructs.Individual(constructs.URI(record))
+    constructs.Declaration(individual)
+    constructs.AnnotationByConstant(annotationURI=constructs.URI("rdfs:label"),
+        annotationValue=constructs.Constant(record, 
+        constructs.URI("xsd:string")))
+
+
+class UniverseMerge(TestCase):
+    """Tests related to merging universes."""
+
+    #------------------------------------------------------------------ Fixture
+    def setUp(self):
+        """Create a universe with a shared URI, and a second universe."""
+        self.universe = OwlUniverse()
+        self.uri = constructs.URI("#shared")
+        self.other = OwlUniverse(default=False)
+        with self.other.activate():
+            self.shared = constructs.Individual(constructs.URI("#shared"))
+            self.own = constructs.Individual(constructs.URI("#own"))
+
+    def tearDown(self):
+        """Reset the universes."""
+        self.universe = None
+        self.other = None
+
+    #------------------------------------------------------- Success test cases
+    def test_merge(self):
+        """Merged objects are registered, and equal URIs are shared."""
+        self.universe.merge(self.other)
+        self.assertEqual(self.universe.count_objects("URI"), 2)
+        self.assertEqual(self.universe.count_objects("Individual"), 2)
+        self.assertIs(self.shared.entityURI, self.uri)
+        self.assertIs(self.shared.universe(), self.universe)
+        self.assertIs(self.universe.lookup("Individual", "#own"), self.own)
+
+    def test_references(self):
+        """Reverse references are rebuilt in the merged universe."""
+        self.universe.merge(self.other)
+        self.assertEqual(list(self.uri.ref_objects("Individual")), 
+            [self.shared])
+        self.assertEqual(list(self.own.entityURI.ref_objects("Individual")),
+            [self.own])
+
+    def test_merge_pickled(self):
+        """Unpickled objects can be merged."""
+        objects = pickle.loads(pickle.dumps(self.other.get_objects("URI") + 
+            self.other.get_objects("Individual")))
+        self.assertEqual(objects[0].universe(), None)
+        
+        self.universe.merge(objects)
+        self.assertEqual(self.universe.count_objects("URI"), 2)
+        self.assertIs(self.universe.lookup("Individual", "#shared").entityURI,
+            self.uri)
+
+    def test_merge_lists(self):
+        """Lists are remapped and wired up as well."""
+        with self.other.activate():
+            ontology = constructs.Ontology(constructs.URI("#shared"), 
+                axioms=[constructs.Declaration(self.shared)])
+        self.universe.merge(self.other)
+        self.assertIs(ontology.ontologyURI, self.uri)
+        self.assertEqual(list(ontology.axioms[0].ref_objects("Ontology")), 
+            [ontology])
+
+
+    def test_merge_labels(self):
+        """Labels with the same text keep constants of their own."""
+        first = constructs.Label("hello")
+        with self.other.activate():
+            second = constructs.Label("hello")
+        self.universe.merge(self.other)
+        self.assertEqual(self.universe.count_objects("Constant"), 2)
+        self.assertIs(first.annotationURI, second.annotationURI)
+
+    def test_merge_later_terminals(self):
+        """Terminals created after a merge are found by the next one."""
+        self.universe.merge(self.other)
+        uri = constructs.URI("#later")
+        other = OwlUniverse(default=False)
+        with other.activate():
+            individual = constructs.Individual(constructs.URI("#later"))
+        self.universe.merge(other)
+        self.assertIs(individual.entityURI, uri)
+
+    def test_merge_pickled_label(self):
+        """Labels can be pickled and merged."""
+        with self.other.activate():
+            constructs.Label("hello")
+        objects = pickle.loads(pickle.dumps(self.other.get_objects(
+            "Annotation") + self.other.get_objects("Constant")))
+        self.assertEqual(objects[0].__class__, constructs.Label)
+        self.assertRaises(SchemaException, self.universe.merge, objects)
+        
+        self.universe.merge(objects + [objects[0].annotationURI])
+        self.assertIs(self.universe.lookup("Annotation", "rdf:label"), 
+            objects[0])
+
+    #------------------------------------------------------- Failure test cases
+    def test_merge_atomic(self):
+        """A merge that breaks the schema changes nothing."""
+        foot = constructs.Individual(constructs.URI("#foot"))
+        declaration = constructs.Declaration(foot)
+        clone = constructs._restore(constructs.Declaration)
+        clone.__setstate__({'entity': foot})
+        
+        self.assertRaises(SchemaException, self.universe.merge, 
+            self.other.get_objects("Individual") + [clone])
+        self.assertEqual(clone.universe(), None)
+        self.assertIs(self.shared.universe(), self.other)
+        self.assertEqual(list(foot.ref_objects("Declaration")), 
+            [declaration])
+        self.assertEqual(self.universe.count_objects("Individual"), 1)
+
+
+class ParallelBuild(TestCase):
+    """Tests related to building a universe with worker processes."""
+
+    #------------------------------------------------------------------ Fixture
+    def setUp(self):
+        """Create a universe to build into."""
+        self.universe = OwlUniverse()
+
+    def tearDown(self):
+        """Reset the universe."""
+        self.universe = None
+
+    #------------------------------------------------------- Success test cases
+    def test_build(self):
+        """Shards built by the workers are merged into the universe."""
+        records = ["#%s" % i for i in range(50)]
+        parallel.build(iter(records), build_individual, workers=2, 
+            shard_size=7)
+        
+        self.assertEqual(self.universe.count_objects("Individual"), 50)
+        self.assertEqual(self.universe.count_objects("Declaration"), 50)
+        self.assertEqual(self.universe.count_objects("Constant"), 50)
+        self.assertEqual(self.universe.count_objects("URI"), 52)
+        
+        label = self.universe.lookup("URI", "rdfs:label")
+        self.assertEqual(len(label.ref_objects("AnnotationByConstant")), 50)
+        self.assertEqual(set(self.universe.query("Declaration")
+            .join("entity").join("entityURI").select("uri")), 
+            set([(i, ) for i in records]))
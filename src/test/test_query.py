@@ -0,0 +1,134 @@
+"""
+:Copyright: |copy| 2008 by Adrian Hare and Kenneth Barber.
+
+.. |copy| unicode:: 0xA9 .. copyright sign
+
+:license: 
+    This file is part of OWLSugar.
+
+    OWLSugar is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    OWLSugar is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+:Version: $Rev$
+
+Tests on universe queries.
+
+"""
+
+__docformat__ = 'restructuredtext en'
+__version__ = '$Rev$'
+
+from unittest import TestCase
+
+from owlsugar import OwlUniverse
+import owlsugar.constructs as constructs
+
+
+class UniverseQuery(TestCase):
+    """Tests related to querying the objects of a universe."""
+
+    #------------------------------------------------------------------ Fixture
+    def setUp(self):
+        """Create a universe with a small ontology."""
+        self.universe = OwlUniverse()
+        self.foot = constructs.Individual(constructs.URI("#foot"))
+        self.shin = constructs.Individual(constructs.URI("#shin"))
+        self.leg = constructs.OWLClass(constructs.URI("#Leg"))
+        self.declarations = [constructs.Declaration(i) for i in 
+            (self.foot, self.shin, self.leg)]
+        self.ontology = constructs.Ontology(constructs.URI("#body"), 
+            axioms=list(self.declarations))
+
+    def tearDown(self):
+        """Reset the universe."""
+        self.universe = None
+
+    #------------------------------------------------------- Success test cases
+    def test_all(self):
+        """A query without steps returns every object of the class."""
+        query = self.universe.query("OWLEntity")
+        self.assertEqual(set(query), set([self.foot, self.shin, self.leg]))
+        self.assertEqual(query.count(), 3)
+        self.assertEqual(query.explain(), "type registry of OWLEntity")
+
+    def test_where_primary(self):
+        """Matching the primary association uses the primary key index."""
+        query = self.universe.query("OWLEntity").where(entityURI="#shin")
+        self.assertEqual(list(query), [self.shin])
+        self.assertTrue(query.explain().startswith("primary key index"))
+        
+        query = self.universe.query("Individual").where(
+            entityURI=self.leg.entityURI)
+        self.assertEqual(list(query), [])
+
+    def test_where_reference(self):
+        """Matching a construct uses its reverse references."""
+        query = self.universe.query("Axiom").where(entity=self.foot)
+        self.assertEqual(list(query), [self.declarations[0]])
+        self.assertTrue(query.explain().startswith("reverse references"))
+
+    def test_where_shared_key(self):
+        """Constructs sharing a primary key match each other's referrers."""
+        first = constructs.Individual(constructs.URI("#x"))
+        second = constructs.Individual(constructs.URI("#x"))
+        declaration = constructs.Declaration(second)
+        query = self.universe.query("Declaration").where(entity=first)
+        self.assertEqual(list(query), [declaration])
+        self.assertEqual(list(query.where(entity=first)), [declaration])
+
+    def test_where_list(self):
+        """Lists match if any of their members match."""
+        query = self.universe.query("Ontology").where(
+            axioms=self.declarations[1])
+        self.assertEqual(list(query), [self.ontology])
+
+    def test_filter(self):
+        """Predicates filter objects or association values."""
+        query = self.universe.query("URI").filter(
+            lambda uri: uri.startswith("#s"), "uri")
+        self.assertEqual(list(query), [self.shin.entityURI])
+        query = self.universe.query("Individual").filter(
+            lambda obj: obj is self.foot)
+        self.assertEqual(list(query), [self.foot])
+
+    def test_join(self):
+        """Joins follow associations, including lists."""
+        query = self.universe.query("Ontology").join("axioms").join("entity") \
+            .join("entityURI").select("uri")
+        self.assertEqual(list(query), [("#foot", ), ("#shin", ), ("#Leg", )])
+
+    def test_referenced_by(self):
+        """Reverse references can be followed."""
+        query = self.universe.query("Individual").where(entityURI="#foot") \
+            .referenced_by("Axiom").referenced_by("Ontology", "axioms")
+        self.assertEqual(list(query), [self.ontology])
+
+    def test_distinct(self):
+        """Distinct drops repeated results."""
+        query = self.universe.query("Declaration").join("entity") \
+            .referenced_by("Declaration").join("entity").distinct()
+        self.assertEqual(query.count(), 3)
+
+    def test_lazy(self):
+        """Queries are evaluated as they are iterated."""
+        query = self.universe.query("Individual")
+        individual = constructs.Individual(constructs.URI("#knee"))
+        self.assertTrue(individual in list(query))
+        self.assertEqual(self.universe.query("Axiom").first() in 
+            self.declarations, True)
+        self.assertEqual(self.universe.query("Individual").where(
+            entityURI="#knee").first(), individual)
+        self.assertEqual(self.universe.query("Individual").where(
+            entityURI="#hand").first(), None)
+
+    #------------------------------------------------------- Failure test cases
+    def test_unknown_class(self):
+        """Queries must start from a class in the model."""
+        self.assertRaises(Exception, self.universe.query, "Nothing")
@@ -0,0 +1,133 @@
+"""
+:Copyright: |copy| 2008 by Adrian Hare and Kenneth Barber.
+
+.. |copy| unicode:: 0xA9 .. copyright sign
+
+:license: 
+    This file is part of OWLSugar.
+
+    OWLSugar is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    OWLSugar is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+:Version: $Rev$
+
+Tests on universe snapshots.
+
+"""
+
+__docformat__ = 'restructuredtext en'
+__version__ = '$Rev$'
+
+import os
+import tempfile
+from unittest import TestCase
+
+from owlsugar import OwlUniverse
+from owlsugar import snapshot
+from owlsugar.exceptions import SnapshotException
+import owlsugar.constructs as constructs
+
+
+class UniverseSnapshot(TestCase):
+    """Tests related to saving and loading snapshots."""
+
+    #------------------------------------------------------------------ Fixture
+    def setUp(self):
+        """Create a universe with a small ontology."""
+        self.universe = OwlUniverse()
+        individuals = [constructs.Individual(constructs.URI(i)) 
+            for i in ("#foot", "#shin", "#kn\u00e9e")]
+        self.ontology = constructs.Ontology(constructs.URI("#body"), 
+            axioms=[constructs.Declaration(i) for i in individuals])
+        constructs.Label("foot")
+        constructs.Label("shin")
+        
+        handle, self.filename = tempfile.mkstemp(suffix='.snap')
+        os.close(handle)
+
+    def tearDown(self):
+        """Remove the snapshot and reset the universe."""
+        os.remove(self.filename)
+        self.universe = None
+
+    #------------------------------------------------------- Success test cases
+    def test_roundtrip(self):
+        """Every object and association survives a snapshot."""
+        snapshot.save(self.universe, self.filename)
+        universe = OwlUniverse()
+        snapshot.load(self.filename)
+        
+        for classname in ("Individual", "Declaration", "Ontology", 
+            "Annotation", "Constant"):
+            self.assertEqual(universe.count_objects(classname), 
+                self.universe.count_objects(classname))
+        
+        # The two labels keep a rdf:label URI each
+        self.assertEqual(universe.count_objects("URI"), 
+            self.universe.count_objects("URI"))
+        
+        ontology = universe.lookup("Ontology", "#body")
+        self.assertEqual([i.entity.entityURI.uri for i in ontology.axioms], 
+            ["#foot", "#shin", "#kn\u00e9e"])
+
+    def test_references(self):
+        """Reverse references are rebuilt on load."""
+        snapshot.save(self.universe, self.filename)
+        universe = OwlUniverse()
+        snapshot.load(self.filename)
+        
+        individual = universe.lookup("Individual", "#shin")
+        declaration = list(individual.ref_objects("Declaration"))[0]
+        self.assertEqual(list(declaration.ref_objects("Ontology")), 
+            [universe.lookup("Ontology", "#body")])
+        for label in universe.lookup_all("URI", "rdf:label"):
+            self.assertEqual(len(label.ref_objects("AnnotationByConstant")), 
+                1)
+
+    def test_strings_shared(self):
+        """Repeated strings are only stored once."""
+        snapshot.save(self.universe, self.filename)
+        with open(self.filename, 'rb') as stream:
+            self.assertEqual(stream.read().count(b'rdf:label'), 1)
+
+    def test_load_populated(self):
+        """Loading into a populated universe leaves its objects alone."""
+        snapshot.save(self.universe, self.filename)
+        universe = OwlUniverse()
+        uri = constructs.URI("#foot")
+        snapshot.load(self.filename)
+        self.assertIsNot(universe.lookup("Individual", "#foot").entityURI, 
+            uri)
+        self.assertEqual(len(universe.lookup_all("URI", "#foot")), 2)
+
+    def test_same_labels(self):
+        """Labels with the same text survive a snapshot."""
+        constructs.Label("foot")
+        snapshot.save(self.universe, self.filename)
+        universe = OwlUniverse()
+        snapshot.load(self.filename)
+        self.assertEqual(universe.count_objects("Annotation"), 3)
+        self.assertEqual(universe.count_objects("Constant"), 3)
+
+    #------------------------------------------------------- Failure test cases
+    def test_not_a_snapshot(self):
+        """Files that are not snapshots are rejected."""
+        with open(self.filename, 'wb') as stream:
+            stream.write(b'<model/>')
+        self.assertRaises(SnapshotException, snapshot.load, self.filename)
+
+    def test_truncated(self):
+        """Truncated snapshots are rejected."""
+        snapshot.save(self.universe, self.filename)
+        with open(self.filename, 'rb') as stream:
+            data = stream.read()
+        with open(self.filename, 'wb') as stream:
+            stream.write(data[:-20])
+        self.assertRaises(SnapshotException, snapshot.load, self.filename)
@@ -0,0 +1,200 @@
+"""
+:Copyright: |copy| 2008 by Adrian Hare and Kenneth Barber.
+
+.. |copy| unicode:: 0xA9 .. copyright sign
+
+:license: 
+    This file is part of OWLSugar.
+
+    OWLSugar is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    OWLSugar is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+:Version: $Rev$
+
+Tests on storage backends.
+
+"""
+
+__docformat__ = 'restructuredtext en'
+__version__ = '$Rev$'
+
+import gc
+import os
+import tempfile
+from unittest import TestCase
+
+from owlsugar import OwlUniverse
+from owlsugar.exceptions import BatchException, SchemaException, \
+    StorageException
+from owlsugar.storage import SQLiteStorage
+import owlsugar.constructs as constructs
+
+
+class SQLiteUniverse(TestCase):
+    """Tests related to universes stored in SQLite."""
+
+    #------------------------------------------------------------------ Fixture
+    def setUp(self):
+        """Create a SQLite backed universe with a small ontology."""
+        handle, self.filename = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.universe = OwlUniverse(storage=SQLiteStorage(self.filename, 
+            cache_size=5, batch_size=4))
+        
+        individuals = [constructs.Individual(constructs.URI(i)) 
+            for i in ("#foot", "#shin", "#knee")]
+        constructs.Ontology(constructs.URI("#body"), 
+            axioms=[constructs.Declaration(i) for i in individuals])
+        individuals = None
+
+    def tearDown(self):
+        """Close and remove the database."""
+        self.universe._storage.close()
+        self.universe = None
+        os.remove(self.filename)
+
+    def reopen(self):
+        """Reopen the database in a new universe."""
+        self.universe._storage.close()
+        self.universe = OwlUniverse(storage=SQLiteStorage(self.filename))
+
+    #------------------------------------------------------- Success test cases
+    def test_get_objects(self):
+        """Objects are counted and returned from the database."""
+        self.assertEqual(self.universe.count_objects("Individual"), 3)
+        self.assertEqual(self.universe.count_objects("OWLEntity"), 3)
+        self.assertEqual(sorted([i.entityURI.uri for i in 
+            self.universe.get_objects("Individual")]), 
+            ["#foot", "#knee", "#shin"])
+
+    def test_reopen(self):
+        """Objects survive reopening the database."""
+        self.reopen()
+        ontology = self.universe.lookup("Ontology", "#body")
+        self.assertEqual([i.entity.entityURI.uri for i in ontology.axioms],
+            ["#foot", "#shin", "#knee"])
+        self.assertEqual(self.universe.count_objects("URI"), 4)
+
+    def test_identity(self):
+        """Objects in use stay the same object."""
+        individual = self.universe.lookup("Individual", "#foot")
+        for i in range(20):
+            constructs.URI("#%s" % i)
+        self.assertIs(self.universe.lookup("Individual", "#foot"), individual)
+
+    def test_write_back(self):
+        """Changes are written back to the database."""
+        individual = self.universe.lookup("Individual", "#foot")
+        individual.entityURI = constructs.URI("#toe")
+        ontology = self.universe.lookup("Ontology", "#body")
+        ontology.axioms.append(constructs.Declaration(
+            constructs.OWLClass(constructs.URI("#Leg"))))
+        individual = ontology = None
+        
+        self.reopen()
+        self.assertEqual(self.universe.lookup("Individual", "#foot"), None)
+        self.assertNotEqual(self.universe.lookup("Individual", "#toe"), None)
+        self.assertEqual(len(self.universe.lookup("Ontology", 
+            "#body").axioms), 4)
+
+    def test_references(self):
+        """Reverse references are read from the database."""
+        self.reopen()
+        individual = self.universe.lookup("Individual", "#shin")
+        declarations = list(individual.ref_objects("Declaration"))
+        self.assertEqual(len(declarations), 1)
+        self.assertEqual(list(declarations[0].ref_objects("Ontology", 
+            "axioms")), [self.universe.lookup("Ontology", "#body")])
+
+    def test_query(self):
+        """Queries run against the database."""
+        query = self.universe.query("Declaration").join("entity").where(
+            entityURI="#knee")
+        self.assertEqual(query.first().entityURI.uri, "#knee")
+        self.assertEqual(self.universe.query("Individual").where(
+            entityURI="#knee").count(), 1)
+
+    def test_view_objects(self):
+        """Views read through to the database."""
+        view = self.universe.view_objects("OWLEntity")
+        self.assertEqual(len(view), 3)
+        individual = constructs.Individual(constructs.URI("#hip"))
+        self.assertEqual(len(view), 4)
+        self.assertTrue(individual in view)
+
+    def test_del_object(self):
+        """Removed objects are deleted from the database."""
+        individual = constructs.Individual(constructs.URI("#hip"))
+        self.universe.del_object(individual)
+        self.assertEqual(self.universe.count_objects("Individual"), 3)
+        self.assertRaises(Exception, self.universe.del_object, individual)
+
+    def test_bounded_cache(self):
+        """Objects that are no longer used are released."""
+        for i in range(50):
+            constructs.URI("#%s" % i)
+        self.universe.flush()
+        gc.collect()
+        self.assertTrue(len(self.universe._storage._objects) < 20)
+        self.assertEqual(self.universe.count_objects("URI"), 54)
+
+    def test_lazy_references(self):
+        """Objects referred to are only loaded when they are used."""
+        ontology = self.universe.lookup("Ontology", "#body")
+        ontology.axioms.extend([constructs.Declaration(constructs.Individual(
+            constructs.URI("#%s" % i))) for i in range(200)])
+        ontology = None
+        self.universe._storage.close()
+        self.universe = OwlUniverse(storage=SQLiteStorage(self.filename, 
+            cache_size=10))
+        
+        ontology = self.universe.lookup("Ontology", "#body")
+        gc.collect()
+        self.assertTrue(len(self.universe._storage._objects) < 20)
+        self.assertEqual(ontology.ontologyURI.uri, "#body")
+        self.assertEqual(len(ontology.axioms), 203)
+        self.assertEqual(ontology.axioms[-1].entity.entityURI.uri, "#199")
+
+    #------------------------------------------------------- Failure test cases
+    def test_del_referenced(self):
+        """Objects that are still referred to cannot be removed."""
+        individual = self.universe.lookup("Individual", "#foot")
+        self.assertRaises(StorageException, self.universe.del_object, 
+            individual)
+        
+        self.reopen()
+        self.assertEqual(self.universe.count_objects("Individual"), 3)
+        self.assertEqual(len(self.universe.get_objects("Declaration")), 3)
+
+    def test_head_cardinality(self):
+        """Head cardinality counts referring objects that are not loaded."""
+        self.universe._storage.close()
+        self.universe = OwlUniverse(storage=SQLiteStorage(self.filename, 
+            cache_size=0))
+        individual = self.universe.lookup("Individual", "#foot")
+        gc.collect()
+        self.assertRaises(SchemaException, constructs.Declaration, individual)
+        
+        def declare():
+            with self.universe.batch():
+                constructs.Declaration(individual)
+        self.assertRaises(BatchException, declare)
+        self.assertEqual(self.universe.count_objects("Declaration"), 3)
+
+    def test_missing_object(self):
+        """References to objects missing from the database are reported."""
+        self.universe.flush()
+        self.universe._storage._db.execute('DELETE FROM objects WHERE oid IN '
+            '(SELECT a_entity FROM c_Declaration)')
+        self.universe._storage._db.commit()
+        
+        self.reopen()
+        declaration = self.universe.get_objects("Declaration")[0]
+        self.assertRaises(StorageException, getattr, declaration, 'entity')
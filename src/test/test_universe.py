@@ -0,0 +1,622 @@
+"""
+:Copyright: |copy| 2008 by Adrian Hare and Kenneth Barber.
+
+.. |copy| unicode:: 0xA9 .. copyright sign
+
+:license: 
+    This file is part of OWLSugar.
+
+    OWLSugar is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    OWLSugar is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+:Version: $Rev$
+
+Tests on the universe.
+
+"""
+
+__docformat__ = 'restructuredtext en'
+__version__ = '$Rev$'
+
+import gc
+from unittest import TestCase
+
+from owlsugar import OwlUniverse
+from owlsugar.exceptions import BatchException, SchemaException
+import owlsugar.constructs as constructs
+
+
+class UniverseObjects(TestCase):
+    """Tests related to the object repository of the universe."""
+
+    #------------------------------------------------------------------ Fixture
+    def setUp(self):
+        """Create a universe with a couple of individuals."""
+        self.universe = OwlUniverse()
+        self.individuals = [constructs.Individual(
+            entityURI=constructs.URI(uri=i)) for i in ("#foot", "#shin")]
+        self.owlclass = constructs.OWLClass(
+            entityURI=constructs.URI(uri="#Leg"))
+
+    def tearDown(self):
+        """Reset the universe."""
+        self.universe = None
+
+    #------------------------------------------------------- Success test cases
+    def test_get_objects(self):
+        """Objects are returned for their own class."""
+        self.assertEqual(set(self.universe.get_objects("Individual")), 
+            set(self.individuals))
+        self.assertEqual(len(self.universe.get_objects("URI")), 3)
+
+    def test_get_objects_children(self):
+        """Objects of child classes are returned for the parent class."""
+        self.assertEqual(set(self.universe.get_objects("OWLEntity")), 
+            set(self.individuals + [self.owlclass]))
+
+    def test_del_object(self):
+        """Objects can be removed from the universe."""
+        self.universe.del_object(self.owlclass)
+        self.assertEqual(set(self.universe.get_objects("OWLEntity")), 
+            set(self.individuals))
+        self.assertRaises(Exception, self.universe.del_object, self.owlclass)
+
+    def test_count_objects(self):
+        """Counts include the objects of child classes."""
+        self.assertEqual(self.universe.count_objects("Individual"), 2)
+        self.assertEqual(self.universe.count_objects("OWLEntity"), 3)
+        self.assertEqual(self.universe.count_objects("Axiom"), 0)
+
+    def test_iter_objects(self):
+        """Objects can be iterated over without building a list."""
+        objects = self.universe.iter_objects("OWLEntity")
+        self.assertFalse(isinstance(objects, list))
+        self.assertEqual(set(objects), set(self.individuals + [self.owlclass]))
+
+    def test_view_objects(self):
+        """Views follow objects added after they were created."""
+        view = self.universe.view_objects("OWLEntity")
+        self.assertEqual(len(view), 3)
+        self.assertTrue(self.owlclass in view)
+        
+        individual = constructs.Individual(constructs.URI("#knee"))
+        self.assertEqual(len(view), 4)
+        self.assertTrue(individual in view)
+
+
+class WeakUniverse(TestCase):
+    """Tests related to universes that only hold weak references."""
+
+    #------------------------------------------------------------------ Fixture
+    def setUp(self):
+        """Create a weak universe."""
+        self.universe = OwlUniverse(weak=True)
+
+    def tearDown(self):
+        """Reset the universe."""
+        self.universe = None
+
+    #------------------------------------------------------- Success test cases
+    def test_discarded_objects(self):
+        """Objects that are no longer used disappear from the universe."""
+        individual = constructs.Individual(constructs.URI("#foot"))
+        constructs.Individual(constructs.URI("#shin"))
+        gc.collect()
+        self.assertEqual(self.universe.get_objects("Individual"), 
+            [individual])
+        
+        # The URI is kept alive by the individual that refers to it
+        self.assertEqual(self.universe.get_objects("URI"), 
+            [individual.entityURI])
+
+    def test_weak_references(self):
+        """Reverse references do not keep the referencing object alive."""
+        uri = constructs.URI("#foot")
+        individual = constructs.Individual(uri)
+        self.assertEqual(list(uri.ref_objects('Individual')), [individual])
+        
+        individual = None
+        gc.collect()
+        self.assertEqual(list(uri.ref_objects('Individual')), [])
+        self.assertEqual(self.universe.get_objects("Individual"), [])
+
+
+    def test_discarded_keys(self):
+        """Primary keys of discarded objects leave the index."""
+        for i in range(100):
+            constructs.Individual(constructs.URI("#%s" % i))
+        gc.collect()
+        self.assertEqual(len(self.universe._keys.get("Individual", {})), 0)
+        self.assertEqual(len(self.universe._keys.get("URI", {})), 0)
+
+    def test_discarded_rekeyed(self):
+        """Objects whose primary key changed drop their latest key."""
+        individual = constructs.Individual(constructs.URI("#foot"))
+        for i in range(10):
+            individual.entityURI = constructs.URI("#%s" % i)
+        self.assertEqual(list(self.universe._keys["Individual"]), ["#9"])
+        individual = None
+        gc.collect()
+        self.assertEqual(len(self.universe._keys.get("Individual", {})), 0)
+
+
+class InternedUniverse(TestCase):
+    """Tests related to universes that intern terminal constructs."""
+
+    #------------------------------------------------------------------ Fixture
+    def setUp(self):
+        """Create an interning universe."""
+        self.universe = OwlUniverse(intern=True)
+
+    def tearDown(self):
+        """Reset the universe."""
+        self.universe = None
+
+    #------------------------------------------------------- Success test cases
+    def test_shared_uri(self):
+        """Equal URIs are the same object."""
+        self.assertTrue(self.universe.is_interning())
+        self.assertIs(constructs.URI("#foot"), constructs.URI("#foot"))
+        self.assertIsNot(constructs.URI("#foot"), constructs.URI("#shin"))
+        self.assertEqual(len(self.universe.get_objects("URI")), 2)
+
+    def test_positional_and_named(self):
+        """Positional and named arguments intern to the same object."""
+        namespace = constructs.Namespace("foo", "http://bob.sh/#")
+        self.assertIs(constructs.Namespace(prefix="foo", 
+            IRI="http://bob.sh/#"), namespace)
+
+    def test_shared_annotation_uri(self):
+        """Labels share a single rdf:label URI."""
+        first = constructs.Label("foot")
+        second = constructs.Label("shin")
+        self.assertIs(first.annotationURI, second.annotationURI)
+
+    def test_same_label(self):
+        """Labels with the same text have constants of their own."""
+        first = constructs.Label("foot")
+        second = constructs.Label("foot")
+        self.assertIsNot(first.annotationValue, second.annotationValue)
+        self.assertIs(first.annotationURI, second.annotationURI)
+
+    def test_bulk(self):
+        """Bulk construction reuses interned objects."""
+        uri = constructs.URI("#foot")
+        uris = constructs.URI.bulk([("#foot", ), ("#shin", ), ("#shin", )])
+        self.assertIs(uris[0], uri)
+        self.assertIs(uris[1], uris[2])
+
+    def test_changed_interned(self):
+        """Interned objects move to the key of their new values."""
+        uri = constructs.URI("#foot")
+        uri.uri = "#shin"
+        self.assertIs(constructs.URI("#shin"), uri)
+        self.assertIsNot(constructs.URI("#foot"), uri)
+
+    def test_discarded_interned(self):
+        """Unused interned objects leave the intern table."""
+        OwlUniverse(weak=True, intern=True)
+        constructs.URI("#foot")
+        gc.collect()
+        self.assertEqual(len(OwlUniverse.get_universe()._intern), 0)
+
+    def test_not_interning(self):
+        """Without interning equal URIs are distinct objects."""
+        OwlUniverse()
+        self.assertIsNot(constructs.URI("#foot"), constructs.URI("#foot"))
+
+    #------------------------------------------------------- Failure test cases
+    def test_failed_not_interned(self):
+        """Objects that fail to build are not interned."""
+        for i in range(2):
+            self.assertRaises(SchemaException, constructs.Namespace, "foo", 5)
+        self.assertEqual(len(self.universe._intern), 0)
+        self.assertRaises(SchemaException, constructs.URI.bulk, 
+            [("#foot", ), (5, )])
+        self.assertEqual(len(self.universe._intern), 0)
+
+
+class PrimaryKeys(TestCase):
+    """Tests related to primary key lookups in the universe."""
+
+    #------------------------------------------------------------------ Fixture
+    def setUp(self):
+        """Create a universe with a couple of individuals."""
+        self.universe = OwlUniverse()
+        self.foot = constructs.Individual(constructs.URI("#foot"))
+        self.shin = constructs.Individual(entityURI=constructs.URI("#shin"))
+
+    def tearDown(self):
+        """Reset the universe."""
+        self.universe = None
+
+    #------------------------------------------------------- Success test cases
+    def test_lookup(self):
+        """Objects are found by their primary key."""
+        self.assertIs(self.universe.lookup("Individual", "#foot"), self.foot)
+        self.assertIs(self.universe.lookup("OWLEntity", "#shin"), self.shin)
+        self.assertIs(self.universe.lookup("URI", "#foot"), 
+            self.foot.entityURI)
+        self.assertEqual(self.universe.lookup("Individual", "#knee"), None)
+        self.assertEqual(self.universe.lookup("OWLClass", "#foot"), None)
+
+    def test_lookup_construct(self):
+        """Constructs can be used as the key."""
+        self.assertIs(self.universe.lookup("Individual", 
+            constructs.URI("#foot")), self.foot)
+
+    def test_setter(self):
+        """Changing the primary association moves the object."""
+        self.foot.entityURI = constructs.URI("#knee")
+        self.assertEqual(self.universe.lookup("Individual", "#foot"), None)
+        self.assertIs(self.universe.lookup("Individual", "#knee"), self.foot)
+
+    def test_referenced_key(self):
+        """Changing a URI moves the objects keyed through it."""
+        self.shin.entityURI.uri = "#knee"
+        self.assertEqual(self.universe.lookup("Individual", "#shin"), None)
+        self.assertIs(self.universe.lookup("Individual", "#knee"), self.shin)
+
+    def test_lookup_all(self):
+        """Keys shared by several objects return all of them."""
+        labels = [constructs.Label("foot"), constructs.Label("shin")]
+        self.assertEqual(self.universe.lookup_all("Annotation", "rdf:label"),
+            labels)
+
+    def test_del_object(self):
+        """Removed objects can no longer be found."""
+        self.universe.del_object(self.foot)
+        self.assertEqual(self.universe.lookup("Individual", "#foot"), None)
+
+    def test_bulk(self):
+        """Objects created in bulk are indexed."""
+        uris = constructs.URI.bulk([("#knee", ), ("#ankle", )])
+        self.assertIs(self.universe.lookup("URI", "#ankle"), uris[1])
+
+
+class ContextUniverses(TestCase):
+    """Tests related to using several universes at once."""
+
+    #------------------------------------------------------------------ Fixture
+    def setUp(self):
+        """Create a default universe."""
+        self.universe = OwlUniverse()
+
+    def tearDown(self):
+        """Reset the universe."""
+        self.universe = None
+
+    #------------------------------------------------------- Success test cases
+    def test_activate(self):
+        """Activated universes are current only inside the block."""
+        other = OwlUniverse(default=False)
+        self.assertIs(OwlUniverse.get_universe(), self.universe)
+        with other.activate() as active:
+            self.assertIs(active, other)
+            self.assertIs(OwlUniverse.get_universe(), other)
+            individual = constructs.Individual(constructs.URI("#foot"))
+        self.assertIs(OwlUniverse.get_universe(), self.universe)
+        
+        self.assertIs(individual.universe(), other)
+        self.assertEqual(other.get_objects("Individual"), [individual])
+        self.assertEqual(self.universe.get_objects("Individual"), [])
+
+    def test_threads(self):
+        """Threads can build in their own universes at the same time."""
+        import threading
+        
+        universes = [OwlUniverse(default=False) for i in range(4)]
+        barrier = threading.Barrier(len(universes))
+        
+        def build(universe, count):
+            with universe.activate():
+                barrier.wait()
+                for i in range(count):
+                    constructs.Individual(constructs.URI("#%s" % i))
+        
+        threads = [threading.Thread(target=build, 
+            args=(universe, 10 * (n + 1))) for n, universe in 
+            enumerate(universes)]
+        for i in threads:
+            i.start()
+        for i in threads:
+            i.join()
+        
+        self.assertEqual([i.count_objects("Individual") for i in universes], 
+            [10, 20, 30, 40])
+        self.assertEqual(self.universe.count_objects("Individual"), 0)
+
+
+class ThreadSafeUniverse(TestCase):
+    """Tests related to building one universe from several threads."""
+
+    #------------------------------------------------------------------ Fixture
+    def setUp(self):
+        """Create a thread-safe universe."""
+        self.universe = OwlUniverse(threadsafe=True)
+
+    def tearDown(self):
+        """Reset the universe."""
+        self.universe = None
+
+    #------------------------------------------------------- Success test cases
+    def test_threads(self):
+        """Objects and references added from many threads are all kept."""
+        import threading
+        
+        uri = constructs.URI("#shared")
+        barrier = threading.Barrier(8)
+        
+        def build(n):
+            with self.universe.activate():
+                barrier.wait()
+                for i in range(200):
+                    constructs.Individual(constructs.URI("#%s-%s" % (n, i)))
+                    constructs.AnnotationByConstant(annotationURI=uri,
+                        annotationValue=constructs.Constant("x", uri))
+        
+        threads = [threading.Thread(target=build, args=(n, )) 
+            for n in range(8)]
+        for i in threads:
+            i.start()
+        for i in threads:
+            i.join()
+        
+        self.assertEqual(self.universe.count_objects("Individual"), 1600)
+        self.assertEqual(len(self.universe.get_objects("Individual")), 1600)
+        self.assertEqual(len(uri.ref_objects("AnnotationByConstant")), 1600)
+        self.assertIs(self.universe.lookup("Individual", "#7-199").universe(),
+            self.universe)
+
+    def test_interning(self):
+        """Threads building equal terminals all get the same, complete one."""
+        import threading
+        
+        universe = OwlUniverse(threadsafe=True, intern=True)
+        barrier = threading.Barrier(8)
+        results = [[] for n in range(8)]
+        
+        def build(n):
+            with universe.activate():
+                barrier.wait()
+                for i in range(200):
+                    results[n].append(constructs.URI("#%s" % i))
+        
+        threads = [threading.Thread(target=build, args=(n, )) 
+            for n in range(8)]
+        for i in threads:
+            i.start()
+        for i in threads:
+            i.join()
+        
+        for n in range(1, 8):
+            for first, other in zip(results[0], results[n]):
+                self.assertIs(first, other)
+        self.assertEqual([i.uri for i in results[0]], 
+            ["#%s" % i for i in range(200)])
+        self.assertEqual(universe.count_objects("URI"), 200)
+
+
+class UniverseEvents(TestCase):
+    """Tests related to mutation events."""
+
+    #------------------------------------------------------------------ Fixture
+    def setUp(self):
+        """Create a universe, and subscribe to it."""
+        self.universe = OwlUniverse()
+        self.deliveries = []
+        self.universe.subscribe(self.deliveries.append)
+
+    def tearDown(self):
+        """Reset the universe."""
+        self.universe = None
+
+    def kinds(self):
+        """The kinds of event delivered so far, per delivery."""
+        return [[i.kind for i in n] for n in self.deliveries]
+
+    #------------------------------------------------------- Success test cases
+    def test_added_removed(self):
+        """Adding and removing objects fire events."""
+        uri = constructs.URI("#foot")
+        self.universe.del_object(uri)
+        self.assertEqual(self.kinds(), [['added'], ['removed']])
+        self.assertIs(self.deliveries[0][0].obj, uri)
+
+    def test_set(self):
+        """Setting an association fires an event with the old value."""
+        uri = constructs.URI("#foot")
+        individual = constructs.Individual(uri)
+        individual.entityURI = constructs.URI("#shin")
+        
+        event = self.deliveries[-1][0]
+        self.assertEqual(self.kinds(), [['added'], ['added'], ['added'], 
+            ['set']])
+        self.assertEqual((event.obj, event.association, event.old), 
+            (individual, 'entityURI', uri))
+        self.assertEqual(event.value.uri, "#shin")
+
+    def test_appended(self):
+        """Appending to a list fires an event."""
+        ontology = constructs.Ontology(axioms=[])
+        declaration = constructs.Declaration(constructs.Individual(
+            constructs.URI("#foot")))
+        ontology.axioms.append(declaration)
+        
+        event = self.deliveries[-1][0]
+        self.assertEqual((event.kind, event.obj, event.association, 
+            event.value), ('appended', ontology, 'axioms', declaration))
+
+    def test_unregistered_list(self):
+        """Changing the lists of objects not in the universe is silent."""
+        ontology = constructs.Ontology(axioms=[])
+        self.universe.del_object(ontology)
+        count = len(self.deliveries)
+        ontology.axioms.append(constructs.Declaration(constructs.Individual(
+            constructs.URI("#foot"))))
+        ontology.axioms.sort(key=id)
+        self.assertEqual([i.obj.id() for n in self.deliveries[count:] 
+            for i in n], ["URI", "Individual", "Declaration"])
+
+    def test_bulk_batched(self):
+        """Bulk operations deliver their events together."""
+        constructs.URI.bulk([("#foot", ), ("#shin", ), ("#knee", )])
+        self.assertEqual(self.kinds(), [['added'] * 3])
+        
+        with self.universe.batch_events():
+            constructs.URI("#hip")
+            constructs.Label("hip")
+            self.assertEqual(len(self.deliveries), 1)
+        self.assertEqual(len(self.deliveries), 2)
+        self.assertEqual(set(self.kinds()[1]), set(['added']))
+        self.assertEqual(self.deliveries[1][-1].obj.id(), 
+            "AnnotationByConstant")
+
+    def test_kinds(self):
+        """Subscribers can ask for some kinds of event only."""
+        removed = []
+        self.universe.subscribe(removed.append, kinds=['removed'])
+        uri = constructs.URI("#foot")
+        self.universe.del_object(uri)
+        self.assertEqual([[i.kind for i in n] for n in removed], 
+            [['removed']])
+
+    def test_unsubscribe(self):
+        """Unsubscribed callbacks are no longer called."""
+        self.universe.unsubscribe(self.deliveries.append)
+        self.assertEqual(self.universe._observers, None)
+        constructs.URI("#foot")
+        self.assertEqual(self.deliveries, [])
+
+
+class UniverseBatches(TestCase):
+    """Tests related to batches of changes."""
+
+    #------------------------------------------------------------------ Fixture
+    def setUp(self):
+        """Create a universe with an ontology declaring an individual."""
+        self.universe = OwlUniverse()
+        self.foot = constructs.Individual(constructs.URI("#foot"))
+        self.declaration = constructs.Declaration(self.foot)
+        self.ontology = constructs.Ontology(axioms=[self.declaration])
+
+    def tearDown(self):
+        """Reset the universe."""
+        self.universe = None
+
+    #------------------------------------------------------- Success test cases
+    def test_commit(self):
+        """New objects and references appear at the end of the batch."""
+        with self.universe.batch():
+            shin = constructs.Individual(constructs.URI("#shin"))
+            declaration = constructs.Declaration(shin)
+            self.ontology.axioms.append(declaration)
+            self.assertEqual(self.universe.lookup("Individual", "#shin"), 
+                None)
+            self.assertEqual(len(shin.ref_objects('Declaration')), 0)
+        
+        self.assertIs(self.universe.lookup("Individual", "#shin"), shin)
+        self.assertEqual(list(shin.ref_objects('Declaration')), 
+            [declaration])
+        self.assertEqual(list(declaration.ref_objects('Ontology')), 
+            [self.ontology])
+
+    def test_rollback(self):
+        """An exception in the block undoes the batch."""
+        try:
+            with self.universe.batch():
+                shin = constructs.Individual(constructs.URI("#shin"))
+                self.ontology.axioms.append(constructs.Declaration(shin))
+                self.foot.entityURI = constructs.URI("#knee")
+                raise ValueError()
+        except ValueError:
+            pass
+        
+        self.assertEqual(list(self.ontology.axioms), [self.declaration])
+        self.assertEqual(self.foot.entityURI.uri, "#foot")
+        self.assertIs(self.universe.lookup("Individual", "#foot"), self.foot)
+        self.assertEqual(self.universe.lookup("Individual", "#shin"), None)
+        self.assertEqual(len(self.universe.get_objects("Declaration")), 1)
+
+    def test_explicit_rollback(self):
+        """A batch can be rolled back without an exception."""
+        with self.universe.batch() as batch:
+            self.ontology.axioms = []
+            batch.rollback()
+        self.assertEqual(list(self.ontology.axioms), [self.declaration])
+        self.assertEqual(list(self.declaration.ref_objects('Ontology')), 
+            [self.ontology])
+
+    def test_labels(self):
+        """Batches accept what construction outside a batch accepts."""
+        with self.universe.batch():
+            label = constructs.Label("foot")
+        self.assertIn(label, self.universe.get_objects("Annotation"))
+
+    def test_events(self):
+        """Events are delivered together, and only if the batch commits."""
+        deliveries = []
+        self.universe.subscribe(deliveries.append)
+        with self.universe.batch() as batch:
+            constructs.URI("#shin")
+            batch.rollback()
+        self.assertEqual(deliveries, [])
+        
+        with self.universe.batch():
+            constructs.URI("#shin")
+            self.foot.entityURI = constructs.URI("#knee")
+        self.assertEqual(len(deliveries), 1)
+        self.assertEqual(sorted([i.kind for i in deliveries[0]]), 
+            ['added', 'added', 'set'])
+
+    #------------------------------------------------------- Failure test cases
+    def test_violations(self):
+        """Every violation is reported, and the batch is undone."""
+        shin = constructs.Individual(constructs.URI("#shin"))
+        try:
+            with self.universe.batch():
+                constructs.Declaration(self.foot)
+                constructs.Declaration(shin)
+                constructs.Declaration(shin)
+                self.ontology.axioms.append(constructs.Declaration())
+        except BatchException as e:
+            self.assertEqual(len(e.errors), 2)
+        else:
+            self.fail("BatchException not raised")
+        
+        self.assertEqual(len(self.universe.get_objects("Declaration")), 1)
+        self.assertEqual(list(self.foot.ref_objects('Declaration')), 
+            [self.declaration])
+        self.assertEqual(len(shin.ref_objects('Declaration')), 0)
+        self.assertEqual(list(self.ontology.axioms), [self.declaration])
+
+    def test_rollback_append(self):
+        """A rolled back append leaves the list as it was."""
+        declaration = constructs.Declaration(constructs.Individual(
+            constructs.URI("#shin")))
+        with self.universe.batch() as batch:
+            self.ontology.axioms.append(declaration)
+            batch.rollback()
+        
+        self.assertNotIn(declaration, self.ontology.axioms)
+        self.ontology.axioms.append(declaration)
+        self.assertEqual(list(self.ontology.axioms), 
+            [self.declaration, declaration])
+
+    def test_rollback_remove(self):
+        """A rolled back removal leaves the list as it was."""
+        with self.universe.batch() as batch:
+            self.ontology.axioms.remove(self.declaration)
+            batch.rollback()
+        
+        self.assertIn(self.declaration, self.ontology.axioms)
+        self.ontology.axioms.remove(self.declaration)
+        self.assertEqual(list(self.ontology.axioms), [])
+        self.assertEqual(len(self.declaration.ref_objects('Ontology')), 0)